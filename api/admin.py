@@ -25,6 +25,10 @@ class UserAdmin(admin.ModelAdmin):
 
 # حماية إدارة الكتب: فقط admin
 class BookAdmin(admin.ModelAdmin):
+    def get_queryset(self, request):
+        # Book.__str__ lists the authors, prefetch them for the changelist
+        return super().get_queryset(request).with_related()
+
     def has_add_permission(self, request):
         return request.user.role.lower() == 'admin'
 
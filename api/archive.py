@@ -0,0 +1,90 @@
+"""
+Archival of closed orders out of the hot `orders` / `order_items` tables.
+
+Orders that are delivered or cancelled and older than the cutoff are moved,
+lines included, into orders_archive / order_items_archive (ArchivedOrder,
+ArchivedOrderItem) by manage.py archive_orders, in batches of one
+transaction each: INSERT .. SELECT into the archive, then DELETE from the hot
+tables. The rows are moved with plain SQL, not the ORM, so no signal fires:
+the sales counters keep counting archived lines (api/sales.py reads both
+sides when it rebuilds) and stock is not touched.
+
+On PostgreSQL the archive tables are range-partitioned by order_date with one
+partition per year, created here before a batch needs it; old years can then
+be detached or dropped as whole tables. The hot tables stay plainly keyed by
+order_id (a partitioned table needs the partition key in every unique
+constraint, which order_id and the order_items foreign key don't allow);
+they just stay small, and so does their order_date index.
+
+The recent-order endpoints read the hot tables only; history reads the
+archive (OrderView ?archived=true, the detail views fall back to it, and
+the order export merges both).
+"""
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import ArchivedOrder, ArchivedOrderItem, Order, OrderItem
+
+CLOSED = ('delivered', 'cancelled')
+BATCH_SIZE = 1000
+
+
+def ensure_partitions(years):
+    """Yearly partitions of the archive tables for `years` (PostgreSQL only)"""
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        for table in (ArchivedOrder._meta.db_table, ArchivedOrderItem._meta.db_table):
+            for year in sorted(years):
+                cursor.execute(
+                    f'CREATE TABLE IF NOT EXISTS {table}_{year} PARTITION OF {table} '
+                    f"FOR VALUES FROM ('{year}-01-01 00:00:00+00') TO ('{year + 1}-01-01 00:00:00+00')"
+                )
+
+
+def move(order_ids):
+    """Copy the orders and their lines to the archive, then delete them; call inside a transaction"""
+    orders, items = Order._meta.db_table, OrderItem._meta.db_table
+    ids = ', '.join(['%s'] * len(order_ids))
+    archived_at = connection.ops.adapt_datetimefield_value(timezone.now())
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {ArchivedOrder._meta.db_table} '
+            f'(order_id, user_id, order_date, total_price, status, archived_at) '
+            f'SELECT order_id, user_id, order_date, total_price, status, %s FROM {orders} '
+            f'WHERE order_id IN ({ids})',
+            [archived_at, *order_ids],
+        )
+        cursor.execute(
+            f'INSERT INTO {ArchivedOrderItem._meta.db_table} '
+            f'(order_item_id, order_id, book_id, order_date, quantity, price) '
+            f'SELECT i.order_item_id, i.order_id, i.book_id, o.order_date, i.quantity, i.price '
+            f'FROM {items} i JOIN {orders} o ON o.order_id = i.order_id WHERE i.order_id IN ({ids})',
+            order_ids,
+        )
+        cursor.execute(f'DELETE FROM {items} WHERE order_id IN ({ids})', order_ids)
+        cursor.execute(f'DELETE FROM {orders} WHERE order_id IN ({ids})', order_ids)
+
+
+def archive_orders(before, statuses=CLOSED, batch_size=BATCH_SIZE, progress=None):
+    """
+    Move the orders in `statuses` placed before `before` to the archive;
+    returns how many. `progress(archived)` is called after every batch
+    """
+    archived = 0
+    while True:
+        with transaction.atomic():
+            # skip_locked: an order being updated right now waits for the next run
+            batch = list(
+                Order.objects.filter(status__in=statuses, order_date__lt=before)
+                .order_by('order_id').select_for_update(skip_locked=True)
+                .values_list('order_id', 'order_date')[:batch_size]
+            )
+            if batch:
+                ensure_partitions({order_date.year for _, order_date in batch})
+                move([order_id for order_id, _ in batch])
+        archived += len(batch)
+        if batch and progress:
+            progress(archived)
+        if len(batch) < batch_size:
+            return archived
@@ -0,0 +1,109 @@
+"""
+Async (ASGI) versions of the read-heavy catalog endpoints, mounted under async/.
+
+They return the same JSON as the DRF views (same serializers, ?fields= /
+?omit=, book filters and keyset pages, conditional GET and response cache)
+but load rows through Django's async ORM, so under library/asgi.py a
+worker keeps serving other requests while one waits on the database or on
+a slow client. The rows are fully
+loaded (prefetches included) before serialization, which then runs without
+touching the database.
+
+Django still runs the ORM calls of one process in a single thread, so the
+gain is in concurrent connections per worker, not in parallel queries.
+"""
+from django.http import Http404, HttpResponse
+from django.shortcuts import aget_object_or_404
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
+
+from . import filters
+from .cache import acache_response
+from .conditional import aconditional_detail, aconditional_list
+from .models import Authors, Book, Category, Review
+from .pagination import KeysetPagination, project_list, wants_pagination
+from .renderers import ORJSONRenderer
+from .serializers import AuthorsSerializer, BookListSerializer, BookSerializer, CategorySerializer, ReviewSerializer
+from .sparse import project, sparse_context
+
+MAX_REVIEWS = 500
+
+
+def json_response(data, status=200):
+    return HttpResponse(ORJSONRenderer().render(data), status=status, content_type='application/json')
+
+
+async def serialize_list(queryset, serializer_class, context, limit=None):
+    # a list of instances, not the queryset: the values fast path would query synchronously
+    queryset = project(queryset, serializer_class, context)
+    rows = [row async for row in queryset[:limit]]
+    return serializer_class(rows, many=True, context=context).data
+
+
+async def serialize_object(queryset, serializer_class, context, pk):
+    try:
+        instance = await aget_object_or_404(project(queryset, serializer_class, context), pk=pk)
+    except Http404 as e:
+        return json_response({'detail': str(e)}, status=404)
+    return json_response(serializer_class(instance, context=context).data)
+
+
+@aconditional_list(Category, 'categories')
+@acache_response('categories')
+async def category_list(request):
+    context = sparse_context(request)
+    return json_response(await serialize_list(Category.objects.all(), CategorySerializer, context))
+
+
+@aconditional_list(Authors, 'authors')
+@acache_response('authors')
+async def authors_list(request):
+    context = sparse_context(request)
+    return json_response(await serialize_list(Authors.objects.all(), AuthorsSerializer, context))
+
+
+# same filters, ?sort= and opt-in keyset pages as BookView (api/filters.py, api/pagination.py)
+@aconditional_list(Book, 'books')
+@acache_response('books')
+async def book_list(request):
+    try:
+        books, ordering = filters.filter_books(Book.objects.with_related(), request.GET)
+    except ValueError as e:
+        return json_response({'error': str(e)}, status=400)
+    books = books.order_by(*ordering)
+    context = sparse_context(request)
+    # the paginator reads request.query_params
+    request = Request(request)
+    if not wants_pagination(request):
+        return json_response(await serialize_list(books, BookListSerializer, context))
+    paginator = KeysetPagination()
+    paginator.ordering = ordering
+    try:
+        page = await paginator.apaginate_queryset(project_list(books, BookListSerializer, context, ordering), request)
+    except NotFound as e:
+        return json_response({'detail': e.detail}, status=404)
+    data = BookListSerializer(page, many=True, context=context).data
+    return json_response(paginator.get_paginated_response(data).data)
+
+
+@aconditional_detail(Book, 'book')
+@acache_response('book', detail=True)
+async def book_detail(request, pk):
+    return await serialize_object(Book.objects.with_related(), BookSerializer, sparse_context(request), pk)
+
+
+# GET ?limit=<n>, newest first; cached with the book, every review write bumps it
+@acache_response('book', detail=True)
+async def book_reviews(request, pk):
+    try:
+        limit = int(request.GET.get('limit', 50))
+    except ValueError:
+        return json_response({'error': 'limit must be an integer'}, status=400)
+    if limit < 1:
+        return json_response({'error': 'limit must be at least 1'}, status=400)
+    limit = min(limit, MAX_REVIEWS)
+    if not await Book.objects.filter(pk=pk).aexists():
+        return json_response({'detail': 'No Book matches the given query.'}, status=404)
+    context = sparse_context(request)
+    reviews = Review.objects.filter(book_id=pk).order_by('-review_id')
+    return json_response(await serialize_list(reviews, ReviewSerializer, context, limit))
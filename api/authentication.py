@@ -0,0 +1,94 @@
+"""
+JWT authentication that trusts the signed claims for read-only requests.
+
+Access tokens minted by CustomLoginView carry `user_id`, `email` and `role`.
+For GET/HEAD/OPTIONS the request user is a ClaimsUser built from those claims,
+so authentication and role checks cost no query; `request.user.instance`
+loads the User row only when a view actually needs it. Unsafe methods get
+the real User, checked for is_active as simplejwt does.
+
+User rows are kept in a small per-process cache for JWT_USER_CACHE_TTL
+seconds. Saving or deleting a user drops its entry in this process
+(api/signals.py); other processes pick the change up when the TTL expires.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.functional import cached_property
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from .models import User
+
+_users = OrderedDict()
+_users_lock = threading.Lock()
+
+
+def cached_user(pk):
+    """The User with this pk (or None), at most JWT_USER_CACHE_TTL seconds old"""
+    now = time.monotonic()
+    with _users_lock:
+        entry = _users.get(pk)
+        if entry and entry[0] > now:
+            _users.move_to_end(pk)
+            # every request gets its own copy, views may modify the user they are given
+            return copy.copy(entry[1])
+    user = User.objects.filter(pk=pk).first()
+    with _users_lock:
+        _users[pk] = (now + getattr(settings, 'JWT_USER_CACHE_TTL', 30), user)
+        _users.move_to_end(pk)
+        while len(_users) > getattr(settings, 'JWT_USER_CACHE_SIZE', 10000):
+            _users.popitem(last=False)
+    return copy.copy(user)
+
+
+def forget_user(pk):
+    with _users_lock:
+        _users.pop(pk, None)
+
+
+class ClaimsUser(TokenUser):
+    """Request user backed by the token claims (id, email, role); the row is loaded on demand"""
+
+    @cached_property
+    def instance(self):
+        return cached_user(self.id)
+
+    def __str__(self):
+        return f'ClaimsUser {self.id} ({self.email})'
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+
+    def authenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+
+        # tokens minted before the role claim existed fall back to the database
+        if request.method in SAFE_METHODS and 'role' in validated_token:
+            return ClaimsUser(validated_token), validated_token
+        return self.get_user(validated_token), validated_token
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[jwt_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('Token contained no recognizable user identification')
+
+        user = cached_user(user_id)
+        if user is None:
+            raise AuthenticationFailed('User not found', code='user_not_found')
+        if not user.is_active:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+        return user
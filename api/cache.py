@@ -0,0 +1,117 @@
+"""
+Response cache for the catalog read endpoints (categories, authors, books).
+
+Responses are stored in the CATALOG_CACHE_ALIAS cache under keys that embed
+version counters: one per list ("books") and one per object ("book:42").
+Writes never delete responses, they bump the counters (api/signals.py), so every
+key a stale response could be found under stops being generated at once and
+the dead entries age out of the cache through its LRU eviction (MAX_ENTRIES).
+
+Version counters start from the current time in nanoseconds rather than 1,
+so a counter that was evicted and re-created can never collide with the
+version of a response that is still cached.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.response import Response
+
+GLOBAL = 'all'
+
+
+def get_cache():
+    return caches[getattr(settings, 'CATALOG_CACHE_ALIAS', 'catalog')]
+
+
+def version_key(namespace, pk=None):
+    return f'catalog:v:{namespace}' if pk is None else f'catalog:v:{namespace}:{pk}'
+
+
+def get_versions(keys):
+    cache = get_cache()
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump(namespace, pks=None):
+    """Invalidate a whole list (no pks) or the given objects of `namespace`"""
+    cache = get_cache()
+    keys = [version_key(namespace)] if pks is None else [version_key(namespace, pk) for pk in pks]
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), timeout=None)
+
+
+def invalidate_books(book_ids):
+    """A book's payload changed: drop its detail and every book list"""
+    bump('book', book_ids)
+    bump('books')
+
+
+def invalidate_all():
+    """Drop every cached catalog response (bulk loads, rebuild commands)"""
+    bump(GLOBAL)
+
+
+def response_key(request, version_keys, kind='r'):
+    """Key of what `request` gets under the current versions; `kind` keeps responses and validators apart"""
+    versions = get_versions([version_key(GLOBAL)] + version_keys)
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return 'catalog:{}:{}:{}'.format(kind, path, ':'.join(str(v) for v in versions))
+
+
+def cache_response(namespace, detail=False, also=(), timeout=DEFAULT_TIMEOUT):
+    """
+    Cache successful GET responses of a catalog view
+    `namespace` is the version counter the response depends on: the list
+    counter for list views, the object counter (pk from the URL) for detail views;
+    `also` names further list counters, `timeout` bounds data no counter tracks
+    """
+    def decorator(get):
+        @wraps(get)
+        def wrapper(view, request, *args, **kwargs):
+            key = response_key(request, [version_key(namespace, kwargs['pk'] if detail else None)]
+                               + [version_key(name) for name in also])
+            cache = get_cache()
+            data = cache.get(key)
+            if data is not None:
+                return Response(data)
+            response = get(view, request, *args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                cache.set(key, response.data, timeout)
+            return response
+        return wrapper
+    return decorator
+
+
+def acache_response(namespace, detail=False):
+    """
+    cache_response() for async function views (api/async_views.py)
+    The rendered body is cached, so a hit skips serialization and rendering.
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            key = response_key(request, [version_key(namespace, kwargs['pk'] if detail else None)])
+            cache = get_cache()
+            content = await cache.aget(key)
+            if content is not None:
+                return HttpResponse(content, content_type='application/json')
+            response = await view(request, *args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                await cache.aset(key, response.content)
+            return response
+        return wrapper
+    return decorator
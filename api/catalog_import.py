@@ -0,0 +1,374 @@
+"""
+Streaming catalog import: books with their authors and category from CSV, JSON or ONIX.
+
+Records are read one at a time (csv.DictReader, an incremental JSON array
+decoder, ElementTree.iterparse for ONIX) and written in batches, so memory
+stays bounded by the batch size and the name -> id maps of categories and
+authors. Per batch:
+- categories are upserted by name and authors matched by name, new ones
+  bulk-created;
+- books are upserted by ISBN in one INSERT .. ON CONFLICT;
+- the Book.authors links of those books are written straight into the
+  through table, replacing the previous links of re-imported books;
+- the search index is refreshed for those books and the catalog cache bumped.
+bulk_create skips Book.save() and the signals, hence the explicit steps;
+cover derivatives are left to manage.py build_image_derivatives.
+"""
+import csv
+import datetime
+import json
+import re
+import xml.etree.ElementTree as ET
+from collections import Counter, defaultdict
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.db import transaction
+from django.utils.dateparse import parse_date
+
+from . import cache, search
+from .models import Authors, Book, Category
+
+FORMATS = ('csv', 'json', 'onix')
+EXTENSIONS = {'.csv': 'csv', '.json': 'json', '.ndjson': 'json', '.jsonl': 'json', '.xml': 'onix', '.onix': 'onix'}
+CONFLICT_POLICIES = ('update', 'skip')
+
+# input key -> record key
+ALIASES = {'ISBN': 'isbn', 'book_cover_photo': 'cover', 'category_name': 'category'}
+AUTHOR_SEPARATORS = re.compile(r'\s*[;|]\s*')
+# optional record keys: a record without them leaves the stored value alone on update
+OPTIONAL_FIELDS = {'description': 'description', 'cover': 'book_cover_photo',
+                   'category': 'category', 'availability': 'availability'}
+ALWAYS_UPDATED = ['title', 'price', 'publication_date', 'updated_at']
+AVAILABLE_CODES = {'20', '21', '22', '23', 'IP'}  # ONIX ProductAvailability / AvailabilityCode
+MAX_ERRORS = 20
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+######################################################################################
+# readers: each yields one dict per book
+
+def read_csv(f):
+    """Header row with isbn,title,authors,category,... ; several authors separated by ; or |"""
+    for row in csv.DictReader(f):
+        yield {key.strip(): value for key, value in row.items() if key}
+
+
+def iter_json_array(f, chunk_size=1 << 16):
+    """Yield the items of a top-level JSON array without loading the whole document"""
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = '', 0, False
+
+    def fill():
+        nonlocal buffer, pos, eof
+        chunk = f.read(chunk_size)
+        eof = not chunk
+        buffer, pos = buffer[pos:] + chunk, 0
+
+    def skip(chars):
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in chars:
+                pos += 1
+            if pos < len(buffer) or eof:
+                return
+            fill()
+
+    fill()
+    skip(' \t\r\n')
+    if buffer[pos:pos + 1] != '[':
+        raise ValueError('expected a JSON array')
+    pos += 1
+    while True:
+        skip(' \t\r\n,')
+        if pos >= len(buffer):
+            raise ValueError('unterminated JSON array')
+        if buffer[pos] == ']':
+            return
+        while True:
+            try:
+                item, pos = decoder.raw_decode(buffer, pos)
+                break
+            except json.JSONDecodeError:
+                # the item continues in the next chunk
+                if eof:
+                    raise
+                fill()
+        yield item
+
+
+def read_json(f):
+    """A JSON array of book objects, or NDJSON (one object per line)"""
+    first = f.read(1)
+    while first.isspace():
+        first = f.read(1)
+    f.seek(0)
+    if first == '[':
+        yield from iter_json_array(f)
+        return
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+
+def local(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def descendants(element, name):
+    return [child for child in element.iter() if local(child.tag) == name]
+
+
+def child_text(element, name):
+    for child in element:
+        if local(child.tag) == name:
+            return (child.text or '').strip()
+    return ''
+
+
+def onix_record(product):
+    """Book fields from an ONIX 3.0 (or 2.1 reference tag) <Product>"""
+    record = {'authors': []}
+    for identifier in descendants(product, 'ProductIdentifier'):
+        if child_text(identifier, 'ProductIDType') in ('15', '03'):
+            record['isbn'] = child_text(identifier, 'IDValue')
+            break
+    for title in descendants(product, 'TitleElement') + descendants(product, 'Title'):
+        text = child_text(title, 'TitleText') or ' '.join(
+            filter(None, (child_text(title, 'TitlePrefix'), child_text(title, 'TitleWithoutPrefix'))))
+        if text:
+            record['title'] = text
+            break
+    for contributor in descendants(product, 'Contributor'):
+        if child_text(contributor, 'ContributorRole').startswith('A'):
+            name = child_text(contributor, 'PersonName') or ' '.join(
+                filter(None, (child_text(contributor, 'NamesBeforeKey'), child_text(contributor, 'KeyNames'))))
+            if name:
+                record['authors'].append(name)
+    for subject in descendants(product, 'Subject'):
+        if child_text(subject, 'SubjectHeadingText'):
+            record['category'] = child_text(subject, 'SubjectHeadingText')
+            break
+    for text in descendants(product, 'TextContent') + descendants(product, 'OtherText'):
+        if (child_text(text, 'TextType') or child_text(text, 'TextTypeCode')) in ('01', '02', '03'):
+            record['description'] = child_text(text, 'Text')
+            break
+    for date in descendants(product, 'PublishingDate'):
+        if child_text(date, 'PublishingDateRole') in ('01', ''):
+            record['publication_date'] = child_text(date, 'Date')
+            break
+    else:
+        for date in descendants(product, 'PublicationDate'):
+            record['publication_date'] = (date.text or '').strip()
+            break
+    for price in descendants(product, 'PriceAmount'):
+        record['price'] = (price.text or '').strip()
+        break
+    for name in ('ProductAvailability', 'AvailabilityCode'):
+        for code in descendants(product, name):
+            record['availability'] = 'in_stock' if (code.text or '').strip() in AVAILABLE_CODES else 'out_of_stock'
+            break
+    return record
+
+
+def read_onix(f):
+    root = None
+    for event, element in ET.iterparse(f, events=('start', 'end')):
+        if root is None:
+            root = element
+        if event == 'end' and local(element.tag) == 'Product':
+            yield onix_record(element)
+            # drop the parsed products, the tree would otherwise grow with the file
+            root.clear()
+
+
+READERS = {'csv': read_csv, 'json': read_json, 'onix': read_onix}
+
+
+######################################################################################
+# validation
+
+def clean_date(value):
+    value = str(value or '').strip()
+    if re.fullmatch(r'\d{8}', value):
+        value = f'{value[:4]}-{value[4:6]}-{value[6:]}'
+    elif re.fullmatch(r'\d{4}', value):
+        value = f'{value}-01-01'
+    try:
+        day = parse_date(value)
+    except ValueError:
+        day = None
+    if day is None:
+        raise ValueError(f'invalid publication_date: {value!r}')
+    return day
+
+
+def clean_price(value):
+    try:
+        price = Decimal(str(value).strip()).quantize(Decimal('0.01'))
+    except (InvalidOperation, ValueError):
+        raise ValueError(f'invalid price: {value!r}')
+    if not Decimal('0.01') <= price < Decimal('100000000'):
+        raise ValueError(f'price out of range: {value!r}')
+    return price
+
+
+def clean(record):
+    """Normalized book record, or ValueError with the reason it can't be imported"""
+    if not isinstance(record, dict):
+        raise ValueError('not an object')
+    record = {ALIASES.get(key, key): value for key, value in record.items()}
+    isbn = re.sub(r'[\s-]', '', str(record.get('isbn') or ''))
+    if not isbn or len(isbn) > 13:
+        raise ValueError(f'invalid isbn: {record.get("isbn")!r}')
+    title = str(record.get('title') or '').strip()
+    if not title or len(title) > Book._meta.get_field('title').max_length:
+        raise ValueError(f'{isbn}: title is missing or too long')
+
+    authors = record.get('authors') or []
+    if isinstance(authors, str):
+        authors = AUTHOR_SEPARATORS.split(authors)
+    authors = list(dict.fromkeys(name.strip() for name in authors if name and name.strip()))
+    if any(len(name) > 255 for name in authors):
+        raise ValueError(f'{isbn}: author name too long')
+
+    cleaned = {
+        'isbn': isbn,
+        'title': title,
+        'authors': authors,
+        'price': clean_price(record.get('price')),
+        'publication_date': clean_date(record.get('publication_date')),
+    }
+    if record.get('category'):
+        cleaned['category'] = str(record['category']).strip()[:255]
+    if record.get('description') is not None:
+        cleaned['description'] = str(record['description'])
+    if record.get('cover'):
+        cleaned['cover'] = str(record['cover']).strip()
+    if record.get('availability'):
+        if record['availability'] not in dict(Book.AVAILABILITY_CHOICES):
+            raise ValueError(f'{isbn}: invalid availability {record["availability"]!r}')
+        cleaned['availability'] = record['availability']
+    return cleaned
+
+
+######################################################################################
+# import
+
+class CatalogImporter:
+    """Upsert cleaned records in batches; `stats` counts read/created/updated/skipped/invalid"""
+
+    def __init__(self, on_conflict='update', batch_size=2000):
+        if on_conflict not in CONFLICT_POLICIES:
+            raise ValueError('on_conflict must be update or skip')
+        self.on_conflict = on_conflict
+        self.batch_size = batch_size
+        self.category_ids = {}
+        self.author_ids = {}
+        self.stats = Counter(read=0, created=0, updated=0, skipped=0, invalid=0)
+        self.errors = []
+
+    def run(self, records, progress=None):
+        for batch in batched(records, self.batch_size):
+            rows = []
+            for record in batch:
+                self.stats['read'] += 1
+                try:
+                    rows.append(clean(record))
+                except ValueError as e:
+                    self.stats['invalid'] += 1
+                    if len(self.errors) < MAX_ERRORS:
+                        self.errors.append(f'record {self.stats["read"]}: {e}')
+            with transaction.atomic():
+                self.import_batch(rows)
+            if progress:
+                progress(self.stats)
+        return self.stats
+
+    def resolve(self, model, field, known, names):
+        """name -> pk for `names`, creating the missing rows; `known` caches the answers"""
+        missing = [name for name in names if name not in known]
+        if missing:
+            # with duplicate names the oldest row wins
+            for name, pk in model.objects.filter(**{f'{field}__in': missing}).order_by('-pk').values_list(field, 'pk'):
+                known[name] = pk
+            new = [name for name in missing if name not in known]
+            if new:
+                model.objects.bulk_create([model(**{field: name}) for name in new], ignore_conflicts=True)
+                known.update(model.objects.filter(**{f'{field}__in': new}).values_list(field, 'pk'))
+        return known
+
+    def import_batch(self, rows):
+        rows = list({row['isbn']: row for row in rows}.values())  # the last record of an ISBN wins
+        stock = dict(Book.objects.filter(ISBN__in=[row['isbn'] for row in rows]).values_list('ISBN', 'stock'))
+        existing = set(stock)
+        # availability follows tracked stock (api/inventory.py), the feed's is only taken for the others
+        rows = [{key: value for key, value in row.items() if key != 'availability'}
+                if stock.get(row['isbn']) is not None else row for row in rows]
+        if self.on_conflict == 'skip':
+            self.stats['skipped'] += len(existing)
+            rows = [row for row in rows if row['isbn'] not in existing]
+        if not rows:
+            return
+
+        categories = self.resolve(Category, 'category_name', self.category_ids,
+                                  {row['category'] for row in rows if 'category' in row})
+        authors = self.resolve(Authors, 'author_name', self.author_ids,
+                               {name for row in rows for name in row['authors']})
+
+        # one upsert per combination of optional fields present, so a missing
+        # optional field doesn't overwrite what is stored
+        groups = defaultdict(list)
+        for row in rows:
+            groups[tuple(key for key in OPTIONAL_FIELDS if key in row)].append(row)
+        for present, group in groups.items():
+            books = [Book(
+                ISBN=row['isbn'], title=row['title'], price=row['price'],
+                publication_date=row['publication_date'],
+                description=row.get('description', ''),
+                book_cover_photo=row.get('cover', ''),
+                category_id=categories.get(row.get('category')),
+                availability=row.get('availability', 'in_stock'),
+            ) for row in group]
+            Book.objects.bulk_create(
+                books, update_conflicts=True, unique_fields=['ISBN'],
+                update_fields=ALWAYS_UPDATED + [OPTIONAL_FIELDS[key] for key in present],
+            )
+
+        book_ids = dict(Book.objects.filter(ISBN__in=[row['isbn'] for row in rows]).values_list('ISBN', 'pk'))
+        through = Book.authors.through
+        relinked = [book_ids[row['isbn']] for row in rows if row['authors'] and row['isbn'] in existing]
+        through.objects.filter(book_id__in=relinked).delete()
+        through.objects.bulk_create([
+            through(book_id=book_ids[row['isbn']], authors_id=authors[name])
+            for row in rows for name in row['authors']
+        ], ignore_conflicts=True)
+
+        search.reindex_books(book_ids.values())
+        transaction.on_commit(cache.invalidate_all)
+        self.stats['created'] += len(rows) - len(existing & book_ids.keys())
+        self.stats['updated'] += len(existing & book_ids.keys())
+
+
+def detect_format(path):
+    for extension, fmt in EXTENSIONS.items():
+        if path.lower().endswith(extension):
+            return fmt
+    return None
+
+
+def import_catalog(path, fmt=None, on_conflict='update', batch_size=2000, progress=None):
+    """Import the catalog file at `path`; returns the CatalogImporter (stats, errors)"""
+    fmt = fmt or detect_format(path)
+    if fmt not in READERS:
+        raise ValueError(f'unknown format, use one of: {", ".join(FORMATS)}')
+    importer = CatalogImporter(on_conflict=on_conflict, batch_size=batch_size)
+    mode = 'rb' if fmt == 'onix' else 'r'
+    with open(path, mode, **({} if mode == 'rb' else {'encoding': 'utf-8-sig', 'newline': ''})) as f:
+        importer.run(READERS[fmt](f), progress=progress)
+    return importer
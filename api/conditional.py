@@ -0,0 +1,140 @@
+"""
+Conditional GET (ETag / Last-Modified / 304) for the catalog endpoints.
+
+Validators come from one cheap query against `updated_at`, so a matching
+If-None-Match / If-Modified-Since is answered with 304 before the view runs
+any serialization. Code that changes a book's payload without Book.save()
+bumps Book.updated_at (BookQuerySet.touch, api/signals.py) to keep them exact.
+
+The validators are cached next to the responses (api/cache.py), under the
+same version counters: a write bumps the counter and the next request runs
+the query again, every other request (304 or cached 200) costs no query.
+"""
+import hashlib
+from functools import wraps
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.decorators import method_decorator
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import condition
+
+from . import cache
+
+
+LIST_STATS = {'count': Count('pk'), 'last': Max('updated_at')}
+
+
+def list_etag(model, request, stats):
+    last = stats['last'].timestamp() if stats['last'] else 0
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()[:16]
+    return f"{model._meta.model_name}s-{stats['count']}-{last}-{path}"
+
+
+def detail_etag(model, pk, last):
+    return f'{model._meta.model_name}-{pk}-{last.timestamp()}' if last else None
+
+
+def validators_key(request, namespace, pk=None):
+    return cache.response_key(request, [cache.version_key(namespace, pk)], kind='v')
+
+
+def cached_validators(namespace, compute, detail=False):
+    """
+    (etag, last_modified) from compute(request, *args, **kwargs), cached under
+    the `namespace` version counter (the object's with detail=True), loaded
+    once per request since condition() asks for each validator separately
+    """
+    def validators(request, *args, **kwargs):
+        if not hasattr(request, '_validators'):
+            key = validators_key(request, namespace, kwargs['pk'] if detail else None)
+            found = cache.get_cache().get(key)
+            if found is None:
+                found = compute(request, *args, **kwargs)
+                cache.get_cache().set(key, found)
+            request._validators = found
+        return request._validators
+    return validators
+
+
+def conditional_list(model, namespace):
+    """
+    ETag for a list endpoint, derived from COUNT(*) and MAX(updated_at) of `model`
+    The count catches deletions; the full path is part of the tag because the
+    query string (pagination, filters) selects a different representation.
+    No Last-Modified here: a deletion does not move MAX(updated_at), so
+    If-Modified-Since alone could not detect it. `namespace` is the list's
+    version counter in api/cache.py.
+    """
+    def compute(request, *args, **kwargs):
+        return list_etag(model, request, model.objects.order_by().aggregate(**LIST_STATS)), None
+
+    validators = cached_validators(namespace, compute)
+    return method_decorator(condition(etag_func=lambda *args, **kwargs: validators(*args, **kwargs)[0]))
+
+
+def conditional_detail(model, namespace):
+    """ETag and Last-Modified for a detail endpoint, from the object's updated_at"""
+    def compute(request, pk):
+        last = model.objects.filter(pk=pk).values_list('updated_at', flat=True).first()
+        return detail_etag(model, pk, last), last
+
+    validators = cached_validators(namespace, compute, detail=True)
+    return method_decorator(condition(
+        etag_func=lambda request, pk: validators(request, pk=pk)[0],
+        last_modified_func=lambda request, pk: validators(request, pk=pk)[1],
+    ))
+
+
+def async_condition(validators):
+    """
+    condition() for async function views whose validators need the database
+    `validators(request, *args, **kwargs)` is a coroutine returning (etag, last_modified).
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            etag, last_modified = await validators(request, *args, **kwargs)
+            etag = quote_etag(etag) if etag else None
+            last_modified = int(last_modified.timestamp()) if last_modified else None
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = await view(request, *args, **kwargs)
+            if request.method in ('GET', 'HEAD'):
+                if last_modified and not response.has_header('Last-Modified'):
+                    response.headers['Last-Modified'] = http_date(last_modified)
+                if etag:
+                    response.headers.setdefault('ETag', etag)
+            return response
+        return wrapper
+    return decorator
+
+
+def acached_validators(namespace, compute, detail=False):
+    """cached_validators() for a coroutine `compute`"""
+    async def validators(request, *args, **kwargs):
+        key = validators_key(request, namespace, kwargs['pk'] if detail else None)
+        found = await cache.get_cache().aget(key)
+        if found is None:
+            found = await compute(request, *args, **kwargs)
+            await cache.get_cache().aset(key, found)
+        return found
+    return validators
+
+
+def aconditional_list(model, namespace):
+    """conditional_list() for async views"""
+    async def compute(request, *args, **kwargs):
+        stats = await model.objects.order_by().aaggregate(**LIST_STATS)
+        return list_etag(model, request, stats), None
+
+    return async_condition(acached_validators(namespace, compute))
+
+
+def aconditional_detail(model, namespace):
+    """conditional_detail() for async views"""
+    async def compute(request, pk):
+        last = await model.objects.filter(pk=pk).values_list('updated_at', flat=True).afirst()
+        return detail_etag(model, pk, last), last
+
+    return async_condition(acached_validators(namespace, compute, detail=True))
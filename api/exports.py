@@ -0,0 +1,149 @@
+"""
+Streaming export of order lines (Order joined with OrderItem and Book) as NDJSON or CSV,
+archived orders included.
+
+Rows come straight from a values_list() query read with QuerySet.iterator(),
+so no model instances are built and memory stays flat whatever the row count
+(server-side cursor on PostgreSQL, chunked fetches elsewhere).
+
+Under ASGI, StreamingHttpResponse reads a sync iterator with
+sync_to_async(list), the whole export in memory before the first byte, so
+stream() hands it an async iterator there instead (astream()).
+"""
+import csv
+import datetime
+import heapq
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import ArchivedOrderItem, Order, OrderItem
+
+FORMATS = ('ndjson', 'csv')
+CHUNK_SIZE = 2000
+# rendered lines per ASGI body message
+STREAM_LINES = 500
+
+# output column -> OrderItem lookup
+COLUMNS = (
+    ('order_id', 'order_id'),
+    ('user_id', 'order__user_id'),
+    ('order_date', 'order__order_date'),
+    ('status', 'order__status'),
+    ('order_total', 'order__total_price'),
+    ('order_item_id', 'order_item_id'),
+    ('book_id', 'book_id'),
+    ('isbn', 'book__ISBN'),
+    ('title', 'book__title'),
+    ('quantity', 'quantity'),
+    ('price', 'price'),
+)
+HEADER = [name for name, _ in COLUMNS] + ['line_total']
+
+
+def parse_bound(value, end=False):
+    """ISO date or datetime -> aware datetime; a plain `end` date includes that whole day"""
+    if not value:
+        return None
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f'invalid date: {value}')
+        moment = datetime.datetime.combine(day + datetime.timedelta(days=end), datetime.time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def parse_statuses(value):
+    if not value:
+        return None
+    statuses = [item.strip() for item in value.split(',') if item.strip()]
+    valid = {choice for choice, _ in Order.STATUS_CHOICES}
+    unknown = set(statuses) - valid
+    if unknown:
+        raise ValueError(f"unknown status: {', '.join(sorted(unknown))}")
+    return statuses
+
+
+def item_rows(items, order_date, date_from=None, date_to=None, statuses=None):
+    if date_from:
+        items = items.filter(**{f'{order_date}__gte': date_from})
+    if date_to:
+        items = items.filter(**{f'{order_date}__lt': date_to})
+    if statuses:
+        items = items.filter(order__status__in=statuses)
+    rows = items.order_by(order_date, 'order_id', 'order_item_id').values_list(
+        *[lookup for _, lookup in COLUMNS]
+    )
+    return rows.iterator(chunk_size=CHUNK_SIZE)
+
+
+def order_lines(date_from=None, date_to=None, statuses=None):
+    """Yield one tuple per order item, oldest order first, in HEADER order, archived orders included"""
+    filters = {'date_from': date_from, 'date_to': date_to, 'statuses': statuses}
+    # both sides come sorted by (order_date, order_id, order_item_id): merging them keeps memory flat.
+    # Archived lines filter on their own copy of order_date, the partition key (api/archive.py)
+    rows = heapq.merge(
+        item_rows(OrderItem.objects.all(), 'order__order_date', **filters),
+        item_rows(ArchivedOrderItem.objects.all(), 'order_date', **filters),
+        key=lambda row: (row[2], row[0], row[5]),
+    )
+    for row in rows:
+        quantity, price = row[-2], row[-1]
+        yield row + (quantity * price,)
+
+
+class Echo:
+    """File-like object whose write() hands the line back, for csv.writer"""
+
+    def write(self, value):
+        return value
+
+
+def render_ndjson(lines):
+    encoder = DjangoJSONEncoder()
+    for line in lines:
+        yield encoder.encode(dict(zip(HEADER, line))) + '\n'
+
+
+def render_csv(lines):
+    writer = csv.writer(Echo())
+    yield writer.writerow(HEADER)
+    for line in lines:
+        yield writer.writerow(line)
+
+
+RENDERERS = {
+    'ndjson': (render_ndjson, 'application/x-ndjson'),
+    'csv': (render_csv, 'text/csv'),
+}
+
+
+def astream(chunks):
+    """
+    Async iterator over the sync iterator `chunks`, STREAM_LINES at a time
+    Each batch is read in Django's sync thread (thread sensitive, like the ORM
+    calls of the view), the one that owns the export query's connection.
+    """
+    read = sync_to_async(lambda: ''.join(islice(chunks, STREAM_LINES)))
+
+    async def batches():
+        while True:
+            batch = await read()
+            if not batch:
+                return
+            yield batch
+    return batches()
+
+
+def stream(request, chunks):
+    """`chunks` for a StreamingHttpResponse to `request`: async under ASGI, as they are under WSGI"""
+    if isinstance(getattr(request, '_request', request), ASGIRequest):
+        return astream(chunks)
+    return chunks
@@ -0,0 +1,159 @@
+"""
+Values fast path for read-only list serializers.
+
+ValuesListSerializer renders a QuerySet from values_list() rows instead of
+model instances: no instance is built, each column goes through one converter
+chosen up front (prices are formatted directly instead of quantized per row),
+and every to-many field costs one values_list() query, like a prefetch.
+The output is the same as the regular ListSerializer's. When a field can't be
+mapped to a column (methods, properties, dotted sources, FK serializers) or
+the data isn't a QuerySet (a page, a list of instances) it falls back to it.
+
+Opt in with Meta.list_serializer_class = ValuesListSerializer.
+"""
+from collections import defaultdict
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+from rest_framework import relations, serializers
+from rest_framework.settings import api_settings
+
+
+def model_field_for(model, field):
+    """The model field a serializer field reads, or None if it isn't a plain field/relation"""
+    if field.source == '*' or '.' in field.source:
+        return None
+    try:
+        return model._meta.get_field(field.source)
+    except FieldDoesNotExist:
+        return None
+
+
+def back_lookup(model_field):
+    """Lookup from the related model back to the owner of a to-many `model_field`"""
+    if model_field.concrete:
+        return model_field.related_query_name()
+    return model_field.field.name
+
+
+def column_converter(field, model_field):
+    """Callable turning a raw column value into field's representation, or None"""
+    if isinstance(field, relations.PrimaryKeyRelatedField):
+        # values_list() already gives the id of a foreign key
+        return (lambda value: value) if field.pk_field is None else None
+    if isinstance(field, (relations.RelatedField, serializers.BaseSerializer)):
+        return None
+    if isinstance(field, serializers.DecimalField):
+        coerce = getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)
+        if not coerce or field.localize or field.normalize_output or field.decimal_places is None:
+            return field.to_representation
+        # stored values never have more places than the column, no rounding needed
+        spec = f'.{field.decimal_places}f'
+        return lambda value: format(value, spec)
+    if isinstance(field, serializers.FileField):
+        use_url = getattr(field, 'use_url', api_settings.UPLOADED_FILES_USE_URL)
+        storage = model_field.storage
+        request = field.context.get('request')
+
+        def file_url(name):
+            if not name:
+                return None
+            if not use_url:
+                return name
+            url = storage.url(name)
+            return request.build_absolute_uri(url) if request is not None else url
+        return file_url
+    return field.to_representation
+
+
+class Plan:
+    """How to render `model` rows for the readable fields of a serializer"""
+
+    def __init__(self, model, fields, loaders):
+        self.model = model
+        self.fields = fields  # [(name, lookup, converter)], lookup is None for to-many fields
+        self.loaders = loaders  # {name: loader}, loader(pks) -> {pk: [representation]}
+
+    @classmethod
+    def build(cls, model, serializer):
+        fields, loaders = [], {}
+        for field in serializer._readable_fields:
+            model_field = model_field_for(model, field)
+            if model_field is None:
+                return None
+            if model_field.many_to_many or model_field.one_to_many:
+                loader = cls.related_loader(model_field, field)
+                if loader is None:
+                    return None
+                fields.append((field.field_name, None, None))
+                loaders[field.field_name] = loader
+            elif model_field.concrete:
+                convert = column_converter(field, model_field)
+                if convert is None:
+                    return None
+                fields.append((field.field_name, model_field.name, convert))
+            else:
+                return None
+        return cls(model, fields, loaders)
+
+    @classmethod
+    def related_loader(cls, model_field, field):
+        related_model, back = model_field.related_model, back_lookup(model_field)
+
+        def queryset(pks):
+            return related_model._default_manager.filter(**{f'{back}__in': pks})
+
+        if isinstance(field, relations.ManyRelatedField):
+            child = field.child_relation
+            if not isinstance(child, relations.PrimaryKeyRelatedField) or child.pk_field is not None:
+                return None
+
+            def load_pks(pks):
+                grouped = defaultdict(list)
+                for owner, pk in queryset(pks).values_list(back, 'pk'):
+                    grouped[owner].append(pk)
+                return grouped
+            return load_pks
+
+        if isinstance(field, serializers.ListSerializer):
+            plan = cls.build(related_model, field.child)
+            if plan is None:
+                return None
+
+            def load_nested(pks):
+                grouped = defaultdict(list)
+                for owner, item in plan.rows(queryset(pks), owner=back):
+                    grouped[owner].append(item)
+                return grouped
+            return load_nested
+        return None
+
+    def rows(self, queryset, owner=None):
+        """Yield (owner, representation) per row; owner is the value of the `owner` lookup, if given"""
+        head = [owner, 'pk'] if owner else ['pk']
+        lookups = [lookup for _, lookup, _ in self.fields if lookup]
+        rows = list(queryset.values_list(*head, *lookups))
+        pk_at = len(head) - 1
+        pks = [row[pk_at] for row in rows]
+        related = {name: load(pks) for name, load in self.loaders.items()} if pks else {}
+        for row in rows:
+            values = iter(row[len(head):])
+            item = {}
+            for name, lookup, convert in self.fields:
+                if lookup is None:
+                    item[name] = related[name].get(row[pk_at], [])
+                else:
+                    value = next(values)
+                    item[name] = None if value is None else convert(value)
+            yield (row[0] if owner else None), item
+
+
+class ValuesListSerializer(serializers.ListSerializer):
+
+    def to_representation(self, data):
+        if isinstance(data, models.QuerySet):
+            plan = Plan.build(data.model, self.child)
+            if plan is not None:
+                queryset = data.select_related(None).prefetch_related(None)
+                return [item for _, item in plan.rows(queryset)]
+        return super().to_representation(data)
@@ -0,0 +1,95 @@
+"""
+Filters and sort order of the book listing (BookView).
+
+GET books/?category=<id,...>&author=<id,...>&availability=in_stock|out_of_stock
+          &price_min=<n>&price_max=<n>&rating_min=<n>
+          &published_after=<date>&published_before=<date>
+          &sort=newest|price|-price|rating
+
+Every sort is a keyset ordering (api/pagination.py) ending in book_id; the
+cursor holds both columns, so books that tie on price or rating (every
+unrated book) page by book_id. The common filter + sort pairs have a
+composite index in Book.Meta.indexes (books_<filter>_<sort>_idx): equality
+column first, then the sort columns, so a page is a range scan of one index
+instead of a filter plus a sort.
+"""
+from decimal import Decimal, InvalidOperation
+
+from django.utils.dateparse import parse_date
+
+from .models import Book
+
+SORTS = {
+    'newest': ('-created_at', '-book_id'),
+    'price': ('price', 'book_id'),
+    '-price': ('-price', '-book_id'),
+    'rating': ('-avg_rating', '-book_id'),
+}
+DEFAULT_SORT = 'newest'
+
+
+def parse_ids(params, name):
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        return [int(item) for item in value.split(',') if item.strip()]
+    except ValueError:
+        raise ValueError(f'{name} must be a comma separated list of ids')
+
+
+def parse_decimal(params, name):
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        number = Decimal(value)
+    except InvalidOperation:
+        raise ValueError(f'{name} must be a number')
+    if not number.is_finite():
+        raise ValueError(f'{name} must be a number')
+    return number
+
+
+def parse_day(params, name):
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        day = parse_date(value)
+    except ValueError:
+        day = None
+    if day is None:
+        raise ValueError(f'{name} must be a date (YYYY-MM-DD)')
+    return day
+
+
+def filter_books(queryset, params):
+    """`queryset` narrowed by the filters in `params`, and the keyset ordering to list it in"""
+    sort = params.get('sort', DEFAULT_SORT)
+    if sort not in SORTS:
+        raise ValueError(f'sort must be one of {", ".join(SORTS)}')
+
+    categories = parse_ids(params, 'category')
+    if categories is not None:
+        queryset = queryset.filter(category_id__in=categories)
+    authors = parse_ids(params, 'author')
+    if authors is not None:
+        # a subquery rather than a join, so books with several matching authors come once
+        through = Book.authors.through.objects.filter(authors_id__in=authors)
+        queryset = queryset.filter(pk__in=through.values('book_id'))
+    availability = params.get('availability')
+    if availability:
+        if availability not in dict(Book.AVAILABILITY_CHOICES):
+            raise ValueError('availability must be in_stock or out_of_stock')
+        queryset = queryset.filter(availability=availability)
+
+    lookups = {
+        'price__gte': parse_decimal(params, 'price_min'),
+        'price__lte': parse_decimal(params, 'price_max'),
+        'avg_rating__gte': parse_decimal(params, 'rating_min'),
+        'publication_date__gte': parse_day(params, 'published_after'),
+        'publication_date__lte': parse_day(params, 'published_before'),
+    }
+    queryset = queryset.filter(**{lookup: value for lookup, value in lookups.items() if value is not None})
+    return queryset, SORTS[sort]
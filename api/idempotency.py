@@ -0,0 +1,110 @@
+"""
+Idempotency-Key support for the write endpoints (orders, checkout, reviews...).
+
+A client that may retry a POST sends a unique Idempotency-Key header with it.
+The first request with a key inserts its IdempotencyKey row, runs the view
+and stores the response in the same transaction; a retry finds the row and
+gets the stored response back (Idempotent-Replayed: true) without the view
+running again. The unique (key, scope) index is the lock: a duplicate sent
+while the first request is still running blocks on the INSERT until that
+transaction ends, then replays its response - or, if it rolled back, runs
+itself. No polling, no extra lock table.
+
+5xx responses and exceptions roll the whole request back, key included, so
+a retry after a server error executes again. Reusing a key for a different
+payload is refused with 422. Keys expire after IDEMPOTENCY_KEY_SECONDS and
+are purged by manage.py purge_idempotency_keys.
+"""
+import datetime
+import hashlib
+import json
+from functools import wraps
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+PURGE_BATCH_SIZE = 1000
+
+
+def request_scope(request):
+    # request.user is already resolved here: DRF authenticates before calling the handler
+    return f'{request.user.pk or "-"}:{request.method}:{request.path}'[:MAX_KEY_LENGTH]
+
+
+def request_fingerprint(request):
+    data = request.data
+    if hasattr(data, 'lists'):
+        data = dict(data.lists())
+    payload = json.dumps([request.get_full_path(), data], sort_keys=True, cls=DjangoJSONEncoder)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def replay(record, fingerprint):
+    if record.fingerprint != fingerprint:
+        return Response({'error': f'{HEADER} was already used for a different request'},
+                        status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    return Response(record.response, status=record.status_code, headers={'Idempotent-Replayed': 'true'})
+
+
+def idempotent(post):
+    """
+    Store the response of a write view sent with an Idempotency-Key header
+    and replay it for retries of the same request; requests without the
+    header are left alone
+    """
+    @wraps(post)
+    def wrapper(view, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None:
+            return post(view, request, *args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return Response({'error': f'{HEADER} must be 1 to {MAX_KEY_LENGTH} characters'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        scope, fingerprint = request_scope(request), request_fingerprint(request)
+        ttl = datetime.timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_SECONDS', 86400))
+
+        # a second round when the row found was expired, or gone once its request rolled back
+        for _ in range(2):
+            claimed = False
+            try:
+                with transaction.atomic():
+                    record = IdempotencyKey.objects.create(key=key, scope=scope, fingerprint=fingerprint,
+                                                           expires_at=timezone.now() + ttl)
+                    claimed = True
+                    response = post(view, request, *args, **kwargs)
+                    if response.status_code >= 500:
+                        transaction.set_rollback(True)
+                        return response
+                    record.status_code, record.response = response.status_code, response.data
+                    record.save(update_fields=['status_code', 'response'])
+                    return response
+            except IntegrityError:
+                if claimed:
+                    raise
+            record = IdempotencyKey.objects.filter(key=key, scope=scope).first()
+            if record is not None:
+                if not record.is_expired:
+                    return replay(record, fingerprint)
+                record.delete()
+        return Response({'error': f'A request with this {HEADER} is in progress, retry later'},
+                        status=status.HTTP_409_CONFLICT)
+    return wrapper
+
+
+def purge_expired():
+    """Delete the expired keys; returns how many"""
+    purged = 0
+    while True:
+        ids = list(IdempotencyKey.objects.filter(expires_at__lte=timezone.now())
+                   .values_list('pk', flat=True)[:PURGE_BATCH_SIZE])
+        if not ids:
+            return purged
+        purged += IdempotencyKey.objects.filter(pk__in=ids).delete()[0]
@@ -0,0 +1,154 @@
+"""
+Resized WebP/AVIF derivatives of book covers and author photos.
+
+After an upload, the source image is resized to each width in IMAGE_DERIVATIVE_SIZES
+and encoded in each format of IMAGE_DERIVATIVE_FORMATS that this Pillow build supports.
+The work runs in a small thread pool once the upload's transaction has committed.
+The resulting storage names are recorded on the row (Book.cover_derivatives /
+Authors.photo_derivatives) so serializers can emit URLs without touching storage.
+IMAGE_DERIVATIVES = False turns the whole thing off.
+"""
+import io
+import logging
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.db.models.functions import Now
+from PIL import Image, ImageOps, features
+
+from . import cache
+from .models import Authors, Book
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIZES = {'thumb': 120, 'small': 240, 'medium': 480}
+DEFAULT_FORMATS = ['avif', 'webp']
+ENCODER_OPTIONS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'avif': {'format': 'AVIF', 'quality': 60},
+}
+
+# model -> (image field, derivatives field)
+IMAGE_FIELDS = {
+    Book: ('book_cover_photo', 'cover_derivatives'),
+    Authors: ('author_photo', 'photo_derivatives'),
+}
+
+_executor = None
+
+
+def derivative_sizes():
+    return getattr(settings, 'IMAGE_DERIVATIVE_SIZES', DEFAULT_SIZES)
+
+
+def derivative_formats():
+    formats = getattr(settings, 'IMAGE_DERIVATIVE_FORMATS', DEFAULT_FORMATS)
+    return [fmt for fmt in formats if features.check(fmt)]
+
+
+def derivative_name(source, size, fmt):
+    """covers/arw.jpg -> covers/derivatives/arw/thumb.webp"""
+    directory, filename = posixpath.split(source)
+    stem = posixpath.splitext(filename)[0]
+    return posixpath.join(directory, 'derivatives', stem, f'{size}.{fmt}')
+
+
+def build_derivatives(source):
+    """
+    Render every size/format of `source` into storage
+    Returns {'source': source, size: {format: storage name}}
+    """
+    sizes = derivative_sizes()
+    formats = derivative_formats()
+    with default_storage.open(source, 'rb') as f:
+        image = Image.open(f)
+        # let the JPEG decoder downscale while decoding, we never need more than the largest size
+        largest = max(sizes.values())
+        image.draft('RGB', (largest, largest * image.height // max(image.width, 1)))
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+
+    derivatives = {'source': source}
+    for size, width in sizes.items():
+        width = min(width, image.width)
+        height = max(1, round(image.height * width / image.width))
+        resized = image.resize((width, height), Image.Resampling.LANCZOS)
+        derivatives[size] = {}
+        for fmt in formats:
+            buffer = io.BytesIO()
+            resized.save(buffer, **ENCODER_OPTIONS[fmt])
+            name = derivative_name(source, size, fmt)
+            if default_storage.exists(name):
+                default_storage.delete(name)
+            derivatives[size][fmt] = default_storage.save(name, ContentFile(buffer.getvalue()))
+    return derivatives
+
+
+def process(model, pk, source):
+    """Build derivatives for one row and record them, unless the image changed meanwhile"""
+    image_field, derivatives_field = IMAGE_FIELDS[model]
+    try:
+        derivatives = build_derivatives(source)
+        model.objects.filter(pk=pk, **{image_field: source}).update(**{derivatives_field: derivatives}, updated_at=Now())
+        invalidate_images(model, pk)
+    except Exception:
+        logger.exception('Could not build image derivatives for %s %s (%s)', model.__name__, pk, source)
+    finally:
+        close_old_connections()
+
+
+def invalidate_images(model, pk):
+    # derivative URLs are part of the cached book / author payloads
+    if model is Book:
+        cache.invalidate_books([pk])
+    else:
+        Book.objects.filter(authors=pk).touch()
+        cache.bump('authors')
+        cache.bump('books')
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'IMAGE_DERIVATIVE_WORKERS', 2),
+            thread_name_prefix='image-derivatives',
+        )
+    return _executor
+
+
+def needs_derivatives(instance):
+    if not getattr(settings, 'IMAGE_DERIVATIVES', True):
+        return False
+    image_field, derivatives_field = IMAGE_FIELDS[type(instance)]
+    source = getattr(instance, image_field).name
+    return bool(source) and getattr(instance, derivatives_field).get('source') != source
+
+
+def schedule(instance):
+    """Queue derivative generation for `instance` after the current transaction commits"""
+    image_field, _ = IMAGE_FIELDS[type(instance)]
+    args = (type(instance), instance.pk, getattr(instance, image_field).name)
+    if getattr(settings, 'IMAGE_DERIVATIVE_WORKERS', 2) == 0:
+        transaction.on_commit(lambda: process(*args))
+    else:
+        transaction.on_commit(lambda: get_executor().submit(process, *args))
+
+
+def derivative_urls(derivatives, request=None):
+    """{size: {format: url}} for the names stored by process()"""
+    urls = {}
+    for size, names in derivatives.items():
+        if size == 'source':
+            continue
+        urls[size] = {}
+        for fmt, name in names.items():
+            url = default_storage.url(name)
+            urls[size][fmt] = request.build_absolute_uri(url) if request else url
+    return urls
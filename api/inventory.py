@@ -0,0 +1,232 @@
+"""
+Stock of the books that track it (Book.stock not NULL).
+
+Stock is only ever changed by UPDATE .. SET stock = stock - n WHERE stock >= n
+(one statement for all the books of an order), so two checkouts can't both
+sell the last copy whatever the isolation level. Before that, take() locks
+the book rows with SELECT .. FOR UPDATE in pk order: concurrent carts that
+share books queue on the first common book instead of deadlocking.
+Availability follows tracked stock: a book going to 0 is out_of_stock, a
+restocked one in_stock again.
+
+Reservations hold stock for a cart for STOCK_RESERVATION_SECONDS. Checkout
+with a reservation consumes it (the stock is already taken); deleting one
+any other way - cancelled, expired, its user deleted - puts the stock back
+(pre_delete signal). Expired reservations are released by
+manage.py release_reservations, and on the spot when a checkout or a new
+reservation finds a book short.
+
+A cancelled order puts its lines back into stock, and takes them again if
+it's un-cancelled. Lines added to or edited in an order that isn't cancelled
+(OrderItem.save(), the order and order item endpoints) take the difference,
+deleted ones (the order deleted with them) put theirs back;
+these raise InsufficientStock from the signal, so callers save in a
+transaction to have the write refused with the stock.
+
+Catalog edits never write the stock (BookSerializer has it read-only and
+saves only the edited columns); copies arrive or are written off through
+restock(), an F() delta like the rest (POST books/<id>/stock/).
+"""
+import datetime
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.db.models.functions import Coalesce
+from django.db.models.lookups import GreaterThan
+from django.utils import timezone
+
+from . import cache
+from .models import Book, Order, StockReservation, StockReservationItem
+
+CANCELLED = 'cancelled'
+RELEASE_BATCH_SIZE = 500
+
+
+class InsufficientStock(Exception):
+
+    def __init__(self, book_ids):
+        self.book_ids = sorted(book_ids)
+        super().__init__(f'Out of stock: {self.book_ids}')
+
+
+def set_stock(books, stock):
+    """UPDATE `books` to the `stock` expression, availability following it; returns the rows updated"""
+    return books.update(
+        stock=stock,
+        availability=Case(When(GreaterThan(stock, 0), then=Value('in_stock')), default=Value('out_of_stock')),
+        updated_at=timezone.now(),
+    )
+
+
+def shift(quantities, sign):
+    """
+    Take (sign=-1) or put back (sign=1) {book_id: quantity} for the books that
+    track stock; a take skips books that don't have enough. Returns the rows updated
+    """
+    delta = Case(*[When(pk=pk, then=Value(quantity)) for pk, quantity in quantities.items()],
+                 output_field=IntegerField())
+    books = Book.objects.filter(pk__in=quantities, stock__isnull=False)
+    if sign < 0:
+        books = books.filter(stock__gte=delta)
+        stock = F('stock') - delta
+    else:
+        stock = F('stock') + delta
+    return set_stock(books, stock)
+
+
+def stock_changed(book_ids, availability_changed):
+    # stock is in the book detail payload; availability also decides ?availability= listings
+    def invalidate():
+        if availability_changed:
+            cache.invalidate_books(book_ids)
+        else:
+            cache.bump('book', book_ids)
+    transaction.on_commit(invalidate)
+
+
+def current_stock(quantities, lock=False):
+    books = Book.objects.filter(pk__in=quantities).order_by('pk')
+    if lock:
+        books = books.select_for_update()
+    stock = dict(books.values_list('pk', 'stock'))
+    return {pk: stock[pk] for pk in quantities if stock.get(pk) is not None}
+
+
+def take(quantities):
+    """
+    Take {book_id: quantity} out of stock, all or nothing; call inside a
+    transaction. Raises InsufficientStock naming the books that are short
+    """
+    stock = current_stock(quantities, lock=True)
+    short = [pk for pk, available in stock.items() if available < quantities[pk]]
+    if short and release_expired(short):
+        stock = current_stock(quantities)
+        short = [pk for pk, available in stock.items() if available < quantities[pk]]
+    if short:
+        raise InsufficientStock(short)
+    if not stock:
+        return
+    if shift({pk: quantities[pk] for pk in stock}, -1) != len(stock):
+        # a backend without row locks let a concurrent take in between
+        raise InsufficientStock([pk for pk, available in current_stock(stock).items() if available < quantities[pk]])
+    stock_changed(list(stock), any(available == quantities[pk] for pk, available in stock.items()))
+
+
+def put_back(lines):
+    """Return [(book_id, quantity)] to stock"""
+    quantities = Counter()
+    for book_id, quantity in lines:
+        quantities[book_id] += quantity
+    if quantities and shift(quantities, 1):
+        stock_changed(list(quantities), True)
+
+
+def restock(book_id, quantity):
+    """
+    Add `quantity` copies of a book to its stock (remove them when negative),
+    starting to track it if it didn't; returns the new stock, None for an
+    unknown book. Raises InsufficientStock when removing more than there is
+    """
+    books = Book.objects.filter(pk=book_id)
+    with transaction.atomic():
+        if quantity < 0:
+            updated = set_stock(books.filter(stock__gte=-quantity), F('stock') + quantity)
+        else:
+            updated = set_stock(books, Coalesce(F('stock'), 0) + quantity)
+        if not updated:
+            if books.exists():
+                raise InsufficientStock([book_id])
+            return None
+        stock_changed([book_id], True)
+        return books.values_list('stock', flat=True).get()
+
+
+######################################################################################
+# reservations
+
+def reserve(user, quantities):
+    """A StockReservation of {book_id: quantity} for `user`, or InsufficientStock"""
+    ttl = datetime.timedelta(seconds=getattr(settings, 'STOCK_RESERVATION_SECONDS', 600))
+    with transaction.atomic():
+        take(quantities)
+        reservation = StockReservation.objects.create(user=user, expires_at=timezone.now() + ttl)
+        reservation.lines = StockReservationItem.objects.bulk_create([
+            StockReservationItem(reservation=reservation, book_id=book_id, quantity=quantity)
+            for book_id, quantity in quantities.items()
+        ])
+    return reservation
+
+
+def consume(reservation):
+    """Delete a reservation whose stock went into an order; call inside a transaction"""
+    reservation.consumed = True
+    reservation.delete()
+
+
+def release_expired(book_ids=None):
+    """Put the stock of expired reservations (holding any of `book_ids`) back; returns how many were released"""
+    released = 0
+    while True:
+        with transaction.atomic():
+            expired = StockReservation.objects.filter(expires_at__lte=timezone.now())
+            if book_ids is not None:
+                holding = StockReservationItem.objects.filter(book_id__in=book_ids).values('reservation_id')
+                expired = expired.filter(pk__in=holding)
+            # skip_locked: a reservation being consumed or released elsewhere is left alone
+            ids = list(expired.select_for_update(skip_locked=True).order_by('pk')
+                       .values_list('pk', flat=True)[:RELEASE_BATCH_SIZE])
+            StockReservation.objects.filter(pk__in=ids).delete()
+        released += len(ids)
+        if len(ids) < RELEASE_BATCH_SIZE:
+            return released
+
+
+######################################################################################
+# called from api/signals.py
+
+def reservation_deleting(reservation):
+    if not getattr(reservation, 'consumed', False):
+        put_back(reservation.items.values_list('book_id', 'quantity'))
+
+
+def order_saved(order, created):
+    stored = None if created else getattr(order, '_stored_status', None)
+    if stored and stored != CANCELLED and order.status == CANCELLED:
+        put_back(order.items.values_list('book_id', 'quantity'))
+    elif stored == CANCELLED and order.status != CANCELLED:
+        quantities = Counter()
+        for book_id, quantity in order.items.values_list('book_id', 'quantity'):
+            quantities[book_id] += quantity
+        if quantities:
+            with transaction.atomic():
+                take(quantities)
+
+
+def item_saved(item, created):
+    # the stored line held stock unless its order was cancelled, the new one does unless its order is
+    stored = None if created else getattr(item, '_stored_sale', None)
+    if stored and None in stored[:3]:
+        stored = None
+    active = set(Order.objects.filter(pk__in={item.order_id, *(stored[:1] if stored else ())})
+                 .exclude(status=CANCELLED).values_list('pk', flat=True))
+    quantities = Counter()
+    if item.order_id in active:
+        quantities[item.book_id] += item.quantity
+    if stored and stored[0] in active:
+        quantities[stored[1]] -= stored[2]
+    more = {pk: quantity for pk, quantity in quantities.items() if quantity > 0}
+    if more:
+        with transaction.atomic():
+            take(more)
+    put_back([(pk, -quantity) for pk, quantity in quantities.items() if quantity < 0])
+
+
+def item_deleted(item):
+    # post_delete: an order deleted with its lines is still there until they're all gone
+    stored = getattr(item, '_stored_sale', None)
+    order_id, book_id, quantity = stored[:3] if stored and None not in stored[:3] else (
+        item.order_id, item.book_id, item.quantity)
+    if Order.objects.filter(pk=order_id).exclude(status=CANCELLED).exists():
+        put_back([(book_id, quantity)])
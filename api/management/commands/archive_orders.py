@@ -0,0 +1,32 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api.archive import BATCH_SIZE, CLOSED, archive_orders
+
+
+class Command(BaseCommand):
+    help = ('Move closed orders (and their lines) older than --months into the archive tables, '
+            'one transaction per batch (run from cron, e.g. nightly)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months', type=int, default=12, help='Keep this many months of orders hot')
+        parser.add_argument('--status', nargs='+', choices=CLOSED, default=list(CLOSED),
+                            help='Closed statuses to archive (default: both)')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        if options['months'] < 0 or options['batch_size'] < 1:
+            raise CommandError('--months must be >= 0 and --batch-size >= 1')
+        # months counted as 30 days: the cutoff only needs to be stable, not calendar exact
+        before = timezone.now() - datetime.timedelta(days=30 * options['months'])
+        started = time.perf_counter()
+        archived = archive_orders(
+            before, statuses=options['status'], batch_size=options['batch_size'],
+            progress=lambda archived: self.stdout.write(f'{archived} orders archived'),
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {archived} orders placed before {before:%Y-%m-%d} in {time.perf_counter() - started:.1f}s'
+        ))
@@ -0,0 +1,234 @@
+import datetime
+import json
+import math
+import platform
+import subprocess
+import time
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, get_resolver, reverse
+from django.utils import timezone
+
+from api import cache, inventory
+from api.models import Authors, Book, Category, Order, OrderItem, Review, User
+
+PASSWORD = 'bench-password-1'
+PAGE = {'page_size': 50}
+
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of sorted `samples`"""
+    return samples[max(0, math.ceil(fraction * len(samples)) - 1)]
+
+
+def api_route_names():
+    """URL names of every route in api/urls.py, in declaration order"""
+    for pattern in get_resolver().url_patterns:
+        if isinstance(pattern, URLPattern):
+            continue
+        if getattr(pattern.urlconf_module, '__name__', None) == 'api.urls':
+            return [p.name for p in pattern.url_patterns if isinstance(p, URLPattern) and p.name]
+    return []
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=settings.BASE_DIR).stdout.strip() or None
+    except OSError:
+        return None
+
+
+class Fixtures:
+    """Existing rows the scenarios point at, plus a bench user created for the writes"""
+
+    def __init__(self):
+        self.book = Book.objects.order_by('pk').first()
+        self.category = Category.objects.order_by('pk').first()
+        self.author = Authors.objects.order_by('pk').first()
+        self.review = Review.objects.order_by('pk').first()
+        self.order = Order.objects.order_by('pk').first()
+        self.item = OrderItem.objects.order_by('pk').first()
+        missing = [name for name, value in vars(self).items() if value is None]
+        if missing:
+            raise CommandError(f'No {", ".join(missing)} in the database, run manage.py seed first')
+        self.in_stock = list(Book.objects.filter(availability='in_stock').order_by('pk').values_list('pk', flat=True)[:200])
+        self.reviewed_book = self.review.book_id
+        self.search_term = self.book.title.split()[1]
+        self.user = User.objects.create_user(email='bench-user@example.com', password=PASSWORD,
+                                             first_name='Bench', last_name='User')
+        self.reservation = inventory.reserve(self.user, {self.in_stock[0]: 1})
+
+
+def build_scenarios(f):
+    """url name -> callable(i) returning (method, path, query or body)"""
+    def get(name, *args, params=None):
+        return lambda i: ('GET', reverse(name, args=args), params or {})
+
+    def post(name, payload, *args, params=''):
+        return lambda i: ('POST', reverse(name, args=args) + params, payload(i))
+
+    week_ago = (timezone.now() - datetime.timedelta(days=7)).date().isoformat()
+    return {
+        'register-user': post('register-user', lambda i: {
+            'first_name': 'Bench', 'last_name': 'Register', 'email': f'bench-register-{i}@example.com',
+            'password': PASSWORD, 'password_confirm': PASSWORD,
+        }),
+        'login': post('login', lambda i: {'email': f.user.email, 'password': PASSWORD}),
+        'user-list': get('user-list', params=PAGE),
+        'user-detail': get('user-detail', f.user.pk),
+        'category-list': get('category-list'),
+        'category-detail': get('category-detail', f.category.pk),
+        'authors-list': get('authors-list'),
+        'authors-detail': get('authors-detail', f.author.pk),
+        'books-list': get('books-list', params=PAGE),
+        'books-search': get('books-search', params={'q': f.search_term}),
+        'books-bestsellers': get('books-bestsellers', params={'window': 'month'}),
+        'books-detail': get('books-detail', f.book.pk),
+        'books-stock': post('books-stock', lambda i: {'quantity': 1}, f.book.pk),
+        'review-list': get('review-list', params=PAGE),
+        'review-bulk': post('review-bulk', lambda i: [
+            {'user': f.user.pk, 'book': book, 'rating': 1 + (i + n) % 5, 'review_text': 'bench'}
+            for n, book in enumerate(f.in_stock[:50])
+        ], params='?on_conflict=update'),
+        'review-detail': get('review-detail', f.review.pk),
+        'order-list': get('order-list', params=PAGE),
+        'order-checkout': post('order-checkout', lambda i: {
+            'user': f.user.pk,
+            'items': [{'book': book, 'quantity': 1} for book in f.in_stock[i % 50:i % 50 + 3]],
+        }),
+        'order-reservation': post('order-reservation', lambda i: {
+            'user': f.user.pk,
+            'items': [{'book': book, 'quantity': 1} for book in f.in_stock[i % 50:i % 50 + 3]],
+        }),
+        'order-reservation-detail': get('order-reservation-detail', f.reservation.pk),
+        'order-export': get('order-export', params={'output': 'ndjson', 'from': week_ago}),
+        'order-detail': get('order-detail', f.order.pk),
+        'orderItems-list': get('orderItems-list', params=PAGE),
+        'orderItems-detail': get('orderItems-detail', f.item.pk),
+        'reports-sales': get('reports-sales', params={'group_by': 'day,category'}),
+        'async-category-list': get('async-category-list'),
+        'async-authors-list': get('async-authors-list'),
+        'async-books-list': get('async-books-list', params={'fields': 'book_id,title,price'}),
+        'async-books-detail': get('async-books-detail', f.book.pk),
+        'async-book-reviews': get('async-book-reviews', f.reviewed_book),
+    }
+
+
+class Command(BaseCommand):
+    help = ('Benchmark every route of api/urls.py with the Django test client and write '
+            'p50/p95/p99 latency, throughput and query counts to a JSON file')
+
+    def add_arguments(self, parser):
+        parser.add_argument('-n', '--iterations', type=int, default=100, help='Requests per route')
+        parser.add_argument('-o', '--output', default='bench-results.json')
+        parser.add_argument('--routes', nargs='+', metavar='URL_NAME', help='Only these routes')
+        parser.add_argument('--cold', action='store_true',
+                            help='Clear the catalog response cache before every request')
+        parser.add_argument('--baseline', help='Earlier results file to compare p50/p95 against')
+        parser.add_argument('--throttle', action='store_true',
+                            help='Keep the rate limits on (most write routes then measure 429s)')
+
+    def handle(self, *args, **options):
+        if options['throttle']:
+            return self.bench(options)
+        with override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {}}):
+            return self.bench(options)
+
+    def bench(self, options):
+        names = options['routes'] or api_route_names()
+        client = Client(raise_request_exception=False)
+        results = {}
+        # writes (registrations, checkouts, reviews) are rolled back at the end
+        with transaction.atomic():
+            scenarios = build_scenarios(Fixtures())
+            for name in names:
+                if name not in scenarios:
+                    self.stderr.write(self.style.WARNING(f'{name}: no scenario, skipped'))
+                    results[name] = {'skipped': True}
+                    continue
+                results[name] = self.run(client, scenarios[name], options['iterations'], options['cold'])
+                self.report(name, results[name])
+            transaction.set_rollback(True)
+
+        document = {
+            'meta': {
+                'started_at': timezone.now().isoformat(),
+                'git_commit': git_commit(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'iterations': options['iterations'],
+                'cold_cache': options['cold'],
+                'rows': {model.__name__: model.objects.count()
+                         for model in (Category, Authors, Book, User, Review, Order, OrderItem)},
+            },
+            'routes': results,
+        }
+        with open(options['output'], 'w', encoding='utf-8') as f:
+            json.dump(document, f, indent=2, sort_keys=True)
+        self.stdout.write(self.style.SUCCESS(f'Results written to {options["output"]}'))
+        if options['baseline']:
+            self.compare(options['baseline'], results)
+
+    def run(self, client, scenario, iterations, cold):
+        self.request(client, scenario(-1))  # warm up
+        durations, queries, statuses = [], [], {}
+        for i in range(iterations):
+            if cold:
+                cache.get_cache().clear()
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                status = self.request(client, scenario(i))
+                durations.append(time.perf_counter() - started)
+            queries.append(len(captured))
+            statuses[status] = statuses.get(status, 0) + 1
+        durations.sort()
+        total = sum(durations)
+        return {
+            'requests': iterations,
+            'p50_ms': round(percentile(durations, 0.50) * 1000, 3),
+            'p95_ms': round(percentile(durations, 0.95) * 1000, 3),
+            'p99_ms': round(percentile(durations, 0.99) * 1000, 3),
+            'mean_ms': round(total / iterations * 1000, 3),
+            'throughput_rps': round(iterations / total, 1) if total else None,
+            'queries_median': sorted(queries)[len(queries) // 2],
+            'queries_max': max(queries),
+            'statuses': {str(code): count for code, count in sorted(statuses.items())},
+        }
+
+    def request(self, client, spec):
+        method, path, data = spec
+        if method == 'GET':
+            response = client.get(path, data)
+        else:
+            response = client.post(path, data, content_type='application/json')
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+        return response.status_code
+
+    def report(self, name, result):
+        self.stdout.write(
+            f'{name:<22} p50 {result["p50_ms"]:8.2f}ms  p95 {result["p95_ms"]:8.2f}ms  '
+            f'p99 {result["p99_ms"]:8.2f}ms  {result["throughput_rps"]:8.1f} req/s  '
+            f'{result["queries_median"]:3d} queries  {result["statuses"]}'
+        )
+
+    def compare(self, path, results):
+        with open(path, encoding='utf-8') as f:
+            baseline = json.load(f)['routes']
+        for name, result in results.items():
+            before = baseline.get(name)
+            if result.get('skipped') or not before or before.get('skipped'):
+                continue
+            self.stdout.write(
+                f'{name:<22} p50 {before["p50_ms"]:8.2f} -> {result["p50_ms"]:8.2f}ms  '
+                f'p95 {before["p95_ms"]:8.2f} -> {result["p95_ms"]:8.2f}ms  '
+                f'queries {before["queries_median"]} -> {result["queries_median"]}'
+            )
@@ -0,0 +1,52 @@
+import time
+
+from django.contrib.auth import authenticate
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework import serializers
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+
+from api.models import User
+from api.serializers import CustomLoginSerializer
+from api.views import CustomLoginView
+
+
+class DoubleAuthLoginSerializer(TokenObtainPairSerializer):
+    """The previous login flow: authenticate() here, then again inside super().validate()"""
+    email = serializers.EmailField()
+    password = serializers.CharField(write_only=True)
+
+    def validate(self, attrs):
+        user = authenticate(request=self.context.get('request'), email=attrs['email'], password=attrs['password'])
+        if not user:
+            raise serializers.ValidationError('Invalid email or password.')
+        return super().validate(attrs)
+
+
+class Command(BaseCommand):
+    help = 'Measure login requests per second in this process, previous (double hash) vs current flow'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-n', '--requests', type=int, default=50)
+
+    def handle(self, *args, **options):
+        factory = APIRequestFactory()
+        credentials = {'email': 'bench-login@example.com', 'password': 'bench-password-1'}
+        results = {}
+        # the benchmark user is rolled back at the end
+        with transaction.atomic():
+            User.objects.create_user(first_name='Bench', last_name='Login', **credentials)
+            for label, serializer_class in (('before', DoubleAuthLoginSerializer), ('after', CustomLoginSerializer)):
+                # the login throttles would stop the loop after a few attempts
+                view = CustomLoginView.as_view(serializer_class=serializer_class, throttle_classes=[])
+                view(factory.post('/api/login/', credentials, format='json'))  # warm up
+                started = time.perf_counter()
+                for _ in range(options['requests']):
+                    response = view(factory.post('/api/login/', credentials, format='json'))
+                    assert response.status_code == 200, response.data
+                elapsed = time.perf_counter() - started
+                results[label] = options['requests'] / elapsed
+                self.stdout.write(f'{label:>6}: {results[label]:8.1f} logins/s ({elapsed / options["requests"] * 1000:.1f} ms each)')
+            transaction.set_rollback(True)
+        self.stdout.write(self.style.SUCCESS(f'speedup: {results["after"] / results["before"]:.2f}x'))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db.models.functions import Now
+
+from api.images import IMAGE_FIELDS, build_derivatives, invalidate_images, needs_derivatives
+
+
+class Command(BaseCommand):
+    help = 'Build resized WebP/AVIF copies of book covers and author photos that lack them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Rebuild derivatives that already exist')
+
+    def handle(self, *args, **options):
+        for model, (image_field, derivatives_field) in IMAGE_FIELDS.items():
+            built = 0
+            rows = model.objects.exclude(**{image_field: ''}).exclude(**{f'{image_field}__isnull': True})
+            for instance in rows.only('pk', image_field, derivatives_field).iterator(chunk_size=500):
+                if not (options['force'] or needs_derivatives(instance)):
+                    continue
+                source = getattr(instance, image_field).name
+                try:
+                    derivatives = build_derivatives(source)
+                except (OSError, ValueError) as e:
+                    self.stderr.write(f'{model.__name__} {instance.pk}: {source}: {e}')
+                    continue
+                model.objects.filter(pk=instance.pk).update(**{derivatives_field: derivatives}, updated_at=Now())
+                invalidate_images(model, instance.pk)
+                built += 1
+            self.stdout.write(self.style.SUCCESS(f'{model.__name__}: built derivatives for {built} images'))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api import exports
+
+
+class Command(BaseCommand):
+    help = 'Stream order lines (orders x order items x books) as NDJSON or CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output-format', choices=exports.FORMATS, default='ndjson')
+        parser.add_argument('--from', dest='date_from', help='First order date (ISO date or datetime)')
+        parser.add_argument('--to', dest='date_to', help='Last order date, inclusive for plain dates')
+        parser.add_argument('--status', help='Comma separated order statuses')
+        parser.add_argument('-o', '--output', help='File to write (default: stdout)')
+
+    def handle(self, *args, **options):
+        try:
+            lines = exports.order_lines(
+                date_from=exports.parse_bound(options['date_from']),
+                date_to=exports.parse_bound(options['date_to'], end=True),
+                statuses=exports.parse_statuses(options['status']),
+            )
+        except ValueError as e:
+            raise CommandError(e)
+        render, _ = exports.RENDERERS[options['output_format']]
+        if not options['output']:
+            for chunk in render(lines):
+                self.stdout.write(chunk, ending='')
+            return
+        with open(options['output'], 'w', newline='', encoding='utf-8') as out:
+            for chunk in render(lines):
+                out.write(chunk)
@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.catalog_import import CONFLICT_POLICIES, FORMATS, import_catalog
+
+
+class Command(BaseCommand):
+    help = ('Stream a catalog file (CSV, JSON array / NDJSON or ONIX XML) into the database: '
+            'categories and authors upserted by name, books by ISBN')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=FORMATS,
+                            help='Default: from the file extension (.csv, .json/.ndjson/.jsonl, .xml/.onix)')
+        parser.add_argument('--on-conflict', choices=CONFLICT_POLICIES, default='update',
+                            help='What to do when a book with the same ISBN already exists')
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+
+        def progress(stats):
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f'{stats["read"]} read, {stats["created"]} created, {stats["updated"]} updated, '
+                f'{stats["skipped"]} skipped, {stats["invalid"]} invalid ({stats["read"] / elapsed:.0f} rows/s)'
+            )
+
+        try:
+            importer = import_catalog(options['path'], fmt=options['format'], on_conflict=options['on_conflict'],
+                                      batch_size=options['batch_size'], progress=progress)
+        except (OSError, ValueError) as e:
+            # the batches before the error are committed, a re-run with --on-conflict skip resumes
+            raise CommandError(f'Import stopped: {e}')
+        for error in importer.errors:
+            self.stderr.write(self.style.WARNING(error))
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported catalog in {time.perf_counter() - started:.1f}s: {dict(importer.stats)}'
+        ))
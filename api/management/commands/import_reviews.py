@@ -0,0 +1,49 @@
+import json
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.serializers import ReviewBulkSerializer
+
+
+def read_rows(path):
+    """Yield review dicts from a JSON array file or an NDJSON (one object per line) file"""
+    with open(path, encoding='utf-8') as f:
+        first = f.read(1)
+        while first.isspace():
+            first = f.read(1)
+        f.seek(0)
+        if first == '[':
+            yield from json.load(f)
+            return
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+class Command(BaseCommand):
+    help = 'Bulk import reviews (JSON array or NDJSON) with one rating recompute per book and batch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--on-conflict', choices=('skip', 'update'), default='skip',
+                            help='What to do when the (user, book) review already exists')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        rows = read_rows(options['path'])
+        totals = {}
+        batch_no = 0
+        while True:
+            batch = list(islice(rows, options['batch_size']))
+            if not batch:
+                break
+            batch_no += 1
+            serializer = ReviewBulkSerializer(data=batch, many=True, context={'on_conflict': options['on_conflict']})
+            if not serializer.is_valid():
+                raise CommandError(f'Batch {batch_no} is invalid: {serializer.errors}')
+            serializer.save()
+            for key, value in serializer.stats.items():
+                totals[key] = totals.get(key, 0) + value
+            self.stdout.write(f'batch {batch_no}: {serializer.stats}')
+        self.stdout.write(self.style.SUCCESS(f'Imported reviews: {totals}'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from api.cache import invalidate_all
+from api.models import Book
+
+
+class Command(BaseCommand):
+    help = 'Rebuild Book.rating_sum / total_reviews / avg_rating from the reviews table (run after bulk loads)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('book_ids', nargs='*', type=int, help='Only rebuild these books (default: all)')
+
+    def handle(self, *args, **options):
+        books = Book.objects.all()
+        if options['book_ids']:
+            books = books.filter(pk__in=options['book_ids'])
+        updated = books.recompute_ratings()
+        invalidate_all()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt rating aggregates for {updated} books'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from api import sales
+
+
+class Command(BaseCommand):
+    help = ('Rebuild Book.units_sold / revenue and the daily sales rows from the order items '
+            '(run after bulk loads or queryset updates of orders)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('book_ids', nargs='*', type=int, help='Only rebuild these books (default: all)')
+
+    def handle(self, *args, **options):
+        updated = sales.rebuild(options['book_ids'] or None)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt sales counters for {updated} books'))
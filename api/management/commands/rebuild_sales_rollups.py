@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from api import reports
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the sales reporting rollups (day x category x status) from the order items, '
+            'archived ones included (run after bulk loads, queryset updates of orders or category moves)')
+
+    def handle(self, *args, **options):
+        written = reports.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {written} sales rollup rows'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the book full-text search index (run after bulk loads that bypass signals)'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} books'))
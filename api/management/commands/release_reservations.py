@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api.inventory import release_expired
+
+
+class Command(BaseCommand):
+    help = 'Put the stock held by expired reservations back (run from cron, e.g. every minute)'
+
+    def handle(self, *args, **options):
+        released = release_expired()
+        self.stdout.write(self.style.SUCCESS(f'Released {released} expired reservations'))
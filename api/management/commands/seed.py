@@ -0,0 +1,224 @@
+import datetime
+import random
+import time
+from contextlib import contextmanager
+from decimal import Decimal
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Max
+from django.utils import timezone
+
+from api import cache, reports, sales
+from api.models import Authors, Book, Category, Order, OrderItem, Review, User
+from api.search import rebuild_index
+
+GENRES = ['Fiction', 'History', 'Science', 'Poetry', 'Philosophy', 'Travel', 'Children', 'Religion',
+          'Biography', 'Economics', 'Art', 'Medicine', 'Law', 'Language', 'Cooking', 'Technology']
+FIRST_NAMES = ['Sara', 'Omar', 'Layla', 'Yusuf', 'Mona', 'Karim', 'Huda', 'Tariq', 'Nour', 'Adam',
+               'Maryam', 'Ali', 'Jane', 'John', 'Amal', 'Rami', 'Dina', 'Sami', 'Reem', 'Hassan']
+LAST_NAMES = ['Elias', 'Haddad', 'Mansour', 'Khalil', 'Saleh', 'Nasser', 'Aziz', 'Farouk', 'Smith',
+              'Hamdan', 'Yousef', 'Brown', 'Rahman', 'Jaber', 'Qasim', 'Taha', 'Ghanem', 'Ibrahim']
+WORDS = ['garden', 'river', 'night', 'city', 'desert', 'memory', 'star', 'letter', 'journey', 'house',
+         'sea', 'window', 'silence', 'fire', 'road', 'mirror', 'song', 'secret', 'empire', 'winter',
+         'الحديقة', 'النهر', 'الليل', 'المدينة', 'الصحراء', 'الذاكرة', 'الرحلة', 'البحر']
+ADJECTIVES = ['Lost', 'Hidden', 'Last', 'Golden', 'Silent', 'Broken', 'Distant', 'Little', 'Dark', 'New']
+STATUSES = [choice for choice, _ in Order.STATUS_CHOICES]
+STATUS_WEIGHTS = [10, 10, 5, 15, 55, 5]
+RATING_WEIGHTS = [5, 8, 20, 35, 32]
+ORDER_HISTORY_DAYS = 730
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def max_pk(model):
+    return model.objects.aggregate(last=Max('pk'))['last'] or 0
+
+
+def pks_after(model, last):
+    return list(model.objects.filter(pk__gt=last).order_by('pk').values_list('pk', flat=True))
+
+
+@contextmanager
+def explicit_dates(*fields):
+    """Let bulk_create keep the values given for auto_now_add fields instead of stamping now()"""
+    saved = [(field, field.auto_now_add) for field in fields]
+    for field, _ in saved:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, value in saved:
+            field.auto_now_add = value
+
+
+class Command(BaseCommand):
+    help = ('Generate a synthetic catalog, users, reviews and orders with bulk inserts '
+            '(e.g. --books 1000000 --reviews 10000000)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=40)
+        parser.add_argument('--authors', type=int, default=2000)
+        parser.add_argument('--books', type=int, default=10000)
+        parser.add_argument('--users', type=int, default=5000)
+        parser.add_argument('--reviews', type=int, default=50000)
+        parser.add_argument('--orders', type=int, default=20000)
+        parser.add_argument('--max-items', type=int, default=5, help='Order lines per order, 1 to N')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=1, help='Random seed, the same seed gives the same data')
+        parser.add_argument('--password', default='seed-password', help='Password of every generated user')
+        parser.add_argument('--skip-search-index', action='store_true',
+                            help='Leave the search index alone (rebuild it later with rebuild_search_index)')
+
+    def handle(self, *args, **options):
+        if not connection.features.can_return_rows_from_bulk_insert:
+            raise CommandError('seed needs a database that returns primary keys from bulk inserts')
+        if options['reviews'] > options['users'] * options['books']:
+            raise CommandError('--reviews can be at most --users x --books (one review per user and book)')
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.now = timezone.now()
+
+        category_ids = self.seed_categories(options['categories'])
+        author_ids = self.seed_authors(options['authors'])
+        book_ids = self.seed_books(options['books'], category_ids, author_ids)
+        user_ids = self.seed_users(options['users'], options['password'])
+        self.seed_reviews(options['reviews'], user_ids, book_ids)
+        self.seed_orders(options['orders'], options['max_items'], user_ids, book_ids)
+
+        # bulk_create bypasses save() and the signals: rebuild what they maintain
+        if book_ids:
+            self.step('ratings', lambda: Book.objects.filter(pk__gte=book_ids[0]).recompute_ratings())
+        if options['orders']:
+            self.step('sales counters', sales.rebuild)
+            self.step('sales rollups', reports.rebuild)
+        if not options['skip_search_index']:
+            self.step('search index', rebuild_index)
+        cache.invalidate_all()
+        self.stdout.write(self.style.SUCCESS('Seeding done'))
+
+    def step(self, label, func):
+        started = time.perf_counter()
+        result = func()
+        self.stdout.write(f'{label}: {result} in {time.perf_counter() - started:.1f}s')
+        return result
+
+    def insert(self, label, model, rows, pks=True):
+        """bulk_create `rows` (an iterable of instances) in batches; return the new pks, or their count"""
+        started = time.perf_counter()
+        last = max_pk(model) if pks else None
+        count = 0
+        for batch in batched(rows, self.batch_size):
+            model.objects.bulk_create(batch)
+            count += len(batch)
+        self.stdout.write(f'{label}: {count} rows in {time.perf_counter() - started:.1f}s')
+        return pks_after(model, last) if pks else count
+
+    def name(self):
+        return f'{self.rng.choice(FIRST_NAMES)} {self.rng.choice(LAST_NAMES)}'
+
+    def sentence(self, words):
+        return ' '.join(self.rng.choice(WORDS) for _ in range(words))
+
+    def past(self, days):
+        return self.now - datetime.timedelta(seconds=self.rng.randrange(days * 86400))
+
+    def seed_categories(self, count):
+        start = max_pk(Category)
+        rows = (Category(category_name=f'{GENRES[n % len(GENRES)]} {start + n}') for n in range(count))
+        return self.insert('categories', Category, rows)
+
+    def seed_authors(self, count):
+        return self.insert('authors', Authors, (Authors(author_name=self.name()) for _ in range(count)))
+
+    def seed_books(self, count, category_ids, author_ids):
+        start = max_pk(Book)
+
+        def books():
+            for n in range(count):
+                yield Book(
+                    ISBN=f'{9780000000000 + start + n:013d}',
+                    title=f'The {self.rng.choice(ADJECTIVES)} {self.rng.choice(WORDS)} {start + n}'[:50],
+                    description=self.sentence(30),
+                    price=Decimal(self.rng.randint(500, 8000)) / 100,
+                    publication_date=datetime.date(1950, 1, 1) + datetime.timedelta(days=self.rng.randrange(27000)),
+                    book_cover_photo='covers/seed.jpg',
+                    availability='in_stock' if self.rng.random() < 0.9 else 'out_of_stock',
+                    category_id=self.rng.choice(category_ids) if category_ids else None,
+                    created_at=self.past(3650),
+                )
+        with explicit_dates(Book._meta.get_field('created_at')):
+            book_ids = self.insert('books', Book, books())
+
+        through = Book.authors.through
+
+        def links():
+            for book_id in book_ids:
+                for author_id in {self.rng.choice(author_ids) for _ in range(self.rng.randint(1, 3))}:
+                    yield through(book_id=book_id, authors_id=author_id)
+        if author_ids:
+            self.insert('book authors', through, links(), pks=False)
+        return book_ids
+
+    def seed_users(self, count, password):
+        start = max_pk(User)
+        hashed = make_password(password)  # hashing is slow on purpose, do it once
+        rows = (
+            User(email=f'seed{start + n}@example.com', first_name=self.rng.choice(FIRST_NAMES),
+                 last_name=self.rng.choice(LAST_NAMES), password=hashed)
+            for n in range(count)
+        )
+        return self.insert('users', User, rows)
+
+    def seed_reviews(self, count, user_ids, book_ids):
+        if not (count and user_ids and book_ids):
+            return 0
+        step = max(1, len(book_ids) // len(user_ids))
+
+        def reviews():
+            # the n-th review of a user goes to consecutive books from a per-user offset,
+            # so (user, book) pairs never repeat
+            for k in range(count):
+                user_index, n = k % len(user_ids), k // len(user_ids)
+                yield Review(
+                    user_id=user_ids[user_index],
+                    book_id=book_ids[(user_index * step + n) % len(book_ids)],
+                    rating=self.rng.choices(range(1, 6), RATING_WEIGHTS)[0],
+                    review_text=self.sentence(12),
+                )
+        return self.insert('reviews', Review, reviews(), pks=False)
+
+    def seed_orders(self, count, max_items, user_ids, book_ids):
+        if not (count and user_ids and book_ids):
+            return
+        started = time.perf_counter()
+        created_items = 0
+        with explicit_dates(Order._meta.get_field('order_date')):
+            for done in range(0, count, self.batch_size):
+                orders, lines = [], []
+                for _ in range(min(self.batch_size, count - done)):
+                    items = [
+                        OrderItem(book_id=self.rng.choice(book_ids), quantity=self.rng.randint(1, 3),
+                                  price=Decimal(self.rng.randint(500, 8000)) / 100)
+                        for _ in range(self.rng.randint(1, max_items))
+                    ]
+                    orders.append(Order(
+                        user_id=self.rng.choice(user_ids), order_date=self.past(ORDER_HISTORY_DAYS),
+                        status=self.rng.choices(STATUSES, STATUS_WEIGHTS)[0],
+                        total_price=sum(item.price * item.quantity for item in items),
+                    ))
+                    lines.append(items)
+                # the order pks come back from the insert, the lines need them
+                Order.objects.bulk_create(orders)
+                for order, items in zip(orders, lines):
+                    for item in items:
+                        item.order_id = order.pk
+                OrderItem.objects.bulk_create([item for items in lines for item in items])
+                created_items += sum(len(items) for items in lines)
+        self.stdout.write(f'orders: {count} orders, {created_items} items in {time.perf_counter() - started:.1f}s')
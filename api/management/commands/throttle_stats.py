@@ -0,0 +1,18 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from api.throttling import reset_stats, stats
+
+
+class Command(BaseCommand):
+    help = ('Print the allowed / throttled request counters of every rate limit scope (api/throttling.py); '
+            'they are only shared with the server processes when THROTTLE_CACHE_ALIAS is a shared cache')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Zero the counters after printing them')
+
+    def handle(self, *args, **options):
+        self.stdout.write(json.dumps(stats(), indent=2, sort_keys=True))
+        if options['reset']:
+            reset_stats()
@@ -0,0 +1,144 @@
+"""
+Per-request SQL instrumentation for the api/ routes.
+
+Every database connection gets an execute wrapper (installed from
+api/signals.py when the connection opens) that feeds the statistics of the
+request being served, held in a context variable so it follows the request
+into sync_to_async threads. Works with DEBUG off.
+
+For each request the middleware reports:
+- a Server-Timing header: `db` (query count, time in SQL) and `app` (whole view);
+- one JSON log line on the `api.sql` logger (INFO; WARNING when a statement
+  repeats SQL_REPEAT_THRESHOLD times or more, the N+1 signature, or when the
+  query budget of the URL name is exceeded);
+- QUERY_BUDGETS = {(url name, method): max queries}, HEAD going by the GET
+  budget; with QUERY_BUDGET_MODE = 'fail' an exceeded budget of a GET/HEAD
+  raises QueryBudgetExceeded instead of just logging. Writes are only logged:
+  their transaction has committed by then, a 500 would hide a success.
+
+Queries run while a streaming response is consumed happen after the
+middleware returns and are not counted.
+"""
+import json
+import logging
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+logger = logging.getLogger('api.sql')
+
+_current = ContextVar('api_sql_stats', default=None)
+
+IN_LIST = re.compile(r'\(\s*%s(?:\s*,\s*%s)+\s*\)')
+LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def normalize(sql):
+    """SQL with literals and IN lists folded, so repeats of one statement share a pattern"""
+    return LITERAL.sub('?', IN_LIST.sub('(%s, ...)', sql))
+
+
+class QueryStats:
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.patterns = Counter()
+
+    def add(self, sql, duration):
+        self.count += 1
+        self.duration += duration
+        self.patterns[normalize(sql)] += 1
+
+    def repeated(self, threshold):
+        return [(sql, n) for sql, n in self.patterns.most_common() if n >= threshold]
+
+
+def record(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.add(sql, time.perf_counter() - start)
+
+
+def install(connection):
+    if record not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record)
+
+
+class QueryInstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats, token, start = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, stats, start)
+
+    async def __acall__(self, request):
+        stats, token, start = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, stats, start)
+
+    def start(self):
+        stats = QueryStats()
+        return stats, _current.set(stats), time.perf_counter()
+
+    def finish(self, request, response, stats, start):
+        match = request.resolver_match
+        if match is None or not match.route.startswith('api/'):
+            return response
+        elapsed = time.perf_counter() - start
+        response['Server-Timing'] = (
+            f'db;dur={stats.duration * 1000:.2f};desc="{stats.count} queries", '
+            f'app;dur={elapsed * 1000:.2f}'
+        )
+
+        method = 'GET' if request.method == 'HEAD' else request.method
+        budget = getattr(settings, 'QUERY_BUDGETS', {}).get((match.url_name, method))
+        over_budget = budget is not None and stats.count > budget
+        repeated = stats.repeated(getattr(settings, 'SQL_REPEAT_THRESHOLD', 5))
+        line = {
+            'url_name': match.url_name,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': stats.count,
+            'db_ms': round(stats.duration * 1000, 2),
+            'total_ms': round(elapsed * 1000, 2),
+            'budget': budget,
+            'repeated': [{'sql': sql[:300], 'count': n} for sql, n in repeated[:5]],
+        }
+        level = logging.WARNING if over_budget or repeated else logging.INFO
+        logger.log(level, json.dumps(line))
+
+        if over_budget and method == 'GET' and getattr(settings, 'QUERY_BUDGET_MODE', 'warn') == 'fail':
+            raise QueryBudgetExceeded(
+                f'{match.url_name}: {stats.count} queries, budget is {budget}'
+            )
+        return response
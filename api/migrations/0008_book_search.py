@@ -0,0 +1,36 @@
+# Full-text search index for books, maintained by api.search
+
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE TABLE book_search ('
+            'book_id integer PRIMARY KEY REFERENCES books (book_id) ON DELETE CASCADE, '
+            'document tsvector NOT NULL)'
+        )
+        schema_editor.execute('CREATE INDEX book_search_document_gin ON book_search USING GIN (document)')
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE book_search USING fts5("
+            "title, authors, category, description, "
+            "tokenize='porter unicode61 remove_diacritics 2')"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ('postgresql', 'sqlite'):
+        schema_editor.execute('DROP TABLE IF EXISTS book_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_book_rating_sum'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+
+
+def backfill_sales(apps, schema_editor):
+    Book = apps.get_model('api', 'Book')
+    BookSales = apps.get_model('api', 'BookSales')
+    OrderItem = apps.get_model('api', 'OrderItem')
+    items = OrderItem.objects.exclude(order__status='cancelled')
+    per_book = items.filter(book=OuterRef('pk')).order_by().values('book')
+    Book.objects.update(
+        units_sold=Coalesce(Subquery(per_book.annotate(total=Sum('quantity')).values('total')), 0),
+        revenue=Coalesce(Subquery(per_book.annotate(total=Sum(F('quantity') * F('price'))).values('total')),
+                         Value(0), output_field=models.DecimalField()),
+    )
+    rows = (
+        items.annotate(day=TruncDate('order__order_date'))
+        .values('book_id', 'day')
+        .annotate(units=Sum('quantity'), revenue=Sum(F('quantity') * F('price')))
+        .order_by()
+    )
+    BookSales.objects.bulk_create([BookSales(**row) for row in rows.iterator()], batch_size=5000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_catalog_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('units', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+            ],
+            options={
+                'db_table': 'book_sales_daily',
+            },
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='revenue',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='units_sold',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['units_sold'], name='books_units_s_add169_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['category', 'units_sold'], name='books_categor_13772a_idx'),
+        ),
+        migrations.AddField(
+            model_name='booksales',
+            name='book',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='api.book'),
+        ),
+        migrations.AddIndex(
+            model_name='booksales',
+            index=models.Index(fields=['day', 'book'], name='book_sales__day_52bb04_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='booksales',
+            unique_together={('book', 'day')},
+        ),
+        migrations.RunPython(backfill_sales, migrations.RunPython.noop),
+    ]
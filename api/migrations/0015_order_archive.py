@@ -0,0 +1,105 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:25
+
+from django.db import migrations, models
+
+# Archive tables for manage.py archive_orders (api/archive.py). On PostgreSQL
+# they are range-partitioned by order_date (yearly partitions are created by
+# the command), which puts order_date in their primary key; elsewhere plain
+# tables keyed by the order / order item id.
+
+ARCHIVE_TABLES = {
+    'orders_archive': {
+        'columns': [
+            ('order_id', models.IntegerField()),
+            ('user_id', models.BigIntegerField()),
+            ('order_date', models.DateTimeField()),
+            ('total_price', models.DecimalField(max_digits=10, decimal_places=2)),
+            ('status', models.CharField(max_length=15)),
+            ('archived_at', models.DateTimeField()),
+        ],
+        'indexes': {
+            'orders_archive_user_idx': 'user_id, order_date',
+            'orders_archive_date_idx': 'order_date',
+        },
+    },
+    'order_items_archive': {
+        'columns': [
+            ('order_item_id', models.IntegerField()),
+            ('order_id', models.IntegerField()),
+            ('book_id', models.IntegerField()),
+            ('order_date', models.DateTimeField()),
+            ('quantity', models.PositiveIntegerField()),
+            ('price', models.DecimalField(max_digits=10, decimal_places=2)),
+        ],
+        'indexes': {
+            'order_items_archive_order_idx': 'order_id',
+            'order_items_archive_book_idx': 'book_id',
+        },
+    },
+}
+
+
+def create_archive_tables(apps, schema_editor):
+    connection = schema_editor.connection
+    partitioned = connection.vendor == 'postgresql'
+    for table, spec in ARCHIVE_TABLES.items():
+        columns = [f'{name} {field.db_type(connection)} NOT NULL' for name, field in spec['columns']]
+        key = spec['columns'][0][0]
+        if partitioned:
+            columns.append(f'PRIMARY KEY (order_date, {key})')
+        else:
+            columns[0] += ' PRIMARY KEY'
+        schema_editor.execute(
+            f'CREATE TABLE {table} ({", ".join(columns)})'
+            + (' PARTITION BY RANGE (order_date)' if partitioned else '')
+        )
+        indexes = dict(spec['indexes'])
+        if partitioned:
+            # lookups by id alone: the primary key starts with order_date
+            indexes[f'{table}_{key}_idx'] = key
+        for name, fields in indexes.items():
+            schema_editor.execute(f'CREATE INDEX {name} ON {table} ({fields})')
+
+
+def drop_archive_tables(apps, schema_editor):
+    for table in reversed(ARCHIVE_TABLES):
+        schema_editor.execute(f'DROP TABLE IF EXISTS {table}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_idempotency_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('order_id', models.IntegerField(primary_key=True, serialize=False)),
+                ('order_date', models.DateTimeField()),
+                ('total_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('confirmed', 'Confirmed'), ('processing', 'Processing'), ('shipped', 'Shipped'), ('delivered', 'Delivered'), ('cancelled', 'Cancelled')], max_length=15)),
+                ('archived_at', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'orders_archive',
+                'ordering': ['-order_date'],
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedOrderItem',
+            fields=[
+                ('order_item_id', models.IntegerField(primary_key=True, serialize=False)),
+                ('order_date', models.DateTimeField()),
+                ('quantity', models.PositiveIntegerField()),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10)),
+            ],
+            options={
+                'db_table': 'order_items_archive',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_archive_tables, drop_archive_tables),
+    ]
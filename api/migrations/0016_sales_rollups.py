@@ -0,0 +1,49 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:29
+
+from django.db import migrations, models
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+
+
+def backfill_rollups(apps, schema_editor):
+    # hot order items only: run manage.py rebuild_sales_rollups if orders were archived already
+    OrderItem = apps.get_model('api', 'OrderItem')
+    SalesRollup = apps.get_model('api', 'SalesRollup')
+    rows = (
+        OrderItem.objects.values(day=TruncDate('order__order_date'), category=F('book__category_id'),
+                                 state=F('order__status'))
+        .annotate(line_count=Count('pk'), unit_count=Sum('quantity'), total=Sum(F('quantity') * F('price')))
+        .order_by()
+    )
+    SalesRollup.objects.bulk_create([
+        SalesRollup(day=row['day'], category_id=row['category'] or 0, status=row['state'],
+                    lines=row['line_count'], units=row['unit_count'], revenue=row['total'])
+        for row in rows.iterator()
+    ], batch_size=5000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_order_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('category_id', models.PositiveIntegerField(default=0)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('confirmed', 'Confirmed'), ('processing', 'Processing'), ('shipped', 'Shipped'), ('delivered', 'Delivered'), ('cancelled', 'Cancelled')], max_length=15)),
+                ('lines', models.IntegerField(default=0)),
+                ('units', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+            options={
+                'db_table': 'sales_rollup_daily',
+                'constraints': [models.UniqueConstraint(fields=('day', 'category_id', 'status'), name='sales_rollup_unique')],
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
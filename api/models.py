@@ -1,8 +1,12 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, Count, F, FloatField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce, Now
+from django.db.models.lookups import Exact
 from django.contrib.auth.models import AbstractUser,Group,Permission
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils import timezone
-from django.contrib.auth.hashers import make_password
+from django.contrib.auth.hashers import identify_hasher, make_password
 
 
 from django.contrib.auth.base_user import BaseUserManager
@@ -62,8 +66,11 @@ class User(AbstractUser):
         db_table = 'users'
         ordering = ['first_name', 'last_name']
     def save(self, *args, **kwargs):
-        # إذا المستخدم جديد أو تم تغيير الباسورد كنص عادي → شفره تلقائيًا
-        if self.pk is None or not self.password.startswith('pbkdf2'):
+        # إذا تم تغيير الباسورد كنص عادي → شفره تلقائيًا
+        # (a password already hashed by set_password() is left alone, hashing it again would lock the user out)
+        try:
+            identify_hasher(self.password)
+        except ValueError:
             self.password = make_password(self.password)
         super().save(*args, **kwargs)
     def __str__(self):
@@ -74,6 +81,7 @@ class Category(models.Model):
 
     category_id = models.AutoField(primary_key=True)
     category_name = models.CharField(max_length=255, unique=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         db_table = 'categories'
@@ -88,6 +96,9 @@ class Authors(models.Model):
     author_id = models.AutoField(primary_key=True)
     author_name = models.CharField(max_length=255)
     author_photo = models.ImageField(upload_to='authors/', blank=True, null=True)
+    # resized WebP/AVIF copies of author_photo, filled in by api.images
+    photo_derivatives = models.JSONField(default=dict, blank=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
     class Meta:
         db_table = 'authors'
         ordering = ['author_name']
@@ -97,6 +108,57 @@ class Authors(models.Model):
 
 
 
+class BookQuerySet(models.QuerySet):
+    def with_related(self):
+        """
+        Load category and authors for every book in a fixed number of queries
+        (one JOIN for category, one prefetch for authors), whatever the page size
+        """
+        return self.select_related('category').prefetch_related('authors')
+
+    def recompute_ratings(self):
+        """
+        Rebuild rating_sum / total_reviews / avg_rating for the books in this
+        queryset from the reviews table, in two set-based UPDATE statements
+        """
+        reviews = Review.objects.filter(book=OuterRef('pk')).order_by().values('book')
+        rating_sum = reviews.annotate(total=Sum('rating')).values('total')
+        review_count = reviews.annotate(total=Count('pk')).values('total')
+        self.update(
+            rating_sum=Coalesce(Subquery(rating_sum), 0),
+            total_reviews=Coalesce(Subquery(review_count), 0),
+        )
+        return self.update(avg_rating=average_rating(F('rating_sum'), F('total_reviews')), updated_at=Now())
+
+    def recompute_sales(self):
+        """
+        Rebuild units_sold / revenue for the books in this queryset from the
+        order items of orders that are not cancelled, archived ones included,
+        in one UPDATE statement
+        """
+        units, revenue = [], []
+        for model in (OrderItem, ArchivedOrderItem):
+            items = (model.objects.filter(book=OuterRef('pk')).exclude(order__status='cancelled')
+                     .order_by().values('book'))
+            units.append(Coalesce(Subquery(items.annotate(total=Sum('quantity')).values('total')), 0))
+            revenue.append(Coalesce(Subquery(items.annotate(total=Sum(F('quantity') * F('price'))).values('total')),
+                                    Value(0), output_field=models.DecimalField()))
+        return self.update(units_sold=units[0] + units[1], revenue=revenue[0] + revenue[1])
+
+    def touch(self):
+        """Bump updated_at for changes saved outside Book.save() (ratings, authors, derivatives)"""
+        return self.update(updated_at=Now())
+
+
+def average_rating(rating_sum, review_count):
+    """SQL expression for rating_sum / review_count, 0 when there are no reviews"""
+    return Case(
+        When(Exact(review_count, 0), then=Value(0.0)),
+        default=Cast(rating_sum, FloatField()) / review_count,
+        output_field=FloatField(),
+    )
+
+
 # Book Model - Following ERD specifications
 class Book(models.Model):
     AVAILABILITY_CHOICES = [
@@ -116,12 +178,17 @@ class Book(models.Model):
     )
     publication_date = models.DateField()
     book_cover_photo = models.ImageField(upload_to='covers/')
+    # resized WebP/AVIF copies of book_cover_photo, filled in by api.images
+    cover_derivatives = models.JSONField(default=dict, blank=True, editable=False)
     availability = models.CharField(
         max_length=20,
         choices=AVAILABILITY_CHOICES,
         default='in_stock'
     )
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, related_name='books')
+    # copies on hand, NULL = not tracked (availability is then set by hand);
+    # checkout and reservations take from it atomically, see api/inventory.py
+    stock = models.PositiveIntegerField(null=True, blank=True)
     avg_rating = models.DecimalField(
         max_digits=3,
         decimal_places=2,
@@ -129,9 +196,16 @@ class Book(models.Model):
         validators=[MinValueValidator(0.00), MaxValueValidator(5.00)]
     )
     total_reviews = models.PositiveIntegerField(default=0)
+    # running sum of review ratings, kept in step with total_reviews
+    rating_sum = models.PositiveIntegerField(default=0)
+    # all-time sales of orders that are not cancelled, kept up to date by api.sales
+    units_sold = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = BookQuerySet.as_manager()
+
     class Meta:
         db_table = 'books'
         ordering = ['-created_at']
@@ -139,16 +213,33 @@ class Book(models.Model):
             models.Index(fields=['category']),
             models.Index(fields=['avg_rating']),
             models.Index(fields=['price']),
+            models.Index(fields=['units_sold']),
+            models.Index(fields=['category', 'units_sold']),
+            # listing filter + sort combinations (api/filters.py), book_id ends the keyset
+            models.Index(fields=['-created_at', '-book_id'], name='books_newest_idx'),
+            models.Index(fields=['category', '-created_at', '-book_id'], name='books_category_newest_idx'),
+            models.Index(fields=['category', 'price', 'book_id'], name='books_category_price_idx'),
+            models.Index(fields=['category', '-avg_rating', '-book_id'], name='books_category_rating_idx'),
+            models.Index(fields=['availability', 'price', 'book_id'], name='books_available_price_idx'),
+            models.Index(fields=['publication_date'], name='books_published_idx'),
         ]
 
     def __str__(self):
+            # uses the prefetched authors when loaded through Book.objects.with_related()
             authors_names = ", ".join([author.author_name for author in self.authors.all()])
             return f"{self.title} - {authors_names}"
 
     @property
     def is_available(self):
         """Check if book is available for purchase"""
-        return self.quantity > 0
+        return self.availability == 'in_stock' and (self.stock is None or self.stock > 0)
+
+    def save(self, *args, **kwargs):
+        # tracked stock decides availability, when this save writes the stock
+        update_fields = kwargs.get('update_fields')
+        if self.stock is not None and (update_fields is None or 'stock' in update_fields):
+            self.availability = 'in_stock' if self.stock > 0 else 'out_of_stock'
+        super().save(*args, **kwargs)
 
     # @property
     # def is_digital(self):
@@ -157,18 +248,27 @@ class Book(models.Model):
 
     def update_rating(self):
         """
-        Update average rating and total reviews count
-        Call this method when reviews are added/updated/deleted
+        Recompute average rating and total reviews count from the reviews table
+        Reviews keep these up to date incrementally (see Review.save),
+        this is only needed to repair the counters after bulk changes
+        """
+        Book.objects.filter(pk=self.pk).recompute_ratings()
+        self.refresh_from_db(fields=['rating_sum', 'avg_rating', 'total_reviews'])
+
+    @classmethod
+    def apply_rating_change(cls, book_id, rating_delta, count_delta):
+        """
+        Atomically shift a book's rating counters by the given deltas
+        Constant cost: one UPDATE on the book row, no reviews scan
         """
-        reviews = self.reviews.all()
-        if reviews.exists():
-            total_rating = sum(review.rating for review in reviews)
-            self.avg_rating = total_rating / reviews.count()
-            self.total_reviews = reviews.count()
-        else:
-            self.avg_rating = 0.00
-            self.total_reviews = 0
-        self.save(update_fields=['avg_rating', 'total_reviews'])
+        new_sum = F('rating_sum') + rating_delta
+        new_count = F('total_reviews') + count_delta
+        cls.objects.filter(pk=book_id).update(
+            rating_sum=new_sum,
+            total_reviews=new_count,
+            avg_rating=average_rating(new_sum, new_count),
+            updated_at=Now(),
+        )
 
 
 
@@ -198,16 +298,36 @@ class Review(models.Model):
     def __str__(self):
         return f'{self.user.email} - {self.book.title} ({self.rating}/5)'
 
-    def save(self, *args, **kwargs):
-        """Override save to update book rating automatically"""
-        super().save(*args, **kwargs)
-        self.book.update_rating()
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        review = super().from_db(db, field_names, values)
+        review._remember_rating()
+        return review
+
+    def _remember_rating(self):
+        # rating/book as stored in the database, used to compute deltas on save/delete
+        self._stored_rating = self.__dict__.get('rating')
+        self._stored_book_id = self.__dict__.get('book_id')
 
-    def delete(self, *args, **kwargs):
-        """Override delete to update book rating automatically"""
-        book = self.book
-        super().delete(*args, **kwargs)
-        book.update_rating()
+    def save(self, *args, **kwargs):
+        """Override save to update book rating counters automatically"""
+        with transaction.atomic():
+            adding = self._state.adding
+            if not adding and getattr(self, '_stored_rating', None) is None:
+                stored = Review.objects.filter(pk=self.pk).values('rating', 'book_id').first()
+                if stored:
+                    self._stored_rating, self._stored_book_id = stored['rating'], stored['book_id']
+                else:
+                    adding = True
+            super().save(*args, **kwargs)
+            if adding:
+                Book.apply_rating_change(self.book_id, self.rating, 1)
+            elif self._stored_book_id != self.book_id:
+                Book.apply_rating_change(self._stored_book_id, -self._stored_rating, -1)
+                Book.apply_rating_change(self.book_id, self.rating, 1)
+            elif self._stored_rating != self.rating:
+                Book.apply_rating_change(self.book_id, self.rating - self._stored_rating, 0)
+        self._remember_rating()
 
 # Order Model - Following ERD specifications
 class Order(models.Model):
@@ -246,6 +366,20 @@ class Order(models.Model):
     def __str__(self):
         return f'Order {self.order_id} by {self.user.email}'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        order = super().from_db(db, field_names, values)
+        order._remember_status()
+        return order
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self._remember_status()
+
+    def _remember_status(self):
+        # status as stored in the database, api.sales recounts the lines when it moves to/from cancelled
+        self._stored_status = self.__dict__.get('status')
+
     @property
     def items_count(self):
         """Get total number of items in this order"""
@@ -292,4 +426,172 @@ class OrderItem(models.Model):
             self.price = self.book.price
         super().save(*args, **kwargs)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        item = super().from_db(db, field_names, values)
+        item._remember_sale()
+        return item
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self._remember_sale()
+
+    def _remember_sale(self):
+        # the line as stored in the database, api.sales counts the difference on save/delete
+        self._stored_sale = tuple(self.__dict__.get(name) for name in ('order_id', 'book_id', 'quantity', 'price'))
+
+
+class ArchivedOrder(models.Model):
+    """
+    A closed order moved out of `orders` by manage.py archive_orders (api/archive.py)
+    Read-only history; on PostgreSQL the table is range-partitioned by
+    order_date, so its real primary key is (order_date, order_id)
+    """
+    order_id = models.IntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_constraint=False, related_name='archived_orders')
+    order_date = models.DateTimeField()
+    total_price = models.DecimalField(max_digits=10, decimal_places=2)
+    status = models.CharField(max_length=15, choices=Order.STATUS_CHOICES)
+    archived_at = models.DateTimeField()
+
+    class Meta:
+        # created by migration 0015 (partitioned tables on PostgreSQL)
+        managed = False
+        db_table = 'orders_archive'
+        ordering = ['-order_date']
+        indexes = [
+            models.Index(fields=['user', 'order_date'], name='orders_archive_user_idx'),
+            models.Index(fields=['order_date'], name='orders_archive_date_idx'),
+        ]
+
+    def __str__(self):
+        return f'Archived order {self.order_id}'
+
+
+class ArchivedOrderItem(models.Model):
+    """A line of an ArchivedOrder; order_date is copied from the order, it is the partition key"""
+    order_item_id = models.IntegerField(primary_key=True)
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, db_constraint=False, related_name='items')
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, db_constraint=False)
+    order_date = models.DateTimeField()
+    quantity = models.PositiveIntegerField()
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+
+    class Meta:
+        managed = False
+        db_table = 'order_items_archive'
+        indexes = [
+            models.Index(fields=['order'], name='order_items_archive_order_idx'),
+            models.Index(fields=['book'], name='order_items_archive_book_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.book_id} x{self.quantity}'
+
+
+class BookSales(models.Model):
+    """
+    Units sold and revenue of one book on one day (order date, TIME_ZONE)
+    Incremented by api.sales, read by the bestseller rankings
+    """
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='daily_sales')
+    day = models.DateField()
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        db_table = 'book_sales_daily'
+        unique_together = ('book', 'day')
+        indexes = [
+            models.Index(fields=['day', 'book']),
+        ]
+
+    def __str__(self):
+        return f'{self.book_id} on {self.day}: {self.units}'
+
+
+class SalesRollup(models.Model):
+    """
+    Order lines summed per day (of the order), book category and order
+    status, for the sales reports; kept up to date by api/reports.py
+    """
+    day = models.DateField()
+    # not a foreign key: 0 stands for books without a category, a NULL would escape the unique key
+    category_id = models.PositiveIntegerField(default=0)
+    status = models.CharField(max_length=15, choices=Order.STATUS_CHOICES)
+    lines = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        db_table = 'sales_rollup_daily'
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'category_id', 'status'], name='sales_rollup_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.day} category {self.category_id} {self.status}: {self.revenue}'
+
+
+class StockReservation(models.Model):
+    """
+    Stock held for a user's cart until expires_at
+    Checkout turns it into an order; cancelling or expiring it puts the
+    stock back (api/inventory.py)
+    """
+    reservation_id = models.AutoField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='reservations')
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        db_table = 'stock_reservations'
+
+    def __str__(self):
+        return f'Reservation {self.reservation_id} until {self.expires_at}'
+
+    @property
+    def is_expired(self):
+        return self.expires_at <= timezone.now()
+
+
+class StockReservationItem(models.Model):
+    reservation = models.ForeignKey(StockReservation, on_delete=models.CASCADE, related_name='items')
+    book = models.ForeignKey(Book, on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField(validators=[MinValueValidator(1)])
+
+    class Meta:
+        db_table = 'stock_reservation_items'
+
+    def __str__(self):
+        return f'{self.book_id} x{self.quantity}'
+
+
+class IdempotencyKey(models.Model):
+    """
+    The stored response of a write sent with an Idempotency-Key header,
+    replayed to retries of the same request until expires_at (api/idempotency.py)
+    """
+    key = models.CharField(max_length=255)
+    # user, method and path the key was used for: the same key on another route is another request
+    scope = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True)
+    response = models.JSONField(null=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        db_table = 'idempotency_keys'
+        constraints = [
+            models.UniqueConstraint(fields=['key', 'scope'], name='idempotency_key_scope_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.key} ({self.scope})'
+
+    @property
+    def is_expired(self):
+        return self.expires_at <= timezone.now()
+
 # Create your models here.
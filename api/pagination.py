@@ -0,0 +1,157 @@
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination, _reverse_ordering
+from rest_framework.response import Response
+
+from .sparse import project, sparse_context
+
+
+def column_value(instance, column):
+    return instance[column] if isinstance(instance, dict) else getattr(instance, column)
+
+
+def following(ordering, position):
+    """
+    Q for the rows after `position` (one value per ordering column) in `ordering`:
+    the row comparison (a, b) > (x, y) spelled out as a > x OR (a = x AND b > y),
+    per column direction, plus a >= x on its own so the index can be seeked
+    """
+    equal, rows = {}, Q()
+    for name, value in zip(ordering, position):
+        column = name.lstrip('-')
+        rows |= Q(**equal, **{f'{column}__{"lt" if name.startswith("-") else "gt"}': value})
+        equal[column] = value
+    leading = ordering[0]
+    bound = Q(**{f'{leading.lstrip("-")}__{"lte" if leading.startswith("-") else "gte"}': position[0]})
+    return bound & rows
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Keyset (cursor) pagination over an indexed ordering key.
+    Pages are fetched with WHERE (key, id) > (last key, last id) instead of
+    OFFSET, so page 1000 costs the same as page 1. The cursor holds the value
+    of every ordering column of the row it starts after, so rows that tie on
+    the leading column are stepped through by the trailing unique one (DRF's
+    CursorPagination keys on the first column only and falls back to an
+    offset, capped at offset_cutoff, inside a tie). The ordering must end in
+    a unique column. Cursors are opaque base64 tokens.
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    cursor_query_param = 'cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.set_page(list(self.page_queryset(queryset, request, view)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """paginate_queryset() for async views, the page is read with the async ORM"""
+        return self.set_page([row async for row in self.page_queryset(queryset, request, view)])
+
+    def page_queryset(self, queryset, request, view=None):
+        """The rows of the requested page, plus one; set_page() takes them"""
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        self.reverse = self.cursor is not None and self.cursor.reverse
+        self.position = self.decode_position(self.cursor)
+
+        # a reverse cursor (previous page) walks the ordering backwards from the first row shown
+        ordering = _reverse_ordering(self.ordering) if self.reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if self.position is not None:
+            try:
+                queryset = queryset.filter(following(ordering, self.position))
+            except (TypeError, ValueError, ValidationError):
+                raise NotFound(self.invalid_cursor_message)
+        # one extra row tells whether there is a page beyond this one
+        return queryset[:self.page_size + 1]
+
+    def set_page(self, results):
+        self.page = results[:self.page_size]
+        has_more = len(results) > self.page_size
+        if self.reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = self.position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.position is not None
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def decode_position(self, cursor):
+        if cursor is None or cursor.position is None:
+            return None
+        try:
+            position = json.loads(cursor.position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if (not isinstance(position, list) or len(position) != len(self.ordering)
+                or not all(isinstance(value, str) for value in position)):
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def _get_position_from_instance(self, instance, ordering):
+        return json.dumps([str(column_value(instance, name.lstrip('-'))) for name in ordering])
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        position = self._get_position_from_instance(self.page[-1], self.ordering)
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=position))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        position = self._get_position_from_instance(self.page[0], self.ordering)
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=position))
+
+
+def wants_pagination(request, pagination_class=KeysetPagination):
+    params = request.query_params
+    return pagination_class.cursor_query_param in params or pagination_class.page_size_query_param in params
+
+
+def project_list(queryset, serializer_class, context, ordering):
+    """`queryset` narrowed to the selected fields (api/sparse.py) and the `ordering` columns"""
+    # the cursor is built from the ordering columns, they must stay loaded
+    keep = [name.lstrip('-') for name in ordering or ()]
+    return project(queryset, serializer_class, context, keep=keep)
+
+
+class KeysetPaginatedMixin:
+    """
+    Opt-in pagination for APIView list endpoints.
+    Clients that send ?cursor= or ?page_size= get a paginated envelope
+    ({next, previous, results}); everyone else keeps the plain list response.
+    `ordering` must start with an indexed column and end with a unique one;
+    list_response can be given a per-request ordering instead (e.g. a ?sort= choice).
+    ?fields= / ?omit= are honoured and narrow the query (api/sparse.py).
+    """
+    pagination_class = KeysetPagination
+    ordering = None
+
+    def wants_pagination(self, request):
+        return wants_pagination(request, self.pagination_class)
+
+    def list_response(self, request, queryset, serializer_class, ordering=None):
+        context = sparse_context(request)
+        if ordering:
+            queryset = queryset.order_by(*ordering)
+        ordering = ordering or self.ordering
+        queryset = project_list(queryset, serializer_class, context, ordering)
+        if not self.wants_pagination(request):
+            serializer = serializer_class(queryset, many=True, context=context)
+            return Response(serializer.data)
+
+        paginator = self.pagination_class()
+        paginator.ordering = ordering
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        serializer = serializer_class(page, many=True, context=context)
+        return paginator.get_paginated_response(serializer.data)
@@ -0,0 +1,46 @@
+"""
+orjson based JSON renderer and parser, enabled in REST_FRAMEWORK (library/settings.py).
+
+Output is the JSON DRF's JSONRenderer produces with the default settings
+(compact, unescaped unicode, U+2028/U+2029 escaped); only the spelling of
+float exponents can differ (1e-7 vs 1e-07). Requests for an
+indented response, or projects that change UNICODE_JSON / COMPACT_JSON, are
+handed to the stock renderer, which supports every combination.
+"""
+import orjson
+from rest_framework import parsers, renderers
+from rest_framework.exceptions import ParseError
+from rest_framework.utils.encoders import JSONEncoder
+
+_encoder = JSONEncoder()
+
+
+def default(obj):
+    # Decimal, lazy strings, querysets, timedelta... exactly as DRF encodes them
+    return _encoder.default(obj)
+
+
+class ORJSONRenderer(renderers.JSONRenderer):
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        if indent or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        ret = orjson.dumps(data, default=default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z)
+        # keep the output a strict javascript subset, like JSONRenderer
+        if b'\xe2\x80' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+class ORJSONParser(parsers.JSONParser):
+    renderer_class = ORJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
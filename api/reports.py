@@ -0,0 +1,146 @@
+"""
+Sales reporting rollups: order lines summed per day, book category and order status.
+
+SalesRollup holds one row per (day of the order, category of the book, status
+of the order) with the number of lines, units and revenue, so the reports
+sum a few hundred small rows instead of joining order_items to orders and
+books. Every line counts, whatever its status: cancelled revenue is a
+bucket of its own. Rows are kept up to date like the sales counters
+(api/sales.py), with SQL increments (sales.increment):
+- checkout (bulk_create) calls record() itself, OrderItem.save() and delete()
+  go through the signals, an edited line moves from its old bucket to the new;
+- an order changing status moves all its lines to the new status.
+
+A line is filed under its book's category when it is written; moving a book
+to another category later, changing an order_date, or writes that skip the
+signals (queryset.update()) are picked up by manage.py rebuild_sales_rollups,
+which recomputes from the order items, archived ones included.
+"""
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate, TruncMonth
+from django.utils import timezone
+
+from .models import ArchivedOrderItem, Book, Category, Order, OrderItem, SalesRollup
+from .sales import REBUILD_BATCH_SIZE, batched, increment, sale_day
+
+NO_CATEGORY = 0
+KEY = ('day', 'category_id', 'status')
+COUNTERS = ('lines', 'units', 'revenue')
+GROUPS = ('day', 'month', 'category', 'status')
+DEFAULT_DAYS = 30
+
+
+def record(order_date, status, lines, sign=1):
+    """Add (sign=1) or take out (sign=-1) lines [(category_id, quantity, price)] of an order"""
+    totals = defaultdict(lambda: [0, 0, Decimal('0.00')])
+    for category_id, quantity, price in lines:
+        bucket = totals[category_id or NO_CATEGORY]
+        bucket[0] += sign
+        bucket[1] += sign * quantity
+        bucket[2] += sign * quantity * Decimal(price)
+    day = sale_day(order_date)
+    increment(SalesRollup, KEY, COUNTERS,
+              [(day, category_id, status, *counters) for category_id, counters in totals.items()])
+
+
+def record_line(order_id, book_id, quantity, price, sign):
+    order = Order.objects.filter(pk=order_id).values_list('order_date', 'status').first()
+    if order is None:
+        return
+    category_id = Book.objects.filter(pk=book_id).values_list('category_id', flat=True).first()
+    record(order[0], order[1], [(category_id, quantity, price)], sign)
+
+
+######################################################################################
+# called from api/signals.py, before api.sales remembers the new state
+
+def item_saved(item, created):
+    current = (item.order_id, item.book_id, item.quantity, Decimal(item.price))
+    stored = None if created else getattr(item, '_stored_sale', None)
+    if stored != current:
+        if stored and None not in stored:
+            record_line(*stored, sign=-1)
+        record_line(*current, sign=1)
+
+
+def item_deleted(item):
+    stored = getattr(item, '_stored_sale', None)
+    record_line(*(stored if stored and None not in stored else
+                  (item.order_id, item.book_id, item.quantity, item.price)), sign=-1)
+
+
+def order_saved(order, created):
+    stored = None if created else getattr(order, '_stored_status', None)
+    if stored and stored != order.status:
+        lines = list(order.items.values_list('book__category_id', 'quantity', 'price'))
+        record(order.order_date, stored, lines, sign=-1)
+        record(order.order_date, order.status, lines)
+
+
+######################################################################################
+# reports
+
+def sales_report(date_from=None, date_to=None, group_by=('day',), statuses=None, categories=None):
+    """
+    Rollup totals between two days (inclusive, default: the last DEFAULT_DAYS),
+    one row per combination of the `group_by` dimensions (see GROUPS)
+    """
+    date_to = date_to or timezone.localdate()
+    date_from = date_from or date_to - datetime.timedelta(days=DEFAULT_DAYS - 1)
+    rows = SalesRollup.objects.filter(day__gte=date_from, day__lte=date_to)
+    if statuses:
+        rows = rows.filter(status__in=statuses)
+    if categories:
+        rows = rows.filter(category_id__in=categories)
+    dimensions = {'day': F('day'), 'month': TruncMonth('day'), 'category': F('category_id'), 'status': F('status')}
+    keys = {f'by_{name}': dimensions[name] for name in group_by}
+    rows = (
+        rows.values(**keys)
+        .annotate(**{f'total_{name}': Sum(name) for name in COUNTERS})
+        .filter(total_lines__gt=0)
+        .order_by(*keys)
+    )
+    result = [
+        {**{name[3:]: row[name] for name in keys}, **{name: row[f'total_{name}'] for name in COUNTERS}}
+        for row in rows
+    ]
+    if 'category' in group_by:
+        names = dict(Category.objects.filter(pk__in={row['category'] for row in result})
+                     .values_list('category_id', 'category_name'))
+        for row in result:
+            row['category_name'] = names.get(row['category'])
+    return date_from, date_to, result
+
+
+######################################################################################
+# rebuild
+
+def rollup_rows(items, order_date):
+    return (
+        items.values(day=TruncDate(order_date), category=F('book__category_id'), status=F('order__status'))
+        .annotate(lines=Count('pk'), units=Sum('quantity'), revenue=Sum(F('quantity') * F('price')))
+        .order_by()
+        .iterator()
+    )
+
+
+def rebuild():
+    """Recompute every rollup row from the order items, archived ones included; returns the rows written"""
+    written = 0
+    with transaction.atomic():
+        SalesRollup.objects.all().delete()
+        for items, order_date in ((OrderItem.objects.all(), 'order__order_date'),
+                                  (ArchivedOrderItem.objects.all(), 'order_date')):
+            for batch in batched(rollup_rows(items, order_date), REBUILD_BATCH_SIZE):
+                increment(SalesRollup, KEY, COUNTERS, [
+                    (row['day'], row['category'] or NO_CATEGORY, row['status'],
+                     row['lines'], row['units'], row['revenue'])
+                    for row in batch
+                ])
+                written += len(batch)
+    return written
@@ -0,0 +1,198 @@
+"""
+Denormalized sales counters behind the bestseller rankings.
+
+Book.units_sold / Book.revenue hold all-time totals, BookSales one row per
+book and day (the order date). An order line counts while its order is not
+cancelled:
+- checkout (bulk_create) calls record() itself, OrderItem.save() goes
+  through the signals, editing a line applies the difference;
+- deleting a line, or moving its order to cancelled, takes it out again, and
+  moving an order back out of cancelled puts its lines back.
+Counters are shifted in SQL (UPDATE .. SET x = x + delta, and an INSERT ..
+ON CONFLICT DO UPDATE for the day rows) so concurrent checkouts never lose an
+increment. Writes that skip save() and the signals (queryset.update(),
+bulk_create on orders) are repaired by manage.py rebuild_sales, which also
+counts the lines moved to the archive (api/archive.py).
+
+Rankings read the counters: the all-time one walks the units_sold index, a
+window sums the day rows of its last N days, never the order items.
+"""
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+from itertools import islice
+
+from django.db import connection, transaction
+from django.db.models import Case, DecimalField, F, IntegerField, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import ArchivedOrderItem, Book, BookSales, Order, OrderItem
+
+CANCELLED = 'cancelled'
+WINDOWS = {'day': 1, 'week': 7, 'month': 30, 'year': 365, 'all': None}
+UPSERT_CHUNK_SIZE = 500
+# rankings are served from the response cache for this long, sales don't invalidate it
+RANKING_CACHE_TIMEOUT = 60
+REBUILD_BATCH_SIZE = 5000
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def sale_day(order_date):
+    return timezone.localdate(order_date) if timezone.is_aware(order_date) else order_date.date()
+
+
+def record(order_date, lines, sign=1):
+    """
+    Add (sign=1) or take out (sign=-1) order lines [(book_id, quantity, price)]
+    of an order placed at `order_date`: one UPDATE on the books, one upsert per
+    UPSERT_CHUNK_SIZE day rows
+    """
+    totals = defaultdict(lambda: [0, Decimal('0.00')])
+    for book_id, quantity, price in lines:
+        totals[book_id][0] += sign * quantity
+        totals[book_id][1] += sign * quantity * Decimal(price)
+    if not totals:
+        return
+    Book.objects.filter(pk__in=totals).update(
+        units_sold=F('units_sold') + Case(
+            *[When(pk=pk, then=Value(units)) for pk, (units, _) in totals.items()],
+            output_field=IntegerField(),
+        ),
+        revenue=F('revenue') + Case(
+            *[When(pk=pk, then=Value(revenue)) for pk, (_, revenue) in totals.items()],
+            output_field=DecimalField(max_digits=12, decimal_places=2),
+        ),
+    )
+    day = sale_day(order_date)
+    add_daily((book_id, day, units, revenue) for book_id, (units, revenue) in totals.items())
+
+
+def add_daily(rows):
+    """Increment BookSales rows [(book_id, day, units, revenue)], creating the missing ones"""
+    increment(BookSales, ('book', 'day'), ('units', 'revenue'), rows)
+
+
+def increment(model, keys, counters, rows):
+    """
+    Add rows [(*keys, *counters)] onto the `model` rows with the same `keys`
+    (a unique key of the model), creating the missing ones: one INSERT ..
+    ON CONFLICT DO UPDATE per UPSERT_CHUNK_SIZE rows
+    """
+    table = connection.ops.quote_name(model._meta.db_table)
+    fields = [model._meta.get_field(name) for name in (*keys, *counters)]
+    columns = [connection.ops.quote_name(field.column) for field in fields]
+    conflict = ', '.join(columns[:len(keys)])
+    updates = ', '.join(f'{column} = {table}.{column} + excluded.{column}' for column in columns[len(keys):])
+    placeholders = f'({", ".join(["%s"] * len(fields))})'
+    with connection.cursor() as cursor:
+        for chunk in batched(rows, UPSERT_CHUNK_SIZE):
+            params = [field.get_db_prep_value(value, connection) for row in chunk for field, value in zip(fields, row)]
+            cursor.execute(
+                f'INSERT INTO {table} ({", ".join(columns)}) VALUES {", ".join([placeholders] * len(chunk))} '
+                f'ON CONFLICT ({conflict}) DO UPDATE SET {updates}',
+                params,
+            )
+
+
+def counted_order(order_id):
+    """order_date of the order if its lines count as sales, else None"""
+    state = Order.objects.filter(pk=order_id).values_list('status', 'order_date').first()
+    return state[1] if state and state[0] != CANCELLED else None
+
+
+######################################################################################
+# called from api/signals.py
+
+def load_stored_sale(item):
+    stored = OrderItem.objects.filter(pk=item.pk).values_list('order_id', 'book_id', 'quantity', 'price').first()
+    item._stored_sale = stored or (None,) * 4
+
+
+def item_saved(item, created):
+    current = (item.order_id, item.book_id, item.quantity, Decimal(item.price))
+    stored = None if created else getattr(item, '_stored_sale', None)
+    if stored != current:
+        if stored and None not in stored:
+            order_date = counted_order(stored[0])
+            if order_date:
+                record(order_date, [stored[1:]], sign=-1)
+        order_date = counted_order(item.order_id)
+        if order_date:
+            record(order_date, [current[1:]])
+    item._remember_sale()
+
+
+def item_deleted(item):
+    stored = getattr(item, '_stored_sale', None)
+    order_id, book_id, quantity, price = stored if stored and None not in stored else (
+        item.order_id, item.book_id, item.quantity, item.price)
+    order_date = counted_order(order_id)
+    if order_date:
+        record(order_date, [(book_id, quantity, price)], sign=-1)
+
+
+def order_saved(order, created):
+    stored = None if created else getattr(order, '_stored_status', None)
+    if stored and stored != order.status and CANCELLED in (stored, order.status):
+        lines = order.items.values_list('book_id', 'quantity', 'price')
+        record(order.order_date, lines, sign=-1 if order.status == CANCELLED else 1)
+    order._remember_status()
+
+
+######################################################################################
+# rankings
+
+def bestsellers(window='week', category=None, limit=20):
+    """[(book_id, units, revenue)] best first, for the last `window` days (see WINDOWS)"""
+    days = WINDOWS[window]
+    if days is None:
+        books = Book.objects.filter(units_sold__gt=0)
+        if category is not None:
+            books = books.filter(category_id=category)
+        return list(books.order_by('-units_sold', '-revenue', 'pk').values_list('pk', 'units_sold', 'revenue')[:limit])
+    since = timezone.localdate() - datetime.timedelta(days=days - 1)
+    rows = BookSales.objects.filter(day__gte=since)
+    if category is not None:
+        rows = rows.filter(book__category_id=category)
+    return list(
+        rows.values('book_id')
+        .annotate(total_units=Sum('units'), total_revenue=Sum('revenue'))
+        .filter(total_units__gt=0)
+        .order_by('-total_units', '-total_revenue', 'book_id')
+        .values_list('book_id', 'total_units', 'total_revenue')[:limit]
+    )
+
+
+def rebuild(book_ids=None):
+    """Recompute every counter of the given books (default: all) from the order items; returns the books updated"""
+    books = Book.objects.all() if book_ids is None else Book.objects.filter(pk__in=book_ids)
+    items = OrderItem.objects.exclude(order__status=CANCELLED)
+    archived = ArchivedOrderItem.objects.exclude(order__status=CANCELLED)
+    daily = BookSales.objects.all()
+    if book_ids is not None:
+        items, archived, daily = (rows.filter(book_id__in=book_ids) for rows in (items, archived, daily))
+    with transaction.atomic():
+        updated = books.recompute_sales()
+        daily.delete()
+        for batch in batched(daily_totals(items, 'order__order_date'), REBUILD_BATCH_SIZE):
+            BookSales.objects.bulk_create([BookSales(**row) for row in batch])
+        # a day can have lines on both sides: add the archived ones onto the rows above
+        add_daily((row['book_id'], row['day'], row['units'], row['revenue'])
+                  for row in daily_totals(archived, 'order_date'))
+    return updated
+
+
+def daily_totals(items, order_date):
+    return (
+        items.annotate(day=TruncDate(order_date))
+        .values('book_id', 'day')
+        .annotate(units=Sum('quantity'), revenue=Sum(F('quantity') * F('price')))
+        .order_by()
+        .iterator()
+    )
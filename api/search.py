@@ -0,0 +1,199 @@
+"""
+Full-text search index over books, their authors and category.
+
+The index lives in a `book_search` table next to `books` (see migration 0008):
+  - PostgreSQL: a tsvector column with a GIN index, built with one text search
+    configuration per language in settings.BOOK_SEARCH_CONFIGS (english + arabic)
+  - SQLite: an FTS5 virtual table (porter + unicode61 tokenizer)
+Other databases fall back to unindexed icontains lookups.
+
+Text is normalized in Python before it reaches either backend so that the
+common Arabic spelling variants (diacritics, tatweel, alef/yaa/taa marbuta
+forms) index and query the same way. The index is kept current by the
+signal receivers in api/signals.py; `manage.py rebuild_search_index`
+rebuilds it after bulk loads.
+"""
+import re
+import unicodedata
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+
+from .models import Book
+
+# harakat, Quranic marks, superscript alef and tatweel
+ARABIC_MARKS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]')
+ARABIC_LETTERS = str.maketrans({'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا', 'ى': 'ي', 'ة': 'ه'})
+# definite article with its common attached prepositions / conjunctions
+ARABIC_ARTICLE = re.compile(r'^(?:وال|بال|كال|فال|لل|ال)(?=\w{2,})')
+WORD = re.compile(r'\w+')
+
+# relative weight of each indexed field, highest first
+FIELD_WEIGHTS = (('title', 'A', 10.0), ('authors', 'B', 5.0), ('category', 'C', 2.0), ('description', 'D', 1.0))
+INDEX_CHUNK_SIZE = 1000
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKC', text or '')
+    return ARABIC_MARKS.sub('', text).translate(ARABIC_LETTERS)
+
+
+def light_stem(text):
+    """Drop the Arabic definite article so that 'الكتاب' and 'كتاب' match (SQLite has no Arabic stemmer)"""
+    return ' '.join(ARABIC_ARTICLE.sub('', word) for word in WORD.findall(text))
+
+
+def book_documents(book_ids):
+    """Yield (book_id, {field: normalized text}) for the given books"""
+    books = Book.objects.filter(pk__in=book_ids).order_by().with_related().only(
+        'book_id', 'title', 'description', 'category__category_name'
+    )
+    for book in books:
+        yield book.pk, {
+            'title': normalize(book.title),
+            'authors': normalize(' '.join(author.author_name for author in book.authors.all())),
+            'category': normalize(book.category.category_name if book.category else ''),
+            'description': normalize(book.description),
+        }
+
+
+class PostgresSearchBackend:
+
+    def __init__(self):
+        self.configs = getattr(settings, 'BOOK_SEARCH_CONFIGS', ['english', 'arabic'])
+
+    def document_sql(self):
+        parts = [
+            f"setweight(to_tsvector(%s::regconfig, %s), '{weight}')"
+            for config in self.configs
+            for _, weight, _ in FIELD_WEIGHTS
+        ]
+        return ' || '.join(parts)
+
+    def index(self, cursor, documents):
+        sql = (
+            f'INSERT INTO book_search (book_id, document) VALUES (%s, {self.document_sql()}) '
+            'ON CONFLICT (book_id) DO UPDATE SET document = EXCLUDED.document'
+        )
+        rows = []
+        for book_id, fields in documents:
+            params = [book_id]
+            for config in self.configs:
+                for field, _, _ in FIELD_WEIGHTS:
+                    params += [config, fields[field]]
+            rows.append(params)
+        cursor.executemany(sql, rows)
+
+    def remove(self, cursor, book_ids):
+        cursor.execute('DELETE FROM book_search WHERE book_id = ANY(%s)', [list(book_ids)])
+
+    def clear(self, cursor):
+        cursor.execute('TRUNCATE book_search')
+
+    def search(self, cursor, query, limit):
+        tsquery = ' || '.join('websearch_to_tsquery(%s::regconfig, %s)' for _ in self.configs)
+        params = [value for config in self.configs for value in (config, normalize(query))]
+        cursor.execute(
+            f'SELECT book_id FROM book_search, (SELECT {tsquery} AS q) AS query '
+            'WHERE document @@ q ORDER BY ts_rank_cd(document, q) DESC, book_id LIMIT %s',
+            params + [limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+class SQLiteSearchBackend:
+
+    def index(self, cursor, documents):
+        documents = list(documents)
+        self.remove(cursor, [book_id for book_id, _ in documents])
+        cursor.executemany(
+            'INSERT INTO book_search (rowid, title, authors, category, description) VALUES (%s, %s, %s, %s, %s)',
+            [[book_id] + [light_stem(fields[field]) for field, _, _ in FIELD_WEIGHTS] for book_id, fields in documents],
+        )
+
+    def remove(self, cursor, book_ids):
+        book_ids = list(book_ids)
+        if book_ids:
+            placeholders = ', '.join(['%s'] * len(book_ids))
+            cursor.execute(f'DELETE FROM book_search WHERE rowid IN ({placeholders})', book_ids)
+
+    def clear(self, cursor):
+        cursor.execute('DELETE FROM book_search')
+
+    def search(self, cursor, query, limit):
+        # quote every term so user input can't inject FTS5 operators; terms are ANDed
+        terms = light_stem(normalize(query)).split()
+        if not terms:
+            return []
+        match = ' '.join('"%s"' % term.replace('"', '""') for term in terms)
+        weights = ', '.join(str(weight) for _, _, weight in FIELD_WEIGHTS)
+        cursor.execute(
+            f'SELECT rowid FROM book_search WHERE book_search MATCH %s '
+            f'ORDER BY bm25(book_search, {weights}), rowid LIMIT %s',
+            [match, limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+class FallbackSearchBackend:
+    """Unindexed substring search for databases without a native full-text index"""
+
+    def index(self, cursor, documents):
+        pass
+
+    def remove(self, cursor, book_ids):
+        pass
+
+    def clear(self, cursor):
+        pass
+
+    def search(self, cursor, query, limit):
+        condition = Q()
+        for term in query.split():
+            condition &= (Q(title__icontains=term) | Q(description__icontains=term)
+                          | Q(authors__author_name__icontains=term) | Q(category__category_name__icontains=term))
+        return list(Book.objects.filter(condition).values_list('pk', flat=True).distinct()[:limit])
+
+
+BACKENDS = {
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SQLiteSearchBackend,
+}
+
+
+def get_backend():
+    return BACKENDS.get(connection.vendor, FallbackSearchBackend)()
+
+
+def reindex_books(book_ids):
+    """(Re)build the index entries of the given books; ids that no longer exist are removed"""
+    book_ids = list(book_ids)
+    backend = get_backend()
+    with connection.cursor() as cursor:
+        for start in range(0, len(book_ids), INDEX_CHUNK_SIZE):
+            chunk = book_ids[start:start + INDEX_CHUNK_SIZE]
+            documents = list(book_documents(chunk))
+            backend.index(cursor, documents)
+            found = {book_id for book_id, _ in documents}
+            backend.remove(cursor, [book_id for book_id in chunk if book_id not in found])
+
+
+def remove_books(book_ids):
+    with connection.cursor() as cursor:
+        get_backend().remove(cursor, book_ids)
+
+
+def rebuild_index():
+    """Drop and rebuild the whole index, returns the number of books indexed"""
+    with connection.cursor() as cursor:
+        get_backend().clear(cursor)
+    book_ids = list(Book.objects.order_by('pk').values_list('pk', flat=True))
+    reindex_books(book_ids)
+    return len(book_ids)
+
+
+def search_books(query, limit=20):
+    """Book ids matching `query`, most relevant first"""
+    with connection.cursor() as cursor:
+        return get_backend().search(cursor, query, limit)
@@ -1,8 +1,18 @@
+from django.db import transaction
+from django.db.models import Sum
 from rest_framework import serializers
-from .models import Category,Authors,Book,Review,Order,OrderItem,User
+from rest_framework.utils.serializer_helpers import ReturnDict
+from .models import (
+    ArchivedOrder, ArchivedOrderItem, Category, Authors, Book, Review, Order, OrderItem,
+    StockReservation, StockReservationItem, User,
+)
+from . import cache, inventory, reports, sales
+from .fastpath import ValuesListSerializer
+from .images import derivative_urls
+from .sparse import SparseFieldsMixin
 # from django.contrib.auth.models import User
 # #user serializer
-class RegisterSerializer( serializers.ModelSerializer ) :
+class RegisterSerializer( SparseFieldsMixin, serializers.ModelSerializer ) :
     password = serializers.CharField( write_only = True , style = { "input_type" : "password" } )
     password_confirm = serializers.CharField( write_only = True , style = { "input_type" : "password"})
 
@@ -19,71 +29,347 @@ class RegisterSerializer( serializers.ModelSerializer ) :
         validated_data.pop( 'password_confirm' )
         password = validated_data.pop( 'password' )
 
-        user = User.objects.create( **validated_data )
+        # set the password before the first save so it is hashed only once
+        user = User( **validated_data )
         user.set_password( password )
         user.save()
         return user
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model=User
         fields=['id','first_name','last_name','email','role']
 #category serializer
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model=Category
         fields=('category_id','category_name')
+        list_serializer_class=ValuesListSerializer
+
+class ImageDerivativesField(serializers.ReadOnlyField):
+    """{size: {format: url}} for the resized copies built by api.images, {} until they exist"""
+
+    def to_representation(self, value):
+        return derivative_urls(value or {}, self.context.get('request'))
+
 #authors serializer
-class AuthorsSerializer(serializers.ModelSerializer):
+class AuthorsSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    photo_images = ImageDerivativesField(source='photo_derivatives')
+
     class Meta:
         model=Authors
-        fields=('author_id','author_name','author_photo')
+        fields=('author_id','author_name','author_photo','photo_images')
+        list_serializer_class=ValuesListSerializer
 #book serializer
-class BookSerializer(serializers.ModelSerializer):
+class BookSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model=Book
         fields=('book_id','ISBN','title','authors','description',
-                'price','publication_date','book_cover_photo','availability'
+                'price','publication_date','book_cover_photo','availability','stock'
                 ,'category','avg_rating','total_reviews','created_at','updated_at')
+        # moved by F() deltas only (api/inventory.py): restock with POST books/<id>/stock/
+        read_only_fields=('stock',)
+
+    def update(self, instance, validated_data):
+        # write the edited columns only: the stock loaded with the book may be
+        # stale by now, and tracked stock decides availability
+        if instance.stock is not None:
+            validated_data.pop('availability', None)
+        authors = validated_data.pop('authors', None)
+        for name, value in validated_data.items():
+            setattr(instance, name, value)
+        instance.save(update_fields=[*validated_data, 'updated_at'])
+        if authors is not None:
+            instance.authors.set(authors)
+        return instance
+
+#restock: copies added (or written off, negative) to a book's stock
+class RestockSerializer(serializers.Serializer):
+    quantity = serializers.IntegerField()
+
+    def validate_quantity(self, quantity):
+        if quantity == 0:
+            raise serializers.ValidationError('quantity must not be 0')
+        return quantity
 
-class BookListSerializer( serializers.ModelSerializer ) :
+class BookListSerializer( SparseFieldsMixin, serializers.ModelSerializer ) :
 
     authors = AuthorsSerializer(many=True)
+    cover_images = ImageDerivativesField(source='cover_derivatives')
     # authors = serializers.SlugRelatedField( read_only = True  , slug_field = 'author_name' , many = True )
     class Meta :
         model = Book
-        fields = [ 'book_id' , 'title' , 'authors' , 'price' , 'book_cover_photo',]
+        fields = [ 'book_id' , 'title' , 'authors' , 'price' , 'book_cover_photo', 'cover_images',]
+        list_serializer_class = ValuesListSerializer
 
 #Review serializer
-class ReviewSerializer(serializers.ModelSerializer):
+class ReviewSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model=Review
         fields=('review_id','user','book','rating','review_text')
+
+class ReviewBulkListSerializer(serializers.ListSerializer):
+    """
+    Validates and writes a whole batch of reviews at once
+    FK existence is checked with one query per table, rows are inserted with
+    bulk_create and each affected book's rating is recomputed once at the end
+    """
+    CONFLICT_POLICIES = ('skip', 'update')
+
+    missing = None
+
+    def validate(self, attrs):
+        missing = {}
+        for field, model in (('user_id', User), ('book_id', Book)):
+            ids = {model._meta.pk.to_python(row[field]) for row in attrs}
+            found = set(model.objects.filter(pk__in=ids).values_list('pk', flat=True))
+            if ids - found:
+                missing[field[:-3]] = sorted(ids - found)
+        if missing:
+            self.missing = missing
+            raise serializers.ValidationError({'missing': missing})
+        return attrs
+
+    @property
+    def errors(self):
+        # ValidationError turns every detail into a string, the unknown ids are reported as pks
+        if self.missing:
+            return ReturnDict({'missing': self.missing}, serializer=self)
+        return super().errors
+
+    def create(self, validated_data):
+        on_conflict = self.context.get('on_conflict', 'skip')
+        # the last row wins when the batch itself repeats a (user, book) pair
+        rows = {(row['user_id'], row['book_id']): row for row in validated_data}
+        reviews = [Review(**row) for row in rows.values()]
+        book_ids = {book_id for _, book_id in rows}
+        affected_books = Book.objects.filter(pk__in=book_ids)
+        with transaction.atomic():
+            reviews_before = affected_books.aggregate(total=Sum('total_reviews'))['total'] or 0
+            if on_conflict == 'update':
+                Review.objects.bulk_create(
+                    reviews, batch_size=1000, update_conflicts=True,
+                    unique_fields=['user', 'book'], update_fields=['rating', 'review_text'],
+                )
+            else:
+                Review.objects.bulk_create(reviews, batch_size=1000, ignore_conflicts=True)
+            affected_books.recompute_ratings()
+            cache.invalidate_books(book_ids)
+            reviews_after = affected_books.aggregate(total=Sum('total_reviews'))['total'] or 0
+        created = reviews_after - reviews_before
+        self.stats = {
+            'received': len(validated_data),
+            'created': created,
+            'updated' if on_conflict == 'update' else 'skipped': len(reviews) - created,
+            'books_updated': len(book_ids),
+        }
+        return reviews
+
+
+class ReviewBulkSerializer(ReviewSerializer):
+    # plain ids: existence is checked for the whole batch in ReviewBulkListSerializer
+    user = serializers.IntegerField(source='user_id')
+    book = serializers.IntegerField(source='book_id')
+
+    class Meta(ReviewSerializer.Meta):
+        fields = ('user', 'book', 'rating', 'review_text')
+        # (user, book) duplicates are resolved by the conflict policy, not rejected
+        validators = []
+        list_serializer_class = ReviewBulkListSerializer
+
+class StockCheckedMixin:
+    """
+    Saves in a transaction: an order un-cancelled or a line added or grown
+    takes its stock (api/inventory.py), a book short of it makes the whole
+    write a 400 on `stock_field`
+    """
+    stock_field = None
+
+    def save(self, **kwargs):
+        try:
+            with transaction.atomic():
+                return super().save(**kwargs)
+        except inventory.InsufficientStock as e:
+            raise serializers.ValidationError({self.stock_field: [str(e)]})
+
 #Order serializzer
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(StockCheckedMixin, SparseFieldsMixin, serializers.ModelSerializer):
+    stock_field = 'status'
+
     class Meta:
         model=Order
         fields=('order_id','user','order_date','total_price','status')
 #OrderItem serializer
-class OrderItemSerializer(serializers.ModelSerializer):
+class OrderItemSerializer(StockCheckedMixin, SparseFieldsMixin, serializers.ModelSerializer):
+    stock_field = 'quantity'
+
     class Meta:
         model=OrderItem
         fields=('order_item_id','order','book','quantity','price')
 
+# archived orders (api/archive.py) are read-only history, same payload as the hot ones
+class ArchivedOrderSerializer(OrderSerializer):
+    class Meta(OrderSerializer.Meta):
+        model=ArchivedOrder
+        read_only_fields=OrderSerializer.Meta.fields
+
+class ArchivedOrderItemSerializer(OrderItemSerializer):
+    class Meta(OrderItemSerializer.Meta):
+        model=ArchivedOrderItem
+        read_only_fields=OrderItemSerializer.Meta.fields
+
+#checkout: an order with all its lines in one request
+class CheckoutItemSerializer(serializers.Serializer):
+    book = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1)
+
+
+class OrderLineSerializer(serializers.ModelSerializer):
+    class Meta:
+        model=OrderItem
+        fields=('order_item_id','book','quantity','price')
+
+
+def cart_lines(items):
+    """Merge repeated books of [{book, quantity}] into one line each, with the Book loaded"""
+    quantities = {}
+    for item in items:
+        quantities[item['book']] = quantities.get(item['book'], 0) + item['quantity']
+    books = Book.objects.only('book_id', 'category_id', 'price', 'availability', 'stock').in_bulk(list(quantities))
+    missing = sorted(set(quantities) - set(books))
+    if missing:
+        raise serializers.ValidationError(f'Unknown books: {missing}')
+    # books that track stock are checked when it's taken (api/inventory.py)
+    unavailable = sorted(pk for pk, book in books.items() if book.stock is None and book.availability != 'in_stock')
+    if unavailable:
+        raise serializers.ValidationError(f'Out of stock: {unavailable}')
+    return [{'book': books[pk], 'quantity': quantity} for pk, quantity in quantities.items()]
+
+
+class CheckoutSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """
+    Creates an Order and its OrderItems atomically
+    Prices come from the books (fetched in one query), never from the client,
+    and total_price is computed from the lines
+    The lines come from `items`, whose stock is taken here, or from a
+    `reservation` of the user, whose stock is already held
+    """
+    items = CheckoutItemSerializer(many=True, allow_empty=False, write_only=True, required=False)
+    reservation = serializers.PrimaryKeyRelatedField(
+        queryset=StockReservation.objects.all(), write_only=True, required=False)
+
+    class Meta:
+        model=Order
+        fields=('order_id','user','order_date','total_price','status','items','reservation')
+        read_only_fields=('order_date','total_price','status')
+
+    def validate_items(self, items):
+        return cart_lines(items)
+
+    def validate(self, attrs):
+        reservation = attrs.get('reservation')
+        if ('items' in attrs) == (reservation is not None):
+            raise serializers.ValidationError('Send either items or a reservation')
+        if reservation is not None:
+            if reservation.user_id != attrs['user'].pk:
+                raise serializers.ValidationError({'reservation': ['Reservation belongs to another user']})
+            if reservation.is_expired:
+                raise serializers.ValidationError({'reservation': ['Reservation expired']})
+            lines = reservation.items.values_list('book_id', 'quantity')
+            attrs['items'] = cart_lines([{'book': book_id, 'quantity': quantity} for book_id, quantity in lines])
+        return attrs
+
+    def create(self, validated_data):
+        lines = validated_data.pop('items')
+        reservation = validated_data.pop('reservation', None)
+        items = [OrderItem(book=line['book'], quantity=line['quantity'], price=line['book'].price) for line in lines]
+        with transaction.atomic():
+            if reservation is None:
+                try:
+                    inventory.take({line['book'].pk: line['quantity'] for line in lines})
+                except inventory.InsufficientStock as e:
+                    raise serializers.ValidationError({'items': [str(e)]})
+            else:
+                # locked, so a concurrent checkout or release can't use it too
+                reservation = StockReservation.objects.select_for_update().filter(pk=reservation.pk).first()
+                if reservation is None:
+                    raise serializers.ValidationError({'reservation': ['Reservation was already used or released']})
+                if reservation.is_expired:
+                    raise serializers.ValidationError({'reservation': ['Reservation expired']})
+                inventory.consume(reservation)
+            order = Order.objects.create(total_price=sum(item.total_price for item in items), **validated_data)
+            for item in items:
+                item.order = order
+            order.lines = OrderItem.objects.bulk_create(items)
+            # bulk_create skips the signals that keep the sales counters and rollups
+            sales.record(order.order_date, [(item.book_id, item.quantity, item.price) for item in items])
+            reports.record(order.order_date, order.status,
+                           [(item.book.category_id, item.quantity, item.price) for item in items])
+        return order
+
+    def to_representation(self, order):
+        data = super().to_representation(order)
+        data['items'] = OrderLineSerializer(getattr(order, 'lines', None) or order.items.all(), many=True).data
+        return data
+
+
+#stock reservation: holds stock for a cart until expires_at
+class ReservationLineSerializer(serializers.ModelSerializer):
+    class Meta:
+        model=StockReservationItem
+        fields=('book','quantity')
+
+
+class ReservationSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    items = CheckoutItemSerializer(many=True, allow_empty=False, write_only=True)
+
+    class Meta:
+        model=StockReservation
+        fields=('reservation_id','user','created_at','expires_at','items')
+        read_only_fields=('created_at','expires_at')
+
+    def validate_items(self, items):
+        return cart_lines(items)
+
+    def create(self, validated_data):
+        quantities = {line['book'].pk: line['quantity'] for line in validated_data['items']}
+        try:
+            return inventory.reserve(validated_data['user'], quantities)
+        except inventory.InsufficientStock as e:
+            raise serializers.ValidationError({'items': [str(e)]})
+
+    def to_representation(self, reservation):
+        data = super().to_representation(reservation)
+        lines = getattr(reservation, 'lines', None) or reservation.items.all()
+        data['items'] = ReservationLineSerializer(lines, many=True).data
+        return data
+
 
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
 from rest_framework import serializers
 from django.contrib.auth import authenticate
+from django.contrib.auth.models import update_last_login
 
 class CustomLoginSerializer(TokenObtainPairSerializer):
     email = serializers.EmailField()
     password = serializers.CharField(write_only=True)
 
+    @classmethod
+    def get_token(cls, user):
+        # claims read by ClaimsJWTAuthentication, so read-only requests need no users lookup
+        token = super().get_token(user)
+        token['email'] = user.email
+        token['role'] = user.role
+        return token
+
     def validate(self, attrs):
         email = attrs.get('email')
         password = attrs.get('password')
 
+        # the only password hash of the login: tokens are minted for this user below,
+        # TokenObtainPairSerializer.validate() is not called because it would authenticate again
         user = authenticate(request=self.context.get('request'), email=email, password=password)
 
         if not user:
@@ -92,8 +378,14 @@ class CustomLoginSerializer(TokenObtainPairSerializer):
         if not user.is_active:
             raise serializers.ValidationError('User account is disabled.')
 
-        # استدعاء الكود الأصلي لتوليد التوكنات
-        data = super().validate(attrs)
+        self.user = user
+        refresh = self.get_token(user)
+        data = {
+            'refresh': str(refresh),
+            'access': str(refresh.access_token),
+        }
+        if jwt_settings.UPDATE_LAST_LOGIN:
+            update_last_login(None, user)
         data['user'] = {
             'id': user.id,
             'email': user.email,
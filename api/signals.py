@@ -0,0 +1,206 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import cache, images, inventory, middleware, reports, sales, search
+from .authentication import forget_user
+from .models import Authors, Book, Category, Order, OrderItem, Review, StockReservation, User
+
+
+@receiver(post_delete, sender=Review)
+def review_deleted(sender, instance, **kwargs):
+    """
+    Take a deleted review out of its book's rating counters
+    Runs for direct deletes and for cascades (e.g. deleting the user)
+    """
+    rating = getattr(instance, '_stored_rating', None) or instance.rating
+    book_id = getattr(instance, '_stored_book_id', None) or instance.book_id
+    Book.apply_rating_change(book_id, -rating, -1)
+
+######################################################################################
+# search index maintenance
+
+SEARCH_FIELDS = {'title', 'description', 'category', 'category_id'}
+
+
+@receiver(post_save, sender=Book)
+def book_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or SEARCH_FIELDS & set(update_fields):
+        search.reindex_books([instance.pk])
+
+
+@receiver(post_delete, sender=Book)
+def book_deleted(sender, instance, **kwargs):
+    search.remove_books([instance.pk])
+
+
+@receiver(m2m_changed, sender=Book.authors.through)
+def book_authors_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        # the author's books are gone by post_clear, remember them now
+        instance._book_ids = list(instance.books.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if not reverse:
+            search.reindex_books([instance.pk])
+        elif action == 'post_clear':
+            search.reindex_books(getattr(instance, '_book_ids', []))
+        else:
+            search.reindex_books(pk_set)
+
+
+@receiver(post_save, sender=Authors)
+@receiver(post_save, sender=Category)
+def catalog_name_saved(sender, instance, created, **kwargs):
+    if not created:
+        search.reindex_books(instance.books.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Authors)
+@receiver(pre_delete, sender=Category)
+def catalog_name_deleting(sender, instance, **kwargs):
+    instance._book_ids = list(instance.books.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Authors)
+@receiver(post_delete, sender=Category)
+def catalog_name_deleted(sender, instance, **kwargs):
+    search.reindex_books(getattr(instance, '_book_ids', []))
+
+######################################################################################
+# cover / author photo derivatives
+
+@receiver(post_save, sender=Book)
+@receiver(post_save, sender=Authors)
+def image_saved(sender, instance, **kwargs):
+    if images.needs_derivatives(instance):
+        images.schedule(instance)
+
+######################################################################################
+# catalog response cache invalidation
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def book_changed(sender, instance, **kwargs):
+    cache.invalidate_books([instance.pk])
+
+
+@receiver(m2m_changed, sender=Book.authors.through)
+def book_authors_changed_cache(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        if not reverse:
+            cache.invalidate_books([instance.pk])
+        else:
+            cache.invalidate_books(pk_set if pk_set is not None else getattr(instance, '_book_ids', []))
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def review_changed_cache(sender, instance, **kwargs):
+    # ratings live on the book; a review moved to another book changes both
+    cache.invalidate_books({instance.book_id, getattr(instance, '_stored_book_id', None) or instance.book_id})
+
+
+@receiver(post_save, sender=Authors)
+@receiver(post_delete, sender=Authors)
+def author_changed(sender, instance, **kwargs):
+    # book lists nest the author name and photo
+    cache.bump('authors')
+    cache.bump('books')
+    if kwargs.get('signal') is post_delete:
+        cache.invalidate_books(getattr(instance, '_book_ids', []))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, instance, **kwargs):
+    cache.bump('categories')
+    if kwargs.get('signal') is post_delete:
+        # books of a deleted category now have category = NULL
+        cache.invalidate_books(getattr(instance, '_book_ids', []))
+
+######################################################################################
+# Book.updated_at drives the conditional GET validators (api/conditional.py):
+# bump it when a book's payload changes without Book.save()
+
+@receiver(m2m_changed, sender=Book.authors.through)
+def book_authors_changed_touch(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        if not reverse:
+            Book.objects.filter(pk=instance.pk).touch()
+        else:
+            Book.objects.filter(pk__in=pk_set if pk_set is not None else getattr(instance, '_book_ids', [])).touch()
+
+
+@receiver(post_save, sender=Authors)
+def author_saved_touch(sender, instance, created, **kwargs):
+    # book lists nest the author
+    if not created:
+        Book.objects.filter(authors=instance).touch()
+
+
+@receiver(post_delete, sender=Authors)
+@receiver(post_delete, sender=Category)
+def catalog_name_deleted_touch(sender, instance, **kwargs):
+    Book.objects.filter(pk__in=getattr(instance, '_book_ids', [])).touch()
+
+######################################################################################
+# sales counters (api/sales.py), reporting rollups (api/reports.py) and stock;
+# checkout's bulk_create records its lines itself
+
+@receiver(pre_save, sender=OrderItem)
+def order_item_saving(sender, instance, **kwargs):
+    # an instance that wasn't loaded from the database: the stored line is needed for the delta
+    if instance.pk is not None and not hasattr(instance, '_stored_sale'):
+        sales.load_stored_sale(instance)
+
+
+@receiver(post_save, sender=OrderItem)
+def order_item_saved(sender, instance, created, **kwargs):
+    # stock and rollups first: sales.item_saved remembers the new line
+    inventory.item_saved(instance, created)
+    reports.item_saved(instance, created)
+    sales.item_saved(instance, created)
+
+
+@receiver(post_delete, sender=OrderItem)
+def order_item_deleted(sender, instance, **kwargs):
+    inventory.item_deleted(instance)
+    reports.item_deleted(instance)
+    sales.item_deleted(instance)
+
+
+@receiver(pre_save, sender=Order)
+def order_saving(sender, instance, **kwargs):
+    if instance.pk is not None and not hasattr(instance, '_stored_status'):
+        instance._stored_status = Order.objects.filter(pk=instance.pk).values_list('status', flat=True).first()
+
+
+@receiver(post_save, sender=Order)
+def order_saved(sender, instance, created, **kwargs):
+    # stock and rollups first: sales.order_saved remembers the new status
+    inventory.order_saved(instance, created)
+    reports.order_saved(instance, created)
+    sales.order_saved(instance, created)
+
+######################################################################################
+# stock reservations (api/inventory.py)
+
+@receiver(pre_delete, sender=StockReservation)
+def reservation_deleting(sender, instance, **kwargs):
+    # cancelled, expired or cascaded from its user: the held stock goes back
+    inventory.reservation_deleting(instance)
+
+######################################################################################
+# JWT authentication user cache
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    forget_user(instance.pk)
+
+######################################################################################
+# per-request SQL instrumentation (api/middleware.py)
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    middleware.install(connection)
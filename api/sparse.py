@@ -0,0 +1,72 @@
+"""
+Sparse fieldsets: ?fields=a,b keeps only those fields, ?omit=a,b drops them.
+
+Only the output of the top-level serializer is filtered; input validation of
+POST/PUT is unchanged. project() narrows the queryset to the columns the
+remaining fields read (.only()) and prefetches only the relations they render,
+so an omitted field also stops costing SQL.
+"""
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+
+
+def split(value):
+    return {name.strip() for name in value.split(',') if name.strip()} if value else None
+
+
+def sparse_context(request):
+    """Serializer context for the ?fields= / ?omit= parameters of `request` (DRF or Django)"""
+    params = request.GET
+    return {'fields': split(params.get('fields')), 'omit': split(params.get('omit'))}
+
+
+def is_selected(name, context):
+    fields, omit = context.get('fields'), context.get('omit')
+    return (not fields or name in fields) and (not omit or name not in omit)
+
+
+class SparseFieldsMixin:
+    """Serializer mixin that applies the context's fields / omit to its output"""
+
+    @property
+    def _readable_fields(self):
+        top_level = self.parent is None or (
+            isinstance(self.parent, serializers.ListSerializer) and self.parent.parent is None
+        )
+        for field in super()._readable_fields:
+            if not top_level or is_selected(field.field_name, self.context):
+                yield field
+
+
+def output_fields(serializer_class, context):
+    return [
+        field for name, field in serializer_class().fields.items()
+        if not field.write_only and is_selected(name, context)
+    ]
+
+
+def project(queryset, serializer_class, context, keep=()):
+    """
+    Restrict `queryset` to what the selected fields of `serializer_class` read
+    Concrete fields go to .only(), to-many relations are prefetched. Anything
+    else (methods, properties, dotted sources, nested FK serializers) leaves the
+    queryset untouched, since the columns it needs can't be told in advance.
+    `keep` lists extra columns the caller needs (e.g. the pagination ordering).
+    """
+    model = queryset.model
+    only = {model._meta.pk.name, *keep}
+    prefetch = []
+    for field in output_fields(serializer_class, context):
+        if field.source == '*' or '.' in field.source:
+            return queryset
+        try:
+            model_field = model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            return queryset
+        if model_field.many_to_many or model_field.one_to_many:
+            prefetch.append(field.source)
+        elif model_field.concrete and not isinstance(field, serializers.BaseSerializer):
+            only.add(field.source)
+        else:
+            return queryset
+    return queryset.select_related(None).prefetch_related(None).only(*only).prefetch_related(*prefetch)
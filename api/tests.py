@@ -1,3 +1,1747 @@
-from django.test import TestCase
+import csv
+import datetime
+from decimal import Decimal
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth.hashers import MD5PasswordHasher
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import Sum
+from django.http import QueryDict
+from django.test import TestCase, TransactionTestCase, override_settings
+from PIL import Image
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient, APIRequestFactory
+
+from . import exports
+from .authentication import ClaimsJWTAuthentication
+from .cache import get_cache as get_catalog_cache
+from .management.commands.bench import api_route_names
+from .middleware import QueryBudgetExceeded, normalize
+from .pagination import KeysetPagination
+from .filters import filter_books
+from .models import (
+    User, Category, Authors, Book, BookSales, IdempotencyKey, Review, Order, OrderItem, ArchivedOrder,
+    ArchivedOrderItem, SalesRollup, StockReservation,
+)
+from .renderers import ORJSONRenderer
+from .search import PostgresSearchBackend
+from .serializers import AuthorsSerializer, BookListSerializer, BookSerializer, CategorySerializer
+from .throttling import WriteRateThrottle, get_cache as get_throttle_cache, stats as throttle_stats
+
+
+def throttle_rates(**rates):
+    return override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': rates})
+
+
+# every test client request comes from 127.0.0.1: only ThrottleTests turns the rate limits on
+no_throttling = throttle_rates()
+# fixture covers aren't real files: only ImageDerivativeTests builds derivatives, from real uploads
+no_image_derivatives = override_settings(IMAGE_DERIVATIVES=False)
+
+
+def setUpModule():
+    no_throttling.enable()
+    no_image_derivatives.enable()
+
+
+def tearDownModule():
+    no_image_derivatives.disable()
+    no_throttling.disable()
+
+
+def make_book(n, category=None, authors=(), **extra):
+    fields = {
+        'ISBN': str(n).zfill(13),
+        'title': f'Book {n}',
+        'description': 'description',
+        'price': 10,
+        'publication_date': datetime.date(2020, 1, 1),
+        'book_cover_photo': 'covers/arw.jpg',
+        'category': category,
+    }
+    book = Book.objects.create(**{**fields, **extra})
+    book.authors.set(authors)
+    return book
+
+
+def bulk_books(count, **extra):
+    """`count` books in one INSERT, no signals; returns their ids"""
+    fields = {'description': '', 'price': 10, 'publication_date': datetime.date(2020, 1, 1), **extra}
+    books = Book.objects.bulk_create(Book(ISBN=f'9{n:012}', title=f'Bulk {n}', **fields) for n in range(count))
+    return [book.pk for book in books]
+
+
+class KeysetPaginationTests(TestCase):
+
+    def setUp(self):
+        get_catalog_cache().clear()
+        self.client = APIClient()
+
+    def walk(self, url, params=None, link='next'):
+        """Every page from `url` following `link`: [[book_id, ...], ...]"""
+        pages = []
+        response = self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, 200, response.content)
+            page = response.json()
+            pages.append([row['book_id'] for row in page['results']])
+            if not page[link]:
+                return pages, page
+            self.assertLessEqual(len(pages), 100, 'the pages never run out')
+            response = self.client.get(page[link])
+
+    def test_deep_pages_cost_the_same_as_the_first(self):
+        ids = bulk_books(120)
+        first = self.client.get(reverse('books-list'), {'page_size': 10}).json()
+        pages, last = self.walk(reverse('books-list'), {'page_size': 10})
+        self.assertEqual(len(pages), 12)
+        self.assertEqual(sum(pages, []), sorted(ids, reverse=True))
+        get_catalog_cache().clear()
+        # ETag validator + books + authors prefetch, on page 12 as on page 1
+        with self.assertNumQueries(3):
+            self.client.get(first['next'])
+        with self.assertNumQueries(3):
+            self.client.get(last['previous'])
+
+    def test_rows_tying_on_the_first_ordering_column(self):
+        # ('-created_at', '-book_id'): one created_at for all, only book_id tells them apart
+        ids = bulk_books(25)
+        Book.objects.update(created_at=timezone.now())
+        pages, last = self.walk(reverse('books-list'), {'page_size': 4})
+        self.assertEqual([len(page) for page in pages], [4] * 6 + [1])
+        self.assertEqual(sum(pages, []), sorted(ids, reverse=True))
+        self.assertIsNone(last['next'])
+        # and back: the same pages, in reverse order
+        back, first = self.walk(last['previous'], link='previous')
+        self.assertEqual(back, pages[-2::-1])
+        self.assertIsNone(first['previous'])
+
+    def test_page_size_bounds(self):
+        bulk_books(510)
+        for page_size, expected in (('1', 1), ('500', 500), ('501', 500), ('100000', 500),
+                                    ('0', 50), ('-3', 50), ('many', 50)):
+            with self.subTest(page_size=page_size):
+                response = self.client.get(reverse('books-list'), {'page_size': page_size, 'fields': 'book_id'})
+                self.assertEqual(len(response.json()['results']), expected)
+
+    def test_invalid_cursors_are_not_found(self):
+        bulk_books(3)
+        # not base64, p=notjson, p=["1"] (one column of two), p=["x", "y"], p=[1, 2]
+        for cursor in ('garbage!', 'cD1ub3Rqc29u', 'cD0lNUIlMjIxJTIyJTVE', 'cD0lNUIlMjJ4JTIyJTJDKyUyMnklMjIlNUQ=',
+                       'cD0lNUIxJTJDKzIlNUQ='):
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self.client.get(reverse('books-list'), {'cursor': cursor}).status_code, 404)
+
+
+class BookQueryCountTests(TestCase):
+    """The book list/detail must not issue one authors query per book"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(category_name='Fiction')
+        cls.authors = [Authors.objects.create(author_name=f'Author {i}') for i in range(3)]
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def assert_list_queries(self, count):
+        for n in range(count):
+            make_book(n, self.category, self.authors)
+        # ETag validator + books + authors prefetch, independent of the number of books
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('books-list'))
+        self.assertEqual(len(response.json()), count)
+
+    def test_list_query_count_is_constant(self):
+        self.assert_list_queries(2)
+
+    def test_list_query_count_is_constant_for_larger_lists(self):
+        self.assert_list_queries(25)
+
+    def test_paginated_list_query_count(self):
+        for n in range(10):
+            make_book(n, self.category, self.authors)
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('books-list'), {'page_size': 5})
+        self.assertEqual(len(response.json()['results']), 5)
+
+    def test_detail_query_count(self):
+        book = make_book(1, self.category, self.authors)
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('books-detail', args=[book.pk]))
+        self.assertEqual(len(response.json()['authors']), 3)
+
+    def test_str_uses_prefetched_authors(self):
+        for n in range(5):
+            make_book(n, self.category, self.authors)
+        with self.assertNumQueries(2):
+            names = [str(book) for book in Book.objects.with_related()]
+        self.assertEqual(len(names), 5)
+
+
+class RatingAggregateTests(TestCase):
+    """avg_rating / total_reviews are maintained incrementally by Review writes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(email=f'reader{i}@example.com', password='pass', first_name='R', last_name=str(i))
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        self.book = make_book(1)
+        self.other = make_book(2)
+
+    def assert_rating(self, book, avg, count):
+        book.refresh_from_db()
+        self.assertEqual(book.total_reviews, count)
+        self.assertAlmostEqual(float(book.avg_rating), avg, places=2)
+
+    def test_create_edit_delete(self):
+        review = Review.objects.create(user=self.users[0], book=self.book, rating=5, review_text='')
+        Review.objects.create(user=self.users[1], book=self.book, rating=2, review_text='')
+        self.assert_rating(self.book, 3.5, 2)
+
+        review.rating = 3
+        review.save()
+        self.assert_rating(self.book, 2.5, 2)
+
+        review.book = self.other
+        review.save()
+        self.assert_rating(self.book, 2.0, 1)
+        self.assert_rating(self.other, 3.0, 1)
+
+        Review.objects.get(pk=review.pk).delete()
+        self.assert_rating(self.other, 0.0, 0)
+
+    def test_cascade_delete_updates_counters(self):
+        Review.objects.create(user=self.users[0], book=self.book, rating=4, review_text='')
+        Review.objects.create(user=self.users[1], book=self.book, rating=1, review_text='')
+        self.users[1].delete()
+        self.assert_rating(self.book, 4.0, 1)
+
+    def test_write_does_not_scan_reviews(self):
+        for user in self.users[:2]:
+            Review.objects.create(user=user, book=self.book, rating=4, review_text='')
+        # INSERT + counters UPDATE (inside a savepoint), whatever the number of existing reviews
+        with self.assertNumQueries(4):
+            Review.objects.create(user=self.users[2], book=self.book, rating=1, review_text='')
+
+    def test_recompute_matches_incremental(self):
+        for rating, user in zip((5, 4, 1), self.users):
+            Review.objects.create(user=user, book=self.book, rating=rating, review_text='')
+        Book.objects.filter(pk=self.book.pk).update(rating_sum=0, total_reviews=0, avg_rating=0)
+        Book.objects.all().recompute_ratings()
+        self.assert_rating(self.book, 10 / 3, 3)
+
+
+class ReviewBulkTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(email=f'bulk{i}@example.com', password='pass', first_name='B', last_name=str(i))
+            for i in range(4)
+        ]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.book = make_book(1)
+        Review.objects.create(user=self.users[0], book=self.book, rating=1, review_text='old')
+
+    def post_batch(self, on_conflict):
+        rows = [{'user': user.pk, 'book': self.book.pk, 'rating': 5, 'review_text': 'new'} for user in self.users]
+        return self.client.post(f"{reverse('review-bulk')}?on_conflict={on_conflict}", rows, format='json')
+
+    def test_skip_keeps_existing_reviews(self):
+        response = self.post_batch('skip')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['created'], 3)
+        self.assertEqual(response.json()['skipped'], 1)
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.total_reviews, float(self.book.avg_rating)), (4, 4.0))
+
+    def test_update_overwrites_existing_reviews(self):
+        response = self.post_batch('update')
+        self.assertEqual(response.json()['updated'], 1)
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.total_reviews, float(self.book.avg_rating)), (4, 5.0))
+
+    def test_unknown_book_rejects_batch(self):
+        rows = [{'user': self.users[1].pk, 'book': 999, 'rating': 5, 'review_text': 'text'}]
+        response = self.client.post(reverse('review-bulk'), rows, format='json')
+        self.assertEqual(response.status_code, 400)
+        missing = response.json()['missing']
+        self.assertEqual(missing, {'book': [999]})
+        self.assertIsInstance(missing['book'][0], int)
+
+    def test_ids_sent_as_strings_are_reported_as_pks(self):
+        rows = [{'user': str(self.users[1].pk), 'book': '99999', 'rating': 5, 'review_text': 'text'},
+                {'user': '99998', 'book': str(self.book.pk), 'rating': 4, 'review_text': 'text'}]
+        response = self.client.post(reverse('review-bulk'), rows, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['missing'], {'user': [99998], 'book': [99999]})
+
+
+class BookSearchTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.category = Category.objects.create(category_name='Poetry')
+        self.author = Authors.objects.create(author_name='Mahmoud Darwish')
+        self.arabic = make_book(1, self.category, [self.author], title='ذاكرة للنسيان')
+        self.english = make_book(2, title='Running Libraries', description='How public libraries are run')
+
+    def search(self, q):
+        response = self.client.get(reverse('books-search'), {'q': q})
+        self.assertEqual(response.status_code, 200)
+        return [book['book_id'] for book in response.json()]
+
+    def test_english_stemming_and_ranking(self):
+        title_match = make_book(3, title='Library', description='nothing')
+        self.assertEqual(self.search('library'), [title_match.pk, self.english.pk])
+
+    def test_arabic_spelling_variants(self):
+        # diacritics, taa marbuta / haa and the definite article are normalized away
+        self.assertEqual(self.search('ذَاكِرَه'), [self.arabic.pk])
+        self.assertEqual(self.search('النسيان'), [self.arabic.pk])
+
+    def test_author_and_category_changes_reindex(self):
+        self.assertEqual(self.search('darwish'), [self.arabic.pk])
+        self.author.author_name = 'محمود درويش'
+        self.author.save()
+        self.assertEqual(self.search('darwish'), [])
+        self.assertEqual(self.search('درويش'), [self.arabic.pk])
+
+        self.english.authors.add(self.author)
+        self.assertEqual(set(self.search('درويش')), {self.arabic.pk, self.english.pk})
+
+        self.category.delete()
+        self.assertEqual(self.search('poetry'), [])
+
+    def test_limit(self):
+        make_book(3, title='Library', description='nothing')
+        response = self.client.get(reverse('books-search'), {'q': 'library', 'limit': 1})
+        self.assertEqual(len(response.json()), 1)
+        for limit in ('0', '-1', 'ten'):
+            with self.subTest(limit=limit):
+                response = self.client.get(reverse('books-search'), {'q': 'library', 'limit': limit})
+                self.assertEqual(response.status_code, 400)
+
+    def test_deleted_books_leave_the_index(self):
+        self.english.delete()
+        self.assertEqual(self.search('libraries'), [])
+
+    def test_postgres_backend_sql(self):
+        # the statements and parameters of the tsvector backend, whatever database runs the tests
+        cursor = mock.Mock()
+        cursor.fetchall.return_value = [(7,), (3,)]
+        backend = PostgresSearchBackend()
+        backend.configs = ['english', 'arabic']
+        backend.index(cursor, [(7, {'title': 'ذاكرة', 'authors': 'Darwish', 'category': 'Poetry', 'description': 'd'})])
+        sql, rows = cursor.executemany.call_args.args
+        self.assertEqual(sql.count('to_tsvector(%s::regconfig, %s)'), 8)
+        self.assertEqual([sql.index(f"'{weight}')") < sql.index("'D')") for weight in 'ABC'], [True] * 3)
+        self.assertIn('ON CONFLICT (book_id) DO UPDATE', sql)
+        self.assertEqual(rows, [[7, 'english', 'ذاكرة', 'english', 'Darwish', 'english', 'Poetry', 'english', 'd',
+                                 'arabic', 'ذاكرة', 'arabic', 'Darwish', 'arabic', 'Poetry', 'arabic', 'd']])
+
+        self.assertEqual(backend.search(cursor, 'ذَاكِرَة', 20), [7, 3])
+        sql, params = cursor.execute.call_args.args
+        self.assertIn('websearch_to_tsquery(%s::regconfig, %s) || websearch_to_tsquery(%s::regconfig, %s)', sql)
+        self.assertIn('ORDER BY ts_rank_cd(document, q) DESC, book_id LIMIT %s', sql)
+        # the query is normalized like the documents (no harakat, taa marbuta as haa)
+        self.assertEqual(params, ['english', 'ذاكره', 'arabic', 'ذاكره', 20])
+
+
+@skipUnless(connection.vendor == 'postgresql', 'tsvector search backend')
+class PostgresSearchTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def search(self, q):
+        response = self.client.get(reverse('books-search'), {'q': q})
+        self.assertEqual(response.status_code, 200)
+        return [book['book_id'] for book in response.json()]
+
+    def test_title_outranks_authors_category_and_description(self):
+        category = make_book(1, Category.objects.create(category_name='Gardens'), title='Notes', description='x')
+        description = make_book(2, title='Essays', description='a book about gardens')
+        author = make_book(3, title='Poems', description='x')
+        author.authors.add(Authors.objects.create(author_name='Anna Garden'))
+        title = make_book(4, title='Gardens of the North', description='x')
+        self.assertEqual(self.search('garden'), [title.pk, author.pk, category.pk, description.pk])
+
+    def test_arabic_stemming_and_spelling_variants(self):
+        book = make_book(1, title='الكتاب الأخضر', description='مكتبة')
+        make_book(2, title='Green', description='English only')
+        self.assertEqual(self.search('كتاب'), [book.pk])
+        self.assertEqual(self.search('الاخضر'), [book.pk])
+        self.assertEqual(self.search('مكتبه'), [book.pk])
+
+    def test_websearch_syntax_is_accepted(self):
+        book = make_book(1, title='Running Libraries', description='public libraries')
+        make_book(2, title='Running Shoes', description='sport')
+        self.assertEqual(self.search('"running libraries" -shoes'), [book.pk])
+        self.assertEqual(self.search('libraries or shoes -running'), [])
+
+
+class ImageDerivativeTests(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.client = APIClient()
+
+    def upload(self, name, size):
+        buffer = io.BytesIO()
+        Image.new('RGB', size, 'red').save(buffer, format='JPEG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+    def test_cover_derivatives_are_built_after_upload(self):
+        with override_settings(MEDIA_ROOT=self.media_root, IMAGE_DERIVATIVES=True, IMAGE_DERIVATIVE_WORKERS=0,
+                               IMAGE_DERIVATIVE_SIZES={'thumb': 120, 'medium': 480}):
+            with self.captureOnCommitCallbacks(execute=True):
+                book = make_book(1, book_cover_photo=self.upload('cover.jpg', (1200, 1800)))
+            book.refresh_from_db()
+            self.assertEqual(book.cover_derivatives['source'], book.book_cover_photo.name)
+
+            with open(f"{self.media_root}/{book.cover_derivatives['thumb']['webp']}", 'rb') as f:
+                self.assertEqual(Image.open(f).size, (120, 180))
+
+            cover = self.client.get(reverse('books-list')).json()[0]['cover_images']
+            self.assertEqual(set(cover), {'thumb', 'medium'})
+            self.assertTrue(cover['thumb']['webp'].endswith('covers/derivatives/cover/thumb.webp'))
+
+    def test_small_images_are_not_upscaled(self):
+        with override_settings(MEDIA_ROOT=self.media_root, IMAGE_DERIVATIVES=True, IMAGE_DERIVATIVE_WORKERS=0):
+            with self.captureOnCommitCallbacks(execute=True):
+                author = Authors.objects.create(author_name='A', author_photo=self.upload('a.jpg', (100, 100)))
+            author.refresh_from_db()
+            with open(f"{self.media_root}/{author.photo_derivatives['medium']['webp']}", 'rb') as f:
+                self.assertEqual(Image.open(f).size, (100, 100))
+
+    def test_turned_off(self):
+        with override_settings(MEDIA_ROOT=self.media_root, IMAGE_DERIVATIVE_WORKERS=0):
+            with self.captureOnCommitCallbacks() as callbacks:
+                book = make_book(1, book_cover_photo=self.upload('cover.jpg', (300, 300)))
+        self.assertEqual(callbacks, [])
+        book.refresh_from_db()
+        self.assertEqual(book.cover_derivatives, {})
+
+
+class CatalogCacheTests(TestCase):
+
+    def setUp(self):
+        get_catalog_cache().clear()
+        self.client = APIClient()
+        self.category = Category.objects.create(category_name='History')
+        self.author = Authors.objects.create(author_name='Ibn Khaldun')
+        self.book = make_book(1, self.category, [self.author])
+
+    def test_repeated_reads_skip_the_database(self):
+        for name, args in (('books-list', []), ('books-detail', [self.book.pk]),
+                           ('authors-list', []), ('category-list', [])):
+            first = self.client.get(reverse(name, args=args))
+            # the conditional GET validators are cached with the response
+            with self.assertNumQueries(0):
+                second = self.client.get(reverse(name, args=args))
+            self.assertEqual(first.json(), second.json())
+
+    def test_writes_invalidate(self):
+        detail = reverse('books-detail', args=[self.book.pk])
+        self.client.get(reverse('books-list'))
+        self.client.get(detail)
+
+        self.author.author_name = 'Ibn Battuta'
+        self.author.save()
+        self.assertEqual(self.client.get(reverse('books-list')).json()[0]['authors'][0]['author_name'], 'Ibn Battuta')
+
+        user = User.objects.create_user(email='cache@example.com', password='pass', first_name='C', last_name='C')
+        Review.objects.create(user=user, book=self.book, rating=4, review_text='good')
+        self.assertEqual(self.client.get(detail).json()['total_reviews'], 1)
+
+        self.category.delete()
+        self.assertIsNone(self.client.get(detail).json()['category'])
+
+        self.book.delete()
+        self.assertEqual(self.client.get(detail).status_code, 404)
+        self.assertEqual(self.client.get(reverse('books-list')).json(), [])
+
+
+class ConditionalGetTests(TestCase):
+
+    def setUp(self):
+        get_catalog_cache().clear()
+        self.client = APIClient()
+        self.author = Authors.objects.create(author_name='Naguib Mahfouz')
+        self.book = make_book(1, authors=[self.author])
+
+    def assert_revalidates(self, url, change):
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        change()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_detail_not_modified_until_a_review_changes_the_rating(self):
+        user = User.objects.create_user(email='etag@example.com', password='pass', first_name='E', last_name='T')
+        url = reverse('books-detail', args=[self.book.pk])
+        self.assert_revalidates(url, lambda: Review.objects.create(user=user, book=self.book, rating=5, review_text='!'))
+
+    def test_detail_last_modified(self):
+        url = reverse('books-detail', args=[self.book.pk])
+        last_modified = self.client.get(url)['Last-Modified']
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+    def test_list_changes_with_nested_author(self):
+        def rename():
+            self.author.author_name = 'Taha Hussein'
+            self.author.save()
+        self.assert_revalidates(reverse('books-list'), rename)
+
+    def test_list_changes_on_delete(self):
+        make_book(2)
+        self.assert_revalidates(reverse('books-list'), self.book.delete)
+
+    def test_catalog_lists(self):
+        self.assert_revalidates(reverse('authors-list'), lambda: Authors.objects.create(author_name='New'))
+        self.assert_revalidates(reverse('category-list'), lambda: Category.objects.create(category_name='New'))
+
+
+class OrderExportTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        user = User.objects.create_user(email='buyer@example.com', password='pass', first_name='B', last_name='Y')
+        self.book = make_book(1)
+        self.orders = []
+        for n, order_status in enumerate(('delivered', 'cancelled', 'delivered')):
+            order = Order.objects.create(user=user, total_price=20, status=order_status)
+            Order.objects.filter(pk=order.pk).update(order_date=datetime.datetime(2025, 1, n + 1, 12, tzinfo=datetime.timezone.utc))
+            OrderItem.objects.create(order=order, book=self.book, quantity=2, price=10)
+            self.orders.append(order)
+
+    def export(self, **params):
+        response = self.client.get(reverse('order-export'), params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_ndjson_filters_by_date_and_status(self):
+        lines = self.export(**{'from': '2025-01-01', 'to': '2025-01-02', 'status': 'delivered'}).splitlines()
+        self.assertEqual(len(lines), 1)
+        row = json.loads(lines[0])
+        self.assertEqual((row['order_id'], row['isbn'], row['line_total']), (self.orders[0].pk, self.book.ISBN, '20.00'))
+
+    def test_csv(self):
+        rows = list(csv.reader(io.StringIO(self.export(output='csv'))))
+        self.assertEqual(rows[0][:2], ['order_id', 'user_id'])
+        self.assertEqual([int(row[0]) for row in rows[1:]], [order.pk for order in self.orders])
+
+    def test_invalid_filters(self):
+        self.assertEqual(self.client.get(reverse('order-export'), {'status': 'lost'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('order-export'), {'from': 'yesterday'}).status_code, 400)
+
+    async def test_streams_under_asgi(self):
+        read, order_lines = [], exports.order_lines
+
+        def lines(**filters):
+            for line in order_lines(**filters):
+                read.append(line)
+                yield line
+
+        expected = await sync_to_async(self.export)()
+        with mock.patch('api.exports.STREAM_LINES', 1), mock.patch('api.exports.order_lines', lines):
+            response = await self.async_client.get(reverse('order-export'))
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.is_async)
+            chunks = aiter(response.streaming_content)
+            first = await anext(chunks)
+            # the first line went out before the rest of the export was read
+            self.assertEqual(len(read), 1)
+            rest = [chunk async for chunk in chunks]
+        self.assertEqual(b''.join([first, *rest]).decode(), expected)
+        self.assertEqual(len(read), 3)
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command('export_orders', '--status', 'cancelled', stdout=out)
+        self.assertEqual(json.loads(out.getvalue())['order_id'], self.orders[1].pk)
+
+
+class CheckoutTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='checkout@example.com', password='pass', first_name='C', last_name='O')
+        self.books = [make_book(n, price=n * 10) for n in range(1, 21)]
+
+    def test_order_with_lines_in_one_request(self):
+        items = [{'book': book.pk, 'quantity': 2} for book in self.books]
+        items.append({'book': self.books[0].pk, 'quantity': 1})
+        # user + books validation, stock lock, order INSERT, items bulk INSERT, sales
+        # counters (one books UPDATE, one daily upsert), rollup upsert, in a savepoint
+        with self.assertNumQueries(10):
+            response = self.client.post(reverse('order-checkout'), {'user': self.user.pk, 'items': items}, format='json')
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual(len(data['items']), 20)
+        self.assertEqual(data['items'][0]['quantity'], 3)
+        self.assertEqual(data['total_price'], '4210.00')
+        order = Order.objects.get(pk=data['order_id'])
+        self.assertEqual(order.items.count(), 20)
+
+    def test_client_cannot_set_prices(self):
+        items = [{'book': self.books[0].pk, 'quantity': 1, 'price': '0.01'}]
+        response = self.client.post(reverse('order-checkout'), {'user': self.user.pk, 'items': items, 'total_price': '0.01'}, format='json')
+        self.assertEqual(response.json()['total_price'], '10.00')
+        self.assertEqual(response.json()['items'][0]['price'], '10.00')
+
+    def test_unknown_or_unavailable_books_create_nothing(self):
+        Book.objects.filter(pk=self.books[1].pk).update(availability='out_of_stock')
+        for book_id in (999, self.books[1].pk):
+            items = [{'book': self.books[0].pk, 'quantity': 1}, {'book': book_id, 'quantity': 1}]
+            response = self.client.post(reverse('order-checkout'), {'user': self.user.pk, 'items': items}, format='json')
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class LoginTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.credentials = {'email': 'login@example.com', 'password': 'a-long-password'}
+
+    def login(self):
+        return self.client.post(reverse('login'), self.credentials, format='json')
+
+    def test_login_hashes_the_password_once(self):
+        User.objects.create_user(first_name='L', last_name='I', **self.credentials)
+        with mock.patch.object(MD5PasswordHasher, 'verify', autospec=True, side_effect=MD5PasswordHasher.verify) as verify:
+            response = self.login()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(verify.call_count, 1)
+        self.assertEqual(set(response.json()), {'refresh', 'access', 'user'})
+
+    def test_registered_user_can_log_in(self):
+        data = {**self.credentials, 'password_confirm': self.credentials['password'], 'first_name': 'R', 'last_name': 'G'}
+        self.assertEqual(self.client.post(reverse('register-user'), data, format='json').status_code, 201)
+        self.assertEqual(self.login().status_code, 200)
+
+    def test_wrong_password(self):
+        User.objects.create_user(first_name='L', last_name='I', **self.credentials)
+        self.credentials['password'] = 'wrong'
+        self.assertEqual(self.login().status_code, 400)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ClaimsAuthenticationTests(TestCase):
+
+    def setUp(self):
+        get_catalog_cache().clear()
+        self.user = User.objects.create_user(email='jwt@example.com', password='pass', first_name='J', last_name='W', role='admin')
+        response = APIClient().post(reverse('login'), {'email': 'jwt@example.com', 'password': 'pass'}, format='json')
+        self.auth_header = f"Bearer {response.json()['access']}"
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=self.auth_header)
+        self.factory = APIRequestFactory()
+
+    def authenticate(self, method):
+        request = getattr(self.factory, method)('/api/books/', HTTP_AUTHORIZATION=self.auth_header)
+        return ClaimsJWTAuthentication().authenticate(request)[0]
+
+    def test_reads_use_claims_without_a_query(self):
+        with self.assertNumQueries(0):
+            user = self.authenticate('get')
+            self.assertEqual((user.id, user.email, user.role), (self.user.pk, 'jwt@example.com', 'admin'))
+        self.assertEqual(user.instance, self.user)
+
+    def test_writes_load_the_user_through_the_cache(self):
+        first = self.authenticate('post')
+        with self.assertNumQueries(0):
+            second = self.authenticate('post')
+        self.assertEqual(first, second)
+        self.assertIsNot(first, second)
+
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate('post')
+
+    def test_authenticated_catalog_read(self):
+        make_book(1)
+        self.assertEqual(self.client.get(reverse('books-list')).status_code, 200)
+
+
+class SparseFieldsTests(TestCase):
+
+    def setUp(self):
+        get_catalog_cache().clear()
+        self.client = APIClient()
+        self.category = Category.objects.create(category_name='Poetry')
+        self.authors = [Authors.objects.create(author_name=f'Poet {i}') for i in range(2)]
+        self.books = [make_book(n, self.category, self.authors) for n in range(3)]
+
+    def test_fields_limit_the_output_and_skip_the_prefetch(self):
+        # ETag validator + books, the authors prefetch is not needed
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('books-list'), {'fields': 'book_id,title'})
+        self.assertEqual([sorted(row) for row in response.json()], [['book_id', 'title']] * 3)
+
+    def test_projection_keeps_the_pagination_cursor_working(self):
+        response = self.client.get(reverse('books-list'), {'fields': 'title', 'page_size': 2})
+        page = response.json()
+        self.assertEqual([sorted(row) for row in page['results']], [['title']] * 2)
+        rest = self.client.get(page['next']).json()
+        self.assertEqual(len(rest['results']), 1)
+
+    def test_omit_on_detail(self):
+        book = self.books[0]
+        response = self.client.get(reverse('books-detail', args=[book.pk]), {'omit': 'description,authors'})
+        data = response.json()
+        self.assertNotIn('description', data)
+        self.assertNotIn('authors', data)
+        self.assertEqual(data['title'], book.title)
+        self.assertEqual(data['category'], self.category.pk)
+
+    def test_nested_serializers_are_not_filtered(self):
+        response = self.client.get(reverse('books-list'), {'fields': 'authors'})
+        self.assertEqual(sorted(response.json()[0]['authors'][0]),
+                         ['author_id', 'author_name', 'author_photo', 'photo_images'])
+
+    def test_write_responses_honour_fields(self):
+        response = self.client.post(
+            reverse('category-list') + '?fields=category_id',
+            {'category_name': 'Drama'}, format='json',
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(list(response.json()), ['category_id'])
+
+
+class FastJSONTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(category_name='Travel')
+        cls.authors = [Authors.objects.create(author_name=name, photo_derivatives={'source': 'a.jpg'})
+                       for name in ('Ibn Battuta', 'Al-Idrisi')]
+        make_book(1, cls.category, cls.authors, price='12.50')
+        make_book(2, cls.category, cls.authors[:1], book_cover_photo='')
+        make_book(3, price=7)
+
+    def test_values_fast_path_matches_instances(self):
+        for serializer_class, queryset in ((BookListSerializer, Book.objects.with_related()),
+                                           (AuthorsSerializer, Authors.objects.all()),
+                                           (CategorySerializer, Category.objects.all())):
+            with self.subTest(serializer_class.__name__):
+                fast = serializer_class(queryset, many=True).data
+                slow = serializer_class(list(queryset), many=True).data
+                self.assertEqual(json.dumps(fast), json.dumps(slow))
+
+    def test_values_fast_path_honours_sparse_fields(self):
+        context = {'fields': {'title', 'price'}, 'omit': None}
+        queryset = Book.objects.all()
+        fast = BookListSerializer(queryset, many=True, context=context).data
+        self.assertEqual(fast, BookListSerializer(list(queryset), many=True, context=context).data)
+        self.assertEqual(sorted(fast[0]), ['price', 'title'])
+
+    def test_renderer_matches_drf(self):
+        data = {'title': 'Rihla   الرحلة', 'price': Decimal('12.50'), 1: None,
+                'when': datetime.datetime(2026, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc)}
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_parser_rejects_invalid_json(self):
+        client = APIClient()
+        response = client.post(reverse('category-list'), '{"category_name": ', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        response = client.post(reverse('category-list'), '{"category_name": "Maps"}', content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+
+
+class AsyncCatalogTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(category_name='Science')
+        cls.authors = [Authors.objects.create(author_name=name) for name in ('Ibn al-Haytham', 'Al-Biruni')]
+        cls.books = [make_book(n, cls.category, cls.authors) for n in range(3)]
+        cls.users = [User.objects.create(first_name='Reader', last_name=str(n), email=f'r{n}@example.com', password='x')
+                     for n in range(3)]
+        for user, rating in zip(cls.users, (3, 5)):
+            Review.objects.create(user=user, book=cls.books[0], rating=rating, review_text='good')
+
+    def setUp(self):
+        get_catalog_cache().clear()
+
+    async def test_same_payload_as_sync_views(self):
+        book = self.books[0]
+        for sync_name, async_name, args, params in (
+                ('category-list', 'async-category-list', [], {}),
+                ('authors-list', 'async-authors-list', [], {}),
+                ('books-list', 'async-books-list', [], {'fields': 'book_id,title'}),
+                ('books-detail', 'async-books-detail', [book.pk], {}),
+                ('books-detail', 'async-books-detail', [book.pk], {'omit': 'authors'})):
+            with self.subTest(async_name, params=params):
+                expected = (await self.async_client.get(reverse(sync_name, args=args), params)).json()
+                response = await self.async_client.get(reverse(async_name, args=args), params)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json(), expected)
+
+    async def test_book_list_filters_sorts_and_pages_like_the_sync_view(self):
+        def results(data):
+            # the links point at each view's own path
+            return data if isinstance(data, list) else (data['results'], bool(data['next']), bool(data['previous']))
+
+        await Book.objects.filter(pk=self.books[1].pk).aupdate(price=5)
+        for params in ({'sort': 'price', 'page_size': 2}, {'sort': 'rating', 'page_size': 1, 'fields': 'book_id'},
+                       {'category': self.category.pk, 'price_max': '9'}, {'page_size': 10000}):
+            with self.subTest(params=params):
+                expected = (await self.async_client.get(reverse('books-list'), params)).json()
+                response = await self.async_client.get(reverse('async-books-list'), params)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(results(response.json()), results(expected))
+        page = (await self.async_client.get(reverse('async-books-list'), {'sort': 'price', 'page_size': 2})).json()
+        self.assertEqual([book['book_id'] for book in page['results']], [self.books[1].pk, self.books[0].pk])
+        self.assertIn('/api/async/books/', page['next'])
+        rest = (await self.async_client.get(page['next'])).json()
+        self.assertEqual([book['book_id'] for book in rest['results']], [self.books[2].pk])
+        self.assertIsNotNone(rest['previous'])
+
+    async def test_book_list_rejects_bad_parameters(self):
+        self.assertEqual((await self.async_client.get(reverse('async-books-list'), {'sort': 'title'})).status_code, 400)
+        self.assertEqual((await self.async_client.get(reverse('async-books-list'), {'cursor': 'x'})).status_code, 404)
+
+    async def test_conditional_get(self):
+        url = reverse('async-books-detail', args=[self.books[1].pk])
+        first = await self.async_client.get(url)
+        second = await self.async_client.get(url, headers={'if-none-match': first['ETag']})
+        self.assertEqual(second.status_code, 304)
+
+    async def test_book_reviews(self):
+        url = reverse('async-book-reviews', args=[self.books[0].pk])
+        response = await self.async_client.get(url, {'limit': 1})
+        self.assertEqual([review['rating'] for review in response.json()], [5])
+        await Review.objects.acreate(user=self.users[2], book=self.books[0], rating=1, review_text='meh')
+        response = await self.async_client.get(url)
+        self.assertEqual([review['rating'] for review in response.json()], [1, 5, 3])
+        for limit in ('0', '-1', 'ten'):
+            with self.subTest(limit=limit):
+                self.assertEqual((await self.async_client.get(url, {'limit': limit})).status_code, 400)
+
+    async def test_missing_book(self):
+        response = await self.async_client.get(reverse('async-books-detail', args=[999]))
+        self.assertEqual(response.status_code, 404)
+        response = await self.async_client.get(reverse('async-book-reviews', args=[999]))
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(QUERY_BUDGET_MODE='fail')
+class QueryInstrumentationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(category_name='Philosophy')
+        authors = [Authors.objects.create(author_name=f'Thinker {i}') for i in range(3)]
+        cls.books = [make_book(n, category, authors) for n in range(10)]
+
+    def setUp(self):
+        get_catalog_cache().clear()
+        self.client = APIClient()
+
+    def test_server_timing_header(self):
+        response = self.client.get(reverse('books-list'))
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="3 queries", app;dur=[\d.]+$')
+
+    def test_catalog_reads_stay_within_budget(self):
+        for name, args in (('books-list', []), ('books-detail', [self.books[0].pk]),
+                           ('authors-list', []), ('category-list', []),
+                           ('review-list', []), ('order-list', []), ('orderItems-list', [])):
+            with self.subTest(name):
+                self.assertEqual(self.client.get(reverse(name, args=args)).status_code, 200)
+
+    @override_settings(QUERY_BUDGETS={('books-list', 'GET'): 1})
+    def test_exceeded_budget_fails(self):
+        with self.assertRaises(QueryBudgetExceeded), self.assertLogs('api.sql', 'WARNING'):
+            self.client.get(reverse('books-list'))
+        get_catalog_cache().clear()
+        with self.assertRaises(QueryBudgetExceeded), self.assertLogs('api.sql', 'WARNING'):
+            self.client.head(reverse('books-list'))
+
+    def test_writes_are_not_held_to_the_read_budgets(self):
+        user = User.objects.create_user(email='budget@example.com', password='pass', first_name='B', last_name='U')
+        with self.assertNoLogs('api.sql', 'WARNING'):
+            response = self.client.post(reverse('order-list'), {'user': user.pk, 'total_price': '10.00'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        response = self.client.post(reverse('order-checkout'), {
+            'user': user.pk, 'items': [{'book': book.pk, 'quantity': 1} for book in self.books[:5]],
+        }, format='json', HTTP_IDEMPOTENCY_KEY='budget-checkout')
+        self.assertEqual(response.status_code, 201)
+
+    @override_settings(QUERY_BUDGETS={('order-list', 'POST'): 1})
+    def test_exceeded_write_budget_is_only_logged(self):
+        user = User.objects.create_user(email='budget@example.com', password='pass', first_name='B', last_name='U')
+        with self.assertLogs('api.sql', 'WARNING'):
+            response = self.client.post(reverse('order-list'), {'user': user.pk, 'total_price': '10.00'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(Order.objects.filter(user=user).exists())
+
+    @override_settings(SQL_REPEAT_THRESHOLD=5, QUERY_BUDGETS={})
+    def test_repeated_statements_are_reported(self):
+        # without the prefetch every book of the page queries its own authors
+        with mock.patch('api.pagination.project', lambda queryset, *args, **kwargs: queryset), \
+                mock.patch.object(Book.objects, 'with_related', Book.objects.all), \
+                self.assertLogs('api.sql', 'WARNING') as logs:
+            self.client.get(reverse('books-list'), {'page_size': 10})
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(line['url_name'], 'books-list')
+        self.assertEqual(line['repeated'][0]['count'], 10)
+        self.assertIn('authors', line['repeated'][0]['sql'])
+
+    def test_normalize_folds_literals_and_in_lists(self):
+        self.assertEqual(normalize("SELECT 1 FROM t WHERE a IN (%s, %s, %s) AND b = 'x'"),
+                         'SELECT ? FROM t WHERE a IN (%s, ...) AND b = ?')
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class SeedAndBenchTests(TestCase):
+
+    def seed(self, **counts):
+        options = {'categories': 3, 'authors': 10, 'books': 30, 'users': 6, 'reviews': 40, 'orders': 12,
+                   'batch_size': 7, 'skip_search_index': True, **counts}
+        call_command('seed', stdout=io.StringIO(), **options)
+
+    def test_seed_counts_and_derived_data(self):
+        self.seed()
+        self.assertEqual((Category.objects.count(), Authors.objects.count(), Book.objects.count()), (3, 10, 30))
+        self.assertEqual((User.objects.count(), Review.objects.count(), Order.objects.count()), (6, 40, 12))
+        self.assertFalse(Book.objects.filter(authors=None).exists())
+        book = Book.objects.filter(total_reviews__gt=0).first()
+        ratings = list(book.reviews.values_list('rating', flat=True))
+        self.assertEqual((book.total_reviews, book.rating_sum), (len(ratings), sum(ratings)))
+        for order in Order.objects.prefetch_related('items'):
+            self.assertEqual(order.total_price, sum(item.price * item.quantity for item in order.items.all()))
+        # a second run adds to the data instead of colliding with it
+        self.seed()
+        self.assertEqual(Book.objects.count(), 60)
+
+    def test_seed_rejects_impossible_review_count(self):
+        with self.assertRaises(CommandError):
+            self.seed(users=2, books=3, reviews=7)
+
+    def test_bench_covers_every_route(self):
+        self.seed(skip_search_index=False)
+        with tempfile.NamedTemporaryFile(suffix='.json') as output:
+            call_command('bench', iterations=3, output=output.name, stdout=io.StringIO(), stderr=io.StringIO())
+            results = json.load(output)
+        routes = results['routes']
+        self.assertEqual(set(routes), set(api_route_names()))
+        for name, result in routes.items():
+            with self.subTest(name):
+                self.assertNotIn('skipped', result)
+                self.assertTrue(all(int(code) < 400 for code in result['statuses']), result['statuses'])
+                self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+        # the benchmark's writes are rolled back
+        self.assertFalse(User.objects.filter(email__startswith='bench-').exists())
+
+    @throttle_rates(login='30/min', login_email='10/min')
+    def test_bench_login_runs_past_the_login_throttle(self):
+        get_throttle_cache().clear()
+        out = io.StringIO()
+        call_command('bench_login', requests=20, stdout=out)
+        self.assertIn('speedup', out.getvalue())
+        self.assertFalse(User.objects.filter(email__startswith='bench-').exists())
+
+
+class CatalogImportTests(TestCase):
+
+    def write(self, suffix, content):
+        f = tempfile.NamedTemporaryFile('w', suffix=suffix, encoding='utf-8', delete=False)
+        f.write(content)
+        f.close()
+        self.addCleanup(os.unlink, f.name)
+        return f.name
+
+    def run_import(self, path, **options):
+        out, err = io.StringIO(), io.StringIO()
+        call_command('import_catalog', path, stdout=out, stderr=err, **options)
+        return out.getvalue(), err.getvalue()
+
+    def csv_file(self, rows):
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(['isbn', 'title', 'authors', 'category', 'price', 'publication_date'])
+        writer.writerows(rows)
+        return self.write('.csv', output.getvalue())
+
+    def test_csv_upserts_books_and_dedupes_names(self):
+        Category.objects.create(category_name='Poetry')
+        Authors.objects.create(author_name='Nizar Qabbani')
+        path = self.csv_file([
+            ['978-0-00-000001-1', 'Poems', 'Nizar Qabbani; Mahmoud Darwish', 'Poetry', '12.5', '1990-05-01'],
+            ['9780000000028', 'Letters', 'Mahmoud Darwish', 'Essays', '20', '19950102'],
+            ['9780000000035', 'x' * 60, 'Someone', 'Essays', '9', '2000-01-01'],
+            ['', 'No ISBN', 'Someone', 'Essays', '9', '2000-01-01'],
+        ])
+        out, err = self.run_import(path, batch_size=2)
+        self.assertIn('2 created', out)
+        self.assertIn('2 invalid', out)
+        self.assertIn('title is missing or too long', err)
+        self.assertEqual(Category.objects.count(), 2)
+        self.assertEqual(Authors.objects.count(), 2)
+        poems = Book.objects.get(ISBN='9780000000011')
+        self.assertEqual(poems.price, Decimal('12.50'))
+        self.assertEqual(poems.category.category_name, 'Poetry')
+        self.assertEqual(set(poems.authors.values_list('author_name', flat=True)),
+                         {'Nizar Qabbani', 'Mahmoud Darwish'})
+        self.assertEqual(Book.objects.get(ISBN='9780000000028').publication_date, datetime.date(1995, 1, 2))
+
+        # re-import: same ISBN updates the book and replaces its authors
+        path = self.csv_file([['9780000000011', 'Poems', 'Adonis', 'Poetry', '15', '1990-05-01']])
+        out, _ = self.run_import(path)
+        self.assertIn('1 updated', out)
+        poems.refresh_from_db()
+        self.assertEqual(poems.price, Decimal('15.00'))
+        self.assertEqual(list(poems.authors.values_list('author_name', flat=True)), ['Adonis'])
+        self.assertEqual(Book.objects.count(), 2)
+
+        out, _ = self.run_import(path, on_conflict='skip')
+        self.assertIn('1 skipped', out)
+
+    def test_json_array_is_streamed_and_searchable(self):
+        from .catalog_import import iter_json_array
+        books = [{'ISBN': f'97800000010{n:02d}', 'title': f'Desert Journey {n}', 'authors': ['Sara Elias'],
+                  'price': '10.00', 'publication_date': '2001-02-03', 'description': 'sand'} for n in range(30)]
+        content = json.dumps(books)
+        self.assertEqual(list(iter_json_array(io.StringIO(content), chunk_size=7)), books)
+        self.run_import(self.write('.json', content), batch_size=8)
+        self.assertEqual(Book.objects.count(), 30)
+        self.assertEqual(Book.authors.through.objects.count(), 30)
+        self.assertEqual(Authors.objects.count(), 1)
+        response = self.client.get(reverse('books-search'), {'q': 'desert'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json())
+
+    def test_onix_products(self):
+        path = self.write('.xml', '''<?xml version="1.0" encoding="UTF-8"?>
+<ONIXMessage xmlns="http://ns.editeur.org/onix/3.0/reference" release="3.0">
+  <Header><Sender><SenderName>Press</SenderName></Sender></Header>
+  <Product>
+    <RecordReference>r1</RecordReference>
+    <ProductIdentifier><ProductIDType>15</ProductIDType><IDValue>9780000000042</IDValue></ProductIdentifier>
+    <DescriptiveDetail>
+      <TitleDetail><TitleType>01</TitleType>
+        <TitleElement><TitleElementLevel>01</TitleElementLevel><TitleText>The Prophet</TitleText></TitleElement>
+      </TitleDetail>
+      <Contributor><ContributorRole>A01</ContributorRole><PersonName>Khalil Gibran</PersonName></Contributor>
+      <Contributor><ContributorRole>B01</ContributorRole><PersonName>An Editor</PersonName></Contributor>
+      <Subject><SubjectSchemeIdentifier>10</SubjectSchemeIdentifier><SubjectHeadingText>Poetry</SubjectHeadingText></Subject>
+    </DescriptiveDetail>
+    <CollateralDetail><TextContent><TextType>03</TextType><Text>Prose poems.</Text></TextContent></CollateralDetail>
+    <PublishingDetail><PublishingDate><PublishingDateRole>01</PublishingDateRole><Date>19230901</Date></PublishingDate></PublishingDetail>
+    <ProductSupply><SupplyDetail><ProductAvailability>40</ProductAvailability>
+      <Price><PriceType>01</PriceType><PriceAmount>9.99</PriceAmount></Price></SupplyDetail></ProductSupply>
+  </Product>
+</ONIXMessage>''')
+        self.run_import(path)
+        book = Book.objects.get(ISBN='9780000000042')
+        self.assertEqual((book.title, book.description, book.price), ('The Prophet', 'Prose poems.', Decimal('9.99')))
+        self.assertEqual(book.publication_date, datetime.date(1923, 9, 1))
+        self.assertEqual(book.availability, 'out_of_stock')
+        self.assertEqual(book.category.category_name, 'Poetry')
+        self.assertEqual(list(book.authors.values_list('author_name', flat=True)), ['Khalil Gibran'])
+
+    def test_availability_of_tracked_stock_is_kept(self):
+        tracked = make_book(1, stock=0)
+        untracked = make_book(2)
+        rows = [{'ISBN': book.ISBN, 'title': book.title, 'price': '11.00', 'publication_date': '2020-01-01',
+                 'availability': 'in_stock' if book == tracked else 'out_of_stock'} for book in (tracked, untracked)]
+        self.run_import(self.write('.json', json.dumps(rows)))
+        tracked.refresh_from_db()
+        untracked.refresh_from_db()
+        self.assertEqual((tracked.price, tracked.stock, tracked.availability), (Decimal('11.00'), 0, 'out_of_stock'))
+        self.assertEqual((untracked.price, untracked.availability), (Decimal('11.00'), 'out_of_stock'))
+
+    def test_unknown_format(self):
+        with self.assertRaises(CommandError):
+            self.run_import(self.write('.txt', 'isbn'))
+
+
+class SalesCounterTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='sales@example.com', password='pass', first_name='S', last_name='A')
+        self.poetry = Category.objects.create(category_name='Poetry')
+        self.books = [make_book(n, price=10) for n in range(1, 5)]
+        Book.objects.filter(pk=self.books[0].pk).update(category=self.poetry)
+
+    def checkout(self, *quantities):
+        items = [{'book': book.pk, 'quantity': q} for book, q in zip(self.books, quantities) if q]
+        response = self.client.post(reverse('order-checkout'), {'user': self.user.pk, 'items': items}, format='json')
+        self.assertEqual(response.status_code, 201)
+        return Order.objects.get(pk=response.json()['order_id'])
+
+    def counters(self):
+        return [tuple(Book.objects.filter(pk=book.pk).values_list('units_sold', 'revenue').get()) for book in self.books]
+
+    def bestsellers(self, **params):
+        get_catalog_cache().clear()
+        response = self.client.get(reverse('books-bestsellers'), params)
+        self.assertEqual(response.status_code, 200)
+        return [(row['book_id'], row['units_sold']) for row in response.json()]
+
+    def test_counters_follow_lines_and_cancellation(self):
+        order = self.checkout(1, 3, 2, 0)
+        self.checkout(0, 1, 0, 0)
+        self.assertEqual([units for units, _ in self.counters()], [1, 4, 2, 0])
+        self.assertEqual(self.counters()[1][1], Decimal('40.00'))
+        self.assertEqual(BookSales.objects.get(book=self.books[1]).units, 4)
+
+        # lines edited, added and deleted one by one
+        item = OrderItem.objects.get(order=order, book=self.books[0])
+        item.quantity = 5
+        item.save()
+        OrderItem.objects.create(order=order, book=self.books[3], quantity=2, price=Decimal('7.50'))
+        OrderItem.objects.get(order=order, book=self.books[2]).delete()
+        self.assertEqual(self.counters(), [(5, Decimal('50.00')), (4, Decimal('40.00')),
+                                           (0, Decimal('0.00')), (2, Decimal('15.00'))])
+
+        response = self.client.put(reverse('order-detail', args=[order.pk]),
+                                   {'user': self.user.pk, 'total_price': '10.00', 'status': 'cancelled'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([units for units, _ in self.counters()], [0, 1, 0, 0])
+        order.refresh_from_db()
+        order.status = 'pending'
+        order.save()
+        self.assertEqual([units for units, _ in self.counters()], [5, 4, 0, 2])
+
+        # the incremental counters agree with a rebuild from the order items
+        def state():
+            return self.counters(), sorted(BookSales.objects.filter(units__gt=0).values_list('book_id', 'day', 'units'))
+        before = state()
+        call_command('rebuild_sales', stdout=io.StringIO())
+        self.assertEqual(state(), before)
+
+    def test_bestseller_rankings(self):
+        self.checkout(1, 3, 2, 0)
+        old = self.checkout(5, 0, 0, 0)
+        Order.objects.filter(pk=old.pk).update(order_date=timezone.now() - datetime.timedelta(days=10))
+        call_command('rebuild_sales', stdout=io.StringIO())
+        books = [book.pk for book in self.books]
+
+        self.assertEqual(self.bestsellers(), [(books[1], 3), (books[2], 2), (books[0], 1)])
+        self.assertEqual(self.bestsellers(window='month'), [(books[0], 6), (books[1], 3), (books[2], 2)])
+        self.assertEqual(self.bestsellers(window='all', limit=1), [(books[0], 6)])
+        self.assertEqual(self.bestsellers(category=self.poetry.pk), [(books[0], 1)])
+        response = self.client.get(reverse('books-bestsellers'), {'window': 'all', 'fields': 'title'})
+        self.assertEqual(set(response.json()[0]), {'title', 'rank', 'units_sold', 'revenue'})
+        self.assertEqual(response.json()[0]['revenue'], '60.00')
+        self.assertEqual(self.client.get(reverse('books-bestsellers'), {'window': 'decade'}).status_code, 400)
+        for limit in ('0', '-1', 'ten'):
+            with self.subTest(limit=limit):
+                response = self.client.get(reverse('books-bestsellers'), {'window': 'all', 'limit': limit})
+                self.assertEqual(response.status_code, 400)
+
+
+class BookFilterTests(TestCase):
+
+    def setUp(self):
+        self.poetry = Category.objects.create(category_name='Poetry')
+        self.history = Category.objects.create(category_name='History')
+        self.darwish = Authors.objects.create(author_name='Mahmoud Darwish')
+        self.gibran = Authors.objects.create(author_name='Khalil Gibran')
+        self.books = [
+            make_book(1, self.poetry, [self.darwish], price=12, publication_date=datetime.date(1990, 1, 1)),
+            make_book(2, self.poetry, [self.darwish, self.gibran], price=30, publication_date=datetime.date(2005, 6, 1)),
+            make_book(3, self.history, [self.gibran], price=8, availability='out_of_stock'),
+            make_book(4, self.history, [], price=20),
+        ]
+        Book.objects.filter(pk=self.books[1].pk).update(avg_rating=4.5)
+        Book.objects.filter(pk=self.books[3].pk).update(avg_rating=3)
+
+    def ids(self, **params):
+        response = self.client.get(reverse('books-list'), params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return [row['book_id'] for row in response.json()]
+
+    def test_filters(self):
+        b1, b2, b3, b4 = [book.pk for book in self.books]
+        self.assertEqual(self.ids(category=self.poetry.pk), [b2, b1])
+        self.assertEqual(self.ids(category=f'{self.poetry.pk},{self.history.pk}'), [b4, b3, b2, b1])
+        self.assertEqual(self.ids(author=f'{self.darwish.pk},{self.gibran.pk}'), [b3, b2, b1])
+        self.assertEqual(self.ids(availability='out_of_stock'), [b3])
+        self.assertEqual(self.ids(price_min='10', price_max='20'), [b4, b1])
+        self.assertEqual(self.ids(rating_min='3'), [b4, b2])
+        self.assertEqual(self.ids(published_after='2000-01-01', published_before='2010-01-01'), [b2])
+
+    def test_sorting_and_keyset_pages(self):
+        b1, b2, b3, b4 = [book.pk for book in self.books]
+        self.assertEqual(self.ids(sort='price'), [b3, b1, b4, b2])
+        self.assertEqual(self.ids(sort='-price'), [b2, b4, b1, b3])
+        self.assertEqual(self.ids(sort='rating', category=self.history.pk), [b4, b3])
+        first = self.client.get(reverse('books-list'), {'sort': 'price', 'page_size': 3}).json()
+        self.assertEqual([row['book_id'] for row in first['results']], [b3, b1, b4])
+        second = self.client.get(first['next']).json()
+        self.assertEqual([row['book_id'] for row in second['results']], [b2])
+
+    def test_sort_pages_through_ties_larger_than_the_offset_cutoff(self):
+        # one price and no rating for all: only the book_id in the cursor moves the pages forward
+        ids = sorted(bulk_books(1200, price=15))
+        self.assertGreater(len(ids), KeysetPagination.offset_cutoff)
+        only_these = {'price_min': '15', 'price_max': '15'}
+        for sort, expected in (('price', ids), ('rating', ids[::-1])):
+            with self.subTest(sort=sort):
+                seen, url, params = [], reverse('books-list'), {'sort': sort, 'page_size': 500, **only_these}
+                while url:
+                    page = self.client.get(url, params).json()
+                    seen += [row['book_id'] for row in page['results']]
+                    url, params = page['next'], None
+                    self.assertLessEqual(len(seen), len(ids))
+                self.assertEqual(seen, expected)
+
+    def test_invalid_parameters(self):
+        for params in ({'sort': 'title'}, {'category': 'poetry'}, {'price_min': 'cheap'}, {'price_max': 'NaN'},
+                       {'availability': 'soon'}, {'published_after': '2020-13-01'}):
+            with self.subTest(params):
+                self.assertEqual(self.client.get(reverse('books-list'), params).status_code, 400)
+
+    def test_common_combinations_use_their_index(self):
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            self.skipTest('plan check written for SQLite and PostgreSQL')
+        cases = [
+            ('', 'books_newest_idx'),
+            (f'category={self.poetry.pk}', 'books_category_newest_idx'),
+            (f'category={self.poetry.pk}&sort=price', 'books_category_price_idx'),
+            (f'category={self.poetry.pk}&sort=rating', 'books_category_rating_idx'),
+            ('availability=in_stock&sort=price', 'books_available_price_idx'),
+            ('published_after=2000-01-01&published_before=2000-12-31', 'books_published_idx'),
+        ]
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # a handful of rows would otherwise be read with a sequential scan
+                cursor.execute('SET LOCAL enable_seqscan = off')
+            for params, index in cases:
+                with self.subTest(params):
+                    books, ordering = filter_books(Book.objects.all(), QueryDict(params))
+                    self.assertIn(index, books.order_by(*ordering)[:50].explain())
+
+
+class InventoryTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='stock@example.com', password='pass', first_name='S', last_name='T')
+        self.book = make_book(1, price=10, stock=3)
+        self.untracked = make_book(2, price=10)
+
+    def post(self, name, **payload):
+        return self.client.post(reverse(name), {'user': self.user.pk, **payload}, format='json')
+
+    def checkout(self, quantity, book=None):
+        return self.post('order-checkout', items=[{'book': (book or self.book).pk, 'quantity': quantity}])
+
+    def stock(self):
+        self.book.refresh_from_db()
+        return self.book.stock
+
+    def test_checkout_takes_stock_without_overselling(self):
+        self.assertTrue(self.book.is_available)
+        self.assertEqual(self.checkout(2).status_code, 201)
+        self.assertEqual(self.stock(), 1)
+        response = self.checkout(2)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Out of stock', str(response.json()))
+        self.assertEqual((self.stock(), Order.objects.count()), (1, 1))
+        self.assertEqual(self.checkout(1).status_code, 201)
+        self.assertEqual(self.stock(), 0)
+        self.assertEqual(self.book.availability, 'out_of_stock')
+        self.assertFalse(self.book.is_available)
+        # books that don't track stock only go by availability
+        self.assertEqual(self.checkout(50, self.untracked).status_code, 201)
+        self.assertIsNone(Book.objects.get(pk=self.untracked.pk).stock)
+
+        # cancelling an order puts its lines back
+        order = Order.objects.filter(items__book=self.book).order_by('pk').first()
+        order.status = 'cancelled'
+        order.save()
+        self.assertEqual(self.stock(), 2)
+        self.assertEqual(self.book.availability, 'in_stock')
+
+    def test_reservation_holds_stock_until_checkout(self):
+        response = self.post('order-reservation', items=[{'book': self.book.pk, 'quantity': 3}])
+        self.assertEqual(response.status_code, 201)
+        reservation = response.json()['reservation_id']
+        self.assertEqual(response.json()['items'], [{'book': self.book.pk, 'quantity': 3}])
+        self.assertEqual(self.stock(), 0)
+        self.assertEqual(self.checkout(1).status_code, 400)
+
+        response = self.post('order-checkout', reservation=reservation)
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.json()['total_price'], '30.00')
+        self.assertEqual(self.stock(), 0)
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertEqual(self.post('order-checkout', reservation=reservation).status_code, 400)
+
+    def test_cancelled_and_expired_reservations_go_back_to_stock(self):
+        first = self.post('order-reservation', items=[{'book': self.book.pk, 'quantity': 2}]).json()
+        self.assertEqual(self.client.delete(reverse('order-reservation-detail', args=[first['reservation_id']])).status_code, 204)
+        self.assertEqual(self.stock(), 3)
+
+        second = self.post('order-reservation', items=[{'book': self.book.pk, 'quantity': 3}]).json()
+        StockReservation.objects.filter(pk=second['reservation_id']).update(
+            expires_at=timezone.now() - datetime.timedelta(seconds=1))
+        self.assertEqual(self.post('order-checkout', reservation=second['reservation_id']).status_code, 400)
+        # a checkout that finds the book short releases the expired reservation on the spot
+        self.assertEqual(self.checkout(2).status_code, 201)
+        self.assertEqual(self.stock(), 1)
+
+        third = self.post('order-reservation', items=[{'book': self.book.pk, 'quantity': 1}]).json()
+        StockReservation.objects.filter(pk=third['reservation_id']).update(expires_at=timezone.now())
+        call_command('release_reservations', stdout=io.StringIO())
+        self.assertEqual(self.stock(), 1)
+        self.assertFalse(StockReservation.objects.exists())
+
+
+    def test_order_and_item_endpoints_take_stock(self):
+        order = self.post('order-list', total_price='20.00').json()['order_id']
+
+        def line(method, quantity, pk=None, book=None):
+            payload = {'order': order, 'book': (book or self.book).pk, 'quantity': quantity, 'price': '10.00'}
+            if pk is None:
+                return self.client.post(reverse('orderItems-list'), payload, format='json')
+            return getattr(self.client, method)(reverse('orderItems-detail', args=[pk]), payload, format='json')
+
+        response = line('post', 2)
+        self.assertEqual(response.status_code, 201)
+        item = response.json()['order_item_id']
+        self.assertEqual(self.stock(), 1)
+        response = line('post', 2)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Out of stock', str(response.json()['quantity']))
+        self.assertEqual((self.stock(), OrderItem.objects.count()), (1, 1))
+        # an edited line takes or puts back the difference
+        self.assertEqual(line('put', 4, item).status_code, 400)
+        self.assertEqual(OrderItem.objects.get(pk=item).quantity, 2)
+        self.assertEqual(line('put', 3, item).status_code, 200)
+        self.assertEqual(self.stock(), 0)
+        self.assertEqual(line('put', 1, item).status_code, 200)
+        self.assertEqual(self.stock(), 2)
+        self.assertEqual(line('put', 5, item, self.untracked).status_code, 200)
+        self.assertEqual(self.stock(), 3)
+
+    def test_uncancelled_orders_take_their_stock_again(self):
+        self.assertEqual(self.checkout(2).status_code, 201)
+        order = Order.objects.get()
+        payload = {'user': self.user.pk, 'total_price': '20.00'}
+        url = reverse('order-detail', args=[order.pk])
+        self.assertEqual(self.client.put(url, {**payload, 'status': 'cancelled'}, format='json').status_code, 200)
+        self.assertEqual(self.stock(), 3)
+        # lines added while cancelled hold nothing
+        OrderItem.objects.create(order=order, book=self.book, quantity=1, price=10)
+        self.assertEqual(self.stock(), 3)
+        self.assertEqual(self.checkout(1).status_code, 201)
+
+        response = self.client.put(url, {**payload, 'status': 'pending'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Out of stock', str(response.json()['status']))
+        self.assertEqual((Order.objects.get(pk=order.pk).status, self.stock()), ('cancelled', 2))
+        self.assertEqual(self.client.post(reverse('books-stock', args=[self.book.pk]), {'quantity': 1},
+                                          format='json').status_code, 200)
+        self.assertEqual(self.client.put(url, {**payload, 'status': 'pending'}, format='json').status_code, 200)
+        self.assertEqual((self.stock(), self.book.availability), (0, 'out_of_stock'))
+
+    def test_deleted_lines_go_back_to_stock(self):
+        self.assertEqual(self.checkout(1).status_code, 201)
+        self.assertEqual(self.checkout(2).status_code, 201)
+        first, second = Order.objects.order_by('pk')
+        response = self.client.delete(reverse('orderItems-detail', args=[first.items.get().pk]))
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.stock(), 1)
+        # deleting an order deletes its lines
+        self.assertEqual(self.client.delete(reverse('order-detail', args=[second.pk])).status_code, 204)
+        self.assertEqual((self.stock(), self.book.availability), (3, 'in_stock'))
+
+        # a cancelled order's lines are already back
+        self.assertEqual(self.checkout(2).status_code, 201)
+        order = Order.objects.latest('pk')
+        order.status = 'cancelled'
+        order.save()
+        order.delete()
+        self.assertEqual(self.stock(), 3)
+
+    def test_catalog_edits_keep_the_stock(self):
+        stale = Book.objects.get(pk=self.book.pk)
+        self.assertEqual(self.checkout(3).status_code, 201)
+        serializer = BookSerializer(stale, data={'title': 'Renamed', 'stock': 99, 'availability': 'in_stock'},
+                                    partial=True)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        serializer.save()
+        self.assertEqual(self.stock(), 0)
+        self.assertEqual((self.book.title, self.book.availability), ('Renamed', 'out_of_stock'))
+
+    def test_restock(self):
+        def restock(quantity, book=None):
+            return self.client.post(reverse('books-stock', args=[(book or self.book).pk]), {'quantity': quantity},
+                                    format='json')
+
+        self.assertEqual(self.checkout(3).status_code, 201)
+        response = restock(2)
+        self.assertEqual(response.json(), {'book_id': self.book.pk, 'stock': 2, 'availability': 'in_stock'})
+        self.assertEqual(self.checkout(2).status_code, 201)
+        self.assertEqual(restock(-1).status_code, 400)
+        self.assertEqual(restock(0).status_code, 400)
+        self.assertEqual(restock(5).json()['stock'], 5)
+        self.assertEqual(restock(-5).json(), {'book_id': self.book.pk, 'stock': 0, 'availability': 'out_of_stock'})
+        self.assertEqual((self.stock(), self.book.availability), (0, 'out_of_stock'))
+        # an untracked book starts tracking from what arrives
+        self.assertEqual(restock(4, self.untracked).json()['stock'], 4)
+        self.assertEqual(self.checkout(5, self.untracked).status_code, 400)
+        self.assertEqual(self.client.post(reverse('books-stock', args=[999999]), {'quantity': 1},
+                                          format='json').status_code, 404)
+
+
+class InventoryConcurrencyTests(TransactionTestCase):
+    """Many parallel checkouts of the same books never sell more than the stock"""
+    buyers = 12
+    stock = 5
+
+    def test_parallel_checkouts_do_not_oversell(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from threading import Barrier
+        from django.db import connections
+
+        user = User.objects.create_user(email='rush@example.com', password='pass', first_name='R', last_name='U')
+        books = [make_book(n, price=10, stock=self.stock) for n in range(1, 3)]
+        barrier = Barrier(self.buyers)
+
+        def buy(n):
+            # half the carts list the books in the other order: locks are still taken in pk order
+            items = [{'book': book.pk, 'quantity': 1} for book in (books if n % 2 else books[::-1])]
+            # the test client's exception hook is process wide: take the 500s as responses instead
+            client = APIClient(raise_request_exception=False)
+            barrier.wait()
+            try:
+                for _ in range(500):
+                    status = client.post(reverse('order-checkout'), {'user': user.pk, 'items': items},
+                                         format='json').status_code
+                    if status != 500:
+                        return status
+                    # the SQLite test database refuses a concurrent writer ("table is locked")
+                    # instead of waiting: retry like a client would
+                    time.sleep(0.005)
+            finally:
+                connections.close_all()
+
+        with mock.patch.object(logging.getLogger('django.request'), 'disabled', True):
+            with ThreadPoolExecutor(self.buyers) as pool:
+                statuses = list(pool.map(buy, range(self.buyers)))
+
+        sold = statuses.count(201)
+        self.assertEqual(sorted(statuses), [201] * self.stock + [400] * (self.buyers - self.stock))
+        self.assertEqual(Order.objects.count(), sold)
+        for book in books:
+            book.refresh_from_db()
+            self.assertEqual((book.stock, book.availability), (0, 'out_of_stock'))
+            self.assertEqual(OrderItem.objects.filter(book=book).count(), sold)
+
+
+class IdempotencyTests(TestCase):
+    """Retries with the same Idempotency-Key replay the first response instead of writing again"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='retry@example.com', password='pass', first_name='R', last_name='T')
+        self.book = make_book(1, price=10, stock=5)
+
+    def post(self, name, payload, key='key-1'):
+        return self.client.post(reverse(name), payload, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def checkout(self, quantity=1, key='key-1'):
+        return self.post('order-checkout', {'user': self.user.pk, 'items': [{'book': self.book.pk, 'quantity': quantity}]},
+                         key=key)
+
+    def test_retried_checkout_is_replayed(self):
+        first = self.checkout()
+        self.assertEqual(first.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', first.headers)
+        # the INSERT of the key fails (in a savepoint here), SELECT it: none of the checkout work runs again
+        with self.assertNumQueries(5):
+            retry = self.checkout()
+        self.assertEqual((retry.status_code, retry.json()), (201, first.json()))
+        self.assertEqual(retry.headers['Idempotent-Replayed'], 'true')
+        self.book.refresh_from_db()
+        self.assertEqual((Order.objects.count(), self.book.stock, self.book.units_sold), (1, 4, 1))
+        # another key is another checkout
+        self.assertEqual(self.checkout(key='key-2').status_code, 201)
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_retried_review_does_not_hit_the_unique_constraint(self):
+        payload = {'user': self.user.pk, 'book': self.book.pk, 'rating': 4, 'review_text': 'good'}
+        self.assertEqual(self.post('review-list', payload).status_code, 201)
+        self.assertEqual(self.post('review-list', payload).status_code, 201)
+        self.book.refresh_from_db()
+        self.assertEqual((Review.objects.count(), self.book.total_reviews), (1, 1))
+        # without a key the retry is a second review of the same book
+        self.assertEqual(self.client.post(reverse('review-list'), payload, format='json').status_code, 400)
+
+    def test_key_reused_for_another_payload_is_refused(self):
+        self.checkout(1)
+        response = self.checkout(2)
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Order.objects.count(), 1)
+        # keys are scoped to the route
+        order = self.post('order-list', {'user': self.user.pk, 'total_price': '5.00', 'status': 'pending'})
+        self.assertEqual(order.status_code, 201)
+
+    def test_errors_are_replayed_but_server_errors_are_not_stored(self):
+        self.assertEqual(self.checkout(quantity=0).status_code, 400)
+        self.assertEqual(self.checkout(quantity=0).headers['Idempotent-Replayed'], 'true')
+        # raised errors (out of stock) roll the key back with the rest: the retry runs again
+        self.assertEqual(self.checkout(quantity=9, key='key-3').status_code, 400)
+        self.assertFalse(IdempotencyKey.objects.filter(key='key-3').exists())
+        with mock.patch('api.views.CheckoutSerializer.save', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.checkout(key='key-2')
+        self.assertFalse(IdempotencyKey.objects.filter(key='key-2').exists())
+        self.assertEqual(self.checkout(key='key-2').status_code, 201)
+
+    def test_expired_keys_run_again_and_are_purged(self):
+        with override_settings(IDEMPOTENCY_KEY_SECONDS=0):
+            self.checkout()
+            self.checkout(key='key-2')
+        self.assertEqual(self.checkout().status_code, 201)
+        self.assertEqual(Order.objects.count(), 3)
+        call_command('purge_idempotency_keys', stdout=io.StringIO())
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['key-1'])
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ThrottleTests(TestCase):
+    """Rate limits answer 429 before any password hashing or write happens"""
+
+    def setUp(self):
+        get_throttle_cache().clear()
+        self.client = APIClient()
+        User.objects.create_user(email='limit@example.com', password='right-password', first_name='L', last_name='M')
+
+    def login(self, email='limit@example.com', password='wrong-password', ip='10.0.0.1'):
+        return self.client.post(reverse('login'), {'email': email, 'password': password}, format='json',
+                                REMOTE_ADDR=ip)
+
+    def register(self, n, ip='10.0.0.1'):
+        payload = {'first_name': 'N', 'last_name': 'U', 'email': f'new{n}@example.com',
+                   'password': 'secret-pass-1', 'password_confirm': 'secret-pass-1'}
+        return self.client.post(reverse('register-user'), payload, format='json', REMOTE_ADDR=ip)
+
+    @throttle_rates(login='100/min', login_email='3/min')
+    def test_login_is_limited_per_email_before_hashing(self):
+        self.assertEqual([self.login().status_code for _ in range(3)], [400] * 3)
+        with mock.patch('api.serializers.authenticate') as authenticate:
+            response = self.login(password='right-password', ip='10.0.0.2')
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response.headers['Retry-After']), 0)
+        authenticate.assert_not_called()
+        # the email is normalized, other accounts are not affected
+        self.assertEqual(self.login(email=' LIMIT@example.com').status_code, 429)
+        self.assertEqual(self.login(email='other@example.com').status_code, 400)
+        self.assertEqual(throttle_stats(['login_email'])['login_email'], {'allowed': 4, 'throttled': 2})
+
+    @throttle_rates(login='3/min', login_email='100/min')
+    def test_login_is_limited_per_ip(self):
+        statuses = [self.login(email=f'user{n}@example.com').status_code for n in range(4)]
+        self.assertEqual(statuses, [400, 400, 400, 429])
+        self.assertEqual(self.login(password='right-password', ip='10.0.0.2').status_code, 200)
+
+    @throttle_rates(register='2/hour')
+    def test_register_is_limited_per_ip(self):
+        self.assertEqual([self.register(n).status_code for n in range(3)], [201, 201, 429])
+        self.assertEqual(User.objects.filter(email__startswith='new').count(), 2)
+        self.assertEqual(self.register(3, ip='10.0.0.2').status_code, 201)
+
+    @throttle_rates(write='2/min')
+    def test_writes_are_limited_and_reads_are_not(self):
+        self.assertEqual([self.client.post(reverse('category-list'), {'category_name': f'C{n}'}, format='json')
+                          .status_code for n in range(3)], [201, 201, 429])
+        self.assertEqual(Category.objects.count(), 2)
+        self.assertEqual(self.client.get(reverse('category-list')).status_code, 200)
+
+    @throttle_rates(write='10/min')
+    def test_window_slides_over_the_previous_minute(self):
+        request = APIRequestFactory().post('/api/category/', REMOTE_ADDR='10.0.0.9')
+        request.user = None
+
+        def allowed_at(now, count):
+            with mock.patch('api.throttling.time.time', return_value=now):
+                return [WriteRateThrottle().allow_request(request, None) for _ in range(count)].count(True)
+
+        self.assertEqual(allowed_at(6000 + 50, 12), 10)
+        # half way through the next minute half of the previous one (12 counted) still weighs in
+        self.assertEqual(allowed_at(6060 + 30, 10), 4)
+        # at the end of the minute after, the 10 attempts of that half weigh 10/60 of a request
+        self.assertEqual(allowed_at(6120 + 59, 10), 9)
+
+
+class OrderArchiveTests(TestCase):
+    """Closed old orders move to the archive tables; lists stay hot, history and sales keep them"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='old@example.com', password='pass', first_name='O', last_name='L')
+        self.books = [make_book(n, price=10) for n in range(1, 3)]
+
+    def order(self, status, days_ago, quantity=1):
+        response = self.client.post(reverse('order-checkout'), {
+            'user': self.user.pk, 'items': [{'book': book.pk, 'quantity': quantity} for book in self.books],
+        }, format='json')
+        order = Order.objects.get(pk=response.json()['order_id'])
+        order.status = status
+        order.save()
+        Order.objects.filter(pk=order.pk).update(order_date=timezone.now() - datetime.timedelta(days=days_ago))
+        return order.pk
+
+    def archive(self, months=6, **options):
+        call_command('archive_orders', months=months, stdout=io.StringIO(), **options)
+
+    def sales(self):
+        return list(Book.objects.order_by('pk').values_list('units_sold', 'revenue'))
+
+    def test_closed_old_orders_move_with_their_lines(self):
+        delivered = self.order('delivered', 400, quantity=2)
+        cancelled = self.order('cancelled', 300)
+        pending = self.order('pending', 400)
+        recent = self.order('delivered', 10)
+        sales = self.sales()
+        self.archive(batch_size=1)
+
+        self.assertEqual(sorted(Order.objects.values_list('pk', flat=True)), [pending, recent])
+        self.assertEqual(sorted(ArchivedOrder.objects.values_list('pk', 'status')),
+                         [(delivered, 'delivered'), (cancelled, 'cancelled')])
+        self.assertEqual(OrderItem.objects.filter(order_id__in=[delivered, cancelled]).count(), 0)
+        lines = ArchivedOrderItem.objects.filter(order_id=delivered)
+        self.assertEqual(sorted(lines.values_list('book_id', 'quantity')), [(self.books[0].pk, 2), (self.books[1].pk, 2)])
+        self.assertEqual(lines.first().order_date, ArchivedOrder.objects.get(pk=delivered).order_date)
+        # archived lines still count as sales, also after a rebuild from the items
+        self.assertEqual(self.sales(), sales)
+        call_command('rebuild_sales', stdout=io.StringIO())
+        self.assertEqual(self.sales(), sales)
+        self.assertEqual(BookSales.objects.filter(book=self.books[0]).aggregate(total=Sum('units'))['total'], 2 + 1 + 1)
+
+    def test_recent_lists_are_hot_and_history_stays_readable(self):
+        archived = self.order('delivered', 400)
+        hot = self.order('shipped', 400)
+        self.archive()
+        orders = self.client.get(reverse('order-list')).json()
+        self.assertEqual([order['order_id'] for order in orders], [hot])
+        history = self.client.get(reverse('order-list'), {'archived': 'true'}).json()
+        self.assertEqual([(order['order_id'], order['status']) for order in history], [(archived, 'delivered')])
+
+        detail = self.client.get(reverse('order-detail', args=[archived]))
+        self.assertEqual((detail.status_code, detail.json()['total_price']), (200, '20.00'))
+        line = ArchivedOrderItem.objects.filter(order_id=archived).first()
+        self.assertEqual(self.client.get(reverse('orderItems-detail', args=[line.pk])).json()['order'], archived)
+        self.assertEqual(self.client.put(reverse('order-detail', args=[archived]), {}, format='json').status_code, 404)
+
+        # the export merges both sides in order_date order
+        export = self.client.get(reverse('order-export'))
+        rows = [json.loads(line) for line in b''.join(export.streaming_content).splitlines()]
+        self.assertEqual(sorted({row['order_id'] for row in rows}), sorted([archived, hot]))
+        self.assertEqual([row['order_date'] for row in rows], sorted(row['order_date'] for row in rows))
+
+    def test_deleting_the_user_deletes_the_archive(self):
+        self.order('delivered', 400)
+        self.archive()
+        self.user.delete()
+        self.assertFalse(ArchivedOrder.objects.exists())
+        self.assertFalse(ArchivedOrderItem.objects.exists())
+
+
+class SalesRollupTests(TestCase):
+    """Rollups per day x category x status follow every write and match a rebuild"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='report@example.com', password='pass', first_name='R', last_name='E')
+        self.poetry = Category.objects.create(category_name='Poetry')
+        self.novels = Category.objects.create(category_name='Novels')
+        self.books = [make_book(1, self.poetry, price=10), make_book(2, self.novels, price=5), make_book(3, price=2)]
+
+    def checkout(self, *quantities):
+        items = [{'book': book.pk, 'quantity': q} for book, q in zip(self.books, quantities) if q]
+        response = self.client.post(reverse('order-checkout'), {'user': self.user.pk, 'items': items}, format='json')
+        return Order.objects.get(pk=response.json()['order_id'])
+
+    def rollups(self):
+        return sorted(SalesRollup.objects.filter(lines__gt=0)
+                      .values_list('category_id', 'status', 'lines', 'units', 'revenue'))
+
+    def report(self, **params):
+        response = self.client.get(reverse('reports-sales'), params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()['rows']
+
+    def test_rollups_follow_lines_and_status(self):
+        order = self.checkout(2, 1, 0)
+        self.checkout(1, 0, 3)
+        self.assertEqual(self.rollups(), [
+            (0, 'pending', 1, 3, Decimal('6.00')),
+            (self.poetry.pk, 'pending', 2, 3, Decimal('30.00')),
+            (self.novels.pk, 'pending', 1, 1, Decimal('5.00')),
+        ])
+        order.status = 'delivered'
+        order.save()
+        line = order.items.get(book=self.books[1])
+        line.quantity = 4
+        line.save()
+        order.items.get(book=self.books[0]).delete()
+        OrderItem.objects.create(order=order, book=self.books[2], quantity=1, price=2)
+        expected = [
+            (0, 'delivered', 1, 1, Decimal('2.00')),
+            (0, 'pending', 1, 3, Decimal('6.00')),
+            (self.poetry.pk, 'pending', 1, 1, Decimal('10.00')),
+            (self.novels.pk, 'delivered', 1, 4, Decimal('20.00')),
+        ]
+        self.assertEqual(self.rollups(), expected)
+        call_command('rebuild_sales_rollups', stdout=io.StringIO())
+        self.assertEqual(self.rollups(), expected)
+
+    def test_report_groups_and_filters(self):
+        self.checkout(1, 2, 0)
+        cancelled = self.checkout(1, 0, 1)
+        cancelled.status = 'cancelled'
+        cancelled.save()
+        today = str(timezone.localdate())
+        self.assertEqual(self.report(), [{'day': today, 'lines': 4, 'units': 5, 'revenue': '32.00'}])
+        by_status = self.report(group_by='status')
+        self.assertEqual([(row['status'], row['revenue']) for row in by_status],
+                         [('cancelled', '12.00'), ('pending', '20.00')])
+        rows = self.report(group_by='month,category', status='pending')
+        self.assertEqual([(row['category_name'], row['units'], row['revenue']) for row in rows],
+                         [('Poetry', 1, '10.00'), ('Novels', 2, '10.00')])
+        self.assertEqual(self.report(category=str(self.novels.pk))[0]['revenue'], '10.00')
+        # dashboards read the rollups only: no join over the order items
+        with self.assertNumQueries(2):
+            self.report(group_by='category')
+        for params in ({'group_by': 'day,month'}, {'group_by': 'book'}, {'from': 'soon'}, {'status': 'lost'}):
+            self.assertEqual(self.client.get(reverse('reports-sales'), params).status_code, 400)
@@ -0,0 +1,146 @@
+"""
+Rate limits for the expensive and the writing endpoints.
+
+- register: per client IP (every registration hashes a password);
+- login: per client IP and per email, so neither a burst from one address
+  nor a slow stuffing run spread over many addresses gets through;
+- write: every POST/PUT/PATCH/DELETE, per user (per IP when anonymous).
+
+Rates are REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'] ('30/min', '10/hour', ...);
+a scope missing from it is not limited. Throttles run in APIView.initial(),
+before the handler: a rejected login or registration costs a few cache
+operations and no password hash, and gets a 429 with Retry-After.
+
+Each limit is a sliding window approximated from two fixed-window counters
+in THROTTLE_CACHE_ALIAS: the current window's count plus the previous one's,
+weighted by how much of it still overlaps the sliding window. That is a
+fixed handful of cache operations per request (add + incr + get, and the
+stats counter), however high the rate, where DRF's SimpleRateThrottle
+reads and writes the whole list of request timestamps. incr is
+atomic on memcached/redis, so concurrent requests can't overshoot; rejected
+requests count too, so a client that keeps hammering stays limited. With a
+per-process cache (locmem) every worker counts for itself; point the alias
+at a shared cache in production.
+
+Allowed and throttled requests are counted per scope (stats(), manage.py
+throttle_stats) for monitoring.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.settings import api_settings
+from rest_framework.throttling import SimpleRateThrottle
+
+OUTCOMES = ('allowed', 'throttled')
+
+
+def get_cache():
+    return caches[getattr(settings, 'THROTTLE_CACHE_ALIAS', 'default')]
+
+
+def increment(cache, key, timeout):
+    cache.add(key, 0, timeout)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # expired between add() and incr()
+        cache.set(key, 1, timeout)
+        return 1
+
+
+def stats_key(scope, outcome):
+    return f'throttle:stats:{scope}:{outcome}'
+
+
+def count(scope, outcome):
+    increment(get_cache(), stats_key(scope, outcome), None)
+
+
+def stats(scopes=None):
+    """{scope: {'allowed': n, 'throttled': n}} since the counters were last reset"""
+    scopes = scopes or sorted(api_settings.DEFAULT_THROTTLE_RATES)
+    values = get_cache().get_many([stats_key(scope, outcome) for scope in scopes for outcome in OUTCOMES])
+    return {scope: {outcome: values.get(stats_key(scope, outcome), 0) for outcome in OUTCOMES} for scope in scopes}
+
+
+def reset_stats(scopes=None):
+    scopes = scopes or sorted(api_settings.DEFAULT_THROTTLE_RATES)
+    get_cache().delete_many([stats_key(scope, outcome) for scope in scopes for outcome in OUTCOMES])
+
+
+class SlidingWindowThrottle(SimpleRateThrottle):
+    """SimpleRateThrottle's rates and idents on two window counters instead of a timestamp list"""
+
+    def __init__(self):
+        # the rate is looked up per request (SimpleRateThrottle reads it once at import)
+        self.rate = self.get_rate()
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+
+    def get_rate(self):
+        return api_settings.DEFAULT_THROTTLE_RATES.get(self.scope)
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        ident = self.get_cache_key(request, view)
+        if ident is None:
+            return True
+        now = time.time()
+        window = int(now // self.duration)
+        self.elapsed = now - window * self.duration
+        cache = get_cache()
+        self.current = increment(cache, self.cache_format % {'scope': self.scope, 'ident': f'{ident}:{window}'},
+                                 2 * self.duration)
+        self.previous = cache.get(self.cache_format % {'scope': self.scope, 'ident': f'{ident}:{window - 1}'}, 0)
+        allowed = self.previous * (1 - self.elapsed / self.duration) + self.current <= self.num_requests
+        count(self.scope, 'allowed' if allowed else 'throttled')
+        return allowed
+
+    def wait(self):
+        if self.current > self.num_requests or not self.previous:
+            return self.duration - self.elapsed
+        # until enough of the previous window has slid out
+        overlap = (self.num_requests - self.current) / self.previous
+        return max(self.duration * (1 - overlap) - self.elapsed, 0)
+
+
+class RegisterRateThrottle(SlidingWindowThrottle):
+    scope = 'register'
+
+    def get_cache_key(self, request, view):
+        return self.get_ident(request)
+
+
+class LoginRateThrottle(SlidingWindowThrottle):
+    scope = 'login'
+
+    def get_cache_key(self, request, view):
+        return self.get_ident(request)
+
+
+class LoginEmailRateThrottle(SlidingWindowThrottle):
+    scope = 'login_email'
+
+    def get_cache_key(self, request, view):
+        email = request.data.get('email') if hasattr(request.data, 'get') else None
+        if not isinstance(email, str) or not email.strip():
+            return None
+        # hashed: cache keys can't hold arbitrary user input
+        return hashlib.sha256(email.strip().lower().encode()).hexdigest()
+
+
+class WriteRateThrottle(SlidingWindowThrottle):
+    scope = 'write'
+
+    def allow_request(self, request, view):
+        if request.method in SAFE_METHODS:
+            return True
+        return super().allow_request(request, view)
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return f'user-{request.user.pk}'
+        return f'ip-{self.get_ident(request)}'
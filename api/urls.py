@@ -1,6 +1,7 @@
 from django.urls import path
 
 from .views import *
+from . import async_views
 from django.conf import settings
 from django.conf.urls.static import static
 urlpatterns = [
@@ -14,13 +15,28 @@ urlpatterns = [
     path('authors/', AuthorsView.as_view(), name='authors-list'),
     path('authors/<int:pk>/', AuthorsDetailView.as_view(), name='authors-detail'),
     path('books/', BookView.as_view(), name='books-list'),
+    path('books/search/', BookSearchView.as_view(), name='books-search'),
+    path('books/bestsellers/', BestsellerView.as_view(), name='books-bestsellers'),
     path('books/<int:pk>/', BookDetailView.as_view(), name='books-detail'),
+    path('books/<int:pk>/stock/', BookStockView.as_view(), name='books-stock'),
     path('review/', ReviewView.as_view(), name='review-list'),
+    path('review/bulk/', ReviewBulkView.as_view(), name='review-bulk'),
     path('review/<int:pk>/', ReviewDetailView.as_view(), name='review-detail'),
     path('order/', OrderView.as_view(), name='order-list'),
+    path('order/checkout/', CheckoutView.as_view(), name='order-checkout'),
+    path('order/export/', OrderExportView.as_view(), name='order-export'),
+    path('order/reservations/', ReservationView.as_view(), name='order-reservation'),
+    path('order/reservations/<int:pk>/', ReservationDetailView.as_view(), name='order-reservation-detail'),
     path('order/<int:pk>/', OrderDetailView.as_view(), name='order-detail'),
     path('orderItems/', OrderItemView.as_view(), name='orderItems-list'),
     path('orderItems/<int:pk>/', OrderItemDetailView.as_view(), name='orderItems-detail'),
+    path('reports/sales/', SalesReportView.as_view(), name='reports-sales'),
+    # async catalog reads, for ASGI deployments (api/async_views.py)
+    path('async/category/', async_views.category_list, name='async-category-list'),
+    path('async/authors/', async_views.authors_list, name='async-authors-list'),
+    path('async/books/', async_views.book_list, name='async-books-list'),
+    path('async/books/<int:pk>/', async_views.book_detail, name='async-books-detail'),
+    path('async/books/<int:pk>/reviews/', async_views.book_reviews, name='async-book-reviews'),
 
             ]
 
@@ -1,3 +1,6 @@
+from decimal import Decimal
+
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from rest_framework.views import APIView
 from rest_framework.response import Response
@@ -5,7 +8,9 @@ from rest_framework.request import Request
 from rest_framework import status
 from drf_yasg.utils import swagger_auto_schema
 
-from .models import User, Category, Authors, Book, Review, Order, OrderItem
+from .models import (
+    User, Category, Authors, Book, Review, Order, OrderItem, ArchivedOrder, ArchivedOrderItem, StockReservation,
+)
 from .serializers import (
     UserSerializer,
     CategorySerializer,
@@ -13,28 +18,44 @@ from .serializers import (
     BookSerializer,
     BookListSerializer ,
     ReviewSerializer,
+    ReviewBulkSerializer,
     RegisterSerializer ,
     OrderSerializer,
-    OrderItemSerializer
+    OrderItemSerializer,
+    ArchivedOrderSerializer,
+    ArchivedOrderItemSerializer,
+    CheckoutSerializer,
+    ReservationSerializer,
+    RestockSerializer,
 )
+from . import exports, filters, inventory, reports, sales
+from .cache import cache_response
+from .conditional import conditional_detail, conditional_list
+from .idempotency import idempotent
+from .pagination import KeysetPaginatedMixin
+from .search import search_books
+from .throttling import LoginEmailRateThrottle, LoginRateThrottle, RegisterRateThrottle
+from .sparse import project, sparse_context
 
 class Register( APIView ) :
+    throttle_classes = [RegisterRateThrottle]
+
     @swagger_auto_schema(request_body=RegisterSerializer)
     def post( self , request : Request ) :
-        serializer = RegisterSerializer( data = request.data )
+        serializer = RegisterSerializer(data = request.data, context=sparse_context(request))
         if serializer.is_valid() :
             serializer.save()
             return Response( data = serializer.data , status = status.HTTP_201_CREATED )
         return Response( data = serializer.errors , status = status.HTTP_400_BAD_REQUEST )
 
-class UserView(APIView):
+class UserView(KeysetPaginatedMixin, APIView):
+ ordering = ('id',)
  def get(self,request):
     users=User.objects.all()
-    serializer=UserSerializer(users,many=True)
-    return Response(serializer.data)
+    return self.list_response(request, users, UserSerializer)
 @swagger_auto_schema(request_body=UserSerializer)
 def post(self,request):
-    serializer=UserSerializer(data=request.data)
+    serializer=UserSerializer(data=request.data, context=sparse_context(request))
     if serializer.is_valid():
         serializer.save()
         return Response(serializer.data,status=status.HTTP_201_CREATED)
@@ -50,16 +71,17 @@ class UserDetailView(APIView):
             return None
 
   def get(self,request,pk):
-      user=self.get_object(pk)
+      context = sparse_context(request)
+      user = project(User.objects.all(), UserSerializer, context).filter(pk=pk).first()
       if user:
-            serializer = UserSerializer(user)
+            serializer = UserSerializer(user, context=context)
             return Response(serializer.data)
       return Response({"error": "User not found"},status=status.HTTP_404_NOT_FOUND)
   @swagger_auto_schema(request_body=UserSerializer)
   def put(self, request, pk):
         user = self.get_object(pk)
         if user:
-            serializer = UserSerializer(user, data=request.data)
+            serializer = UserSerializer(user, data=request.data, context=sparse_context(request))
             if serializer.is_valid():
                 serializer.save()
                 return Response(serializer.data)
@@ -75,14 +97,17 @@ class UserDetailView(APIView):
 
 ######################################################################################
 class CategoryView(APIView):
+    @conditional_list(Category, 'categories')
+    @cache_response('categories')
     def get(self, request):
-        categories = Category.objects.all()
-        serializer = CategorySerializer(categories, many=True)
+        context = sparse_context(request)
+        categories = project(Category.objects.all(), CategorySerializer, context)
+        serializer = CategorySerializer(categories, many=True, context=context)
         return Response(serializer.data)
     @swagger_auto_schema(request_body=CategorySerializer)
 
     def post(self, request):
-        serializer = CategorySerializer(data=request.data)
+        serializer = CategorySerializer(data=request.data, context=sparse_context(request))
         if serializer.is_valid():
             serializer.save()
             return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -94,13 +119,14 @@ class CategoryDetailView(APIView):
         return get_object_or_404(Category, pk=pk)
 
     def get(self, request, pk):
-        category = self.get_object(pk)
-        serializer = CategorySerializer(category)
+        context = sparse_context(request)
+        category = get_object_or_404(project(Category.objects.all(), CategorySerializer, context), pk=pk)
+        serializer = CategorySerializer(category, context=context)
         return Response(serializer.data)
     @swagger_auto_schema(request_body=CategorySerializer)
     def put(self, request, pk):
         category = self.get_object(pk)
-        serializer = CategorySerializer(category, data=request.data)
+        serializer = CategorySerializer(category, data=request.data, context=sparse_context(request))
         if serializer.is_valid():
             serializer.save()
             return Response(serializer.data)
@@ -114,13 +140,16 @@ class CategoryDetailView(APIView):
 
 #########################################################################################################
 class AuthorsView(APIView):
+    @conditional_list(Authors, 'authors')
+    @cache_response('authors')
     def get(self,request):
-        authors=Authors.objects.all()
-        serializer=AuthorsSerializer(authors,many=True)
+        context = sparse_context(request)
+        authors=project(Authors.objects.all(), AuthorsSerializer, context)
+        serializer=AuthorsSerializer(authors,many=True, context=context)
         return Response(serializer.data)
     @swagger_auto_schema(request_body=AuthorsSerializer)
     def post(self,request):
-          serializer=AuthorsSerializer(data=request.data)
+          serializer=AuthorsSerializer(data=request.data, context=sparse_context(request))
           if serializer.is_valid():
                 serializer.save()
                 return Response(serializer.data,status=status.HTTP_201_CREATED)
@@ -130,12 +159,13 @@ class AuthorsDetailView(APIView):
     def get_object(self,pk):
         return get_object_or_404(Authors,pk=pk)
     def get(self,request,pk):
-        authors=self.get_object(pk)
-        serializer=AuthorsSerializer(authors)
+        context = sparse_context(request)
+        authors=get_object_or_404(project(Authors.objects.all(), AuthorsSerializer, context), pk=pk)
+        serializer=AuthorsSerializer(authors, context=context)
         return Response(serializer.data)
     def put(self,request,pk):
         authors=self.get_object(pk)
-        serializer=AuthorsSerializer(authors,data=request.data)
+        serializer=AuthorsSerializer(authors,data=request.data, context=sparse_context(request))
         if serializer.is_valid():
             serializer.save()
             return Response(serializer.data)
@@ -146,31 +176,88 @@ class AuthorsDetailView(APIView):
         return Response({'message': 'Author deleted successfully'}, status=status.HTTP_204_NO_CONTENT)
     ############################################################################################
 
-class BookView(APIView):
+# GET filters and ?sort= are listed in api/filters.py
+class BookView(KeysetPaginatedMixin, APIView):
+    ordering = filters.SORTS[filters.DEFAULT_SORT]
+
+    @conditional_list(Book, 'books')
+    @cache_response('books')
     def get(self, request):
-        books = Book.objects.all()
-        serializer = BookListSerializer(books, many=True)
-        return Response(serializer.data)
+        try:
+            books, ordering = filters.filter_books(Book.objects.with_related(), request.query_params)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return self.list_response(request, books, BookListSerializer, ordering=ordering)
 
     def post(self, request):
-        serializer = BookSerializer(data=request.data)
+        serializer = BookSerializer(data=request.data, context=sparse_context(request))
         if serializer.is_valid():
             serializer.save()
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+# GET ?q=<text>&limit=<n>, books ranked by relevance
+class BookSearchView(APIView):
+    max_limit = 100
+
+    def get(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'error': 'q is required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = int(request.query_params.get('limit', 20))
+        except ValueError:
+            return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        if limit < 1:
+            return Response({'error': 'limit must be at least 1'}, status=status.HTTP_400_BAD_REQUEST)
+        book_ids = search_books(query, min(limit, self.max_limit))
+        context = sparse_context(request)
+        books = project(Book.objects.with_related(), BookListSerializer, context).in_bulk(book_ids)
+        serializer = BookListSerializer([books[pk] for pk in book_ids if pk in books], many=True, context=context)
+        return Response(serializer.data)
+# GET ?window=day|week|month|year|all&category=<id>&limit=<n>, books ranked by units sold
+class BestsellerView(APIView):
+    max_limit = 100
+
+    @cache_response('bestsellers', also=('books',), timeout=sales.RANKING_CACHE_TIMEOUT)
+    def get(self, request):
+        window = request.query_params.get('window', 'week')
+        if window not in sales.WINDOWS:
+            return Response({'error': f'window must be one of {", ".join(sales.WINDOWS)}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            category = request.query_params.get('category')
+            category = int(category) if category else None
+            limit = int(request.query_params.get('limit', 20))
+        except ValueError:
+            return Response({'error': 'category and limit must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+        if limit < 1:
+            return Response({'error': 'limit must be at least 1'}, status=status.HTTP_400_BAD_REQUEST)
+        limit = min(limit, self.max_limit)
+        ranking = sales.bestsellers(window, category, limit)
+        context = sparse_context(request)
+        books = project(Book.objects.with_related(), BookListSerializer, context).in_bulk([row[0] for row in ranking])
+        ranking = [row for row in ranking if row[0] in books]
+        data = BookListSerializer([books[book_id] for book_id, _, _ in ranking], many=True, context=context).data
+        for rank, (book, (_, units, revenue)) in enumerate(zip(data, ranking), 1):
+            book.update(rank=rank, units_sold=units, revenue=f'{Decimal(revenue):.2f}')
+        return Response(data)
+
 #GET/PUT/DEL
 class BookDetailView(APIView):
     def get_object(self, pk):
-        return get_object_or_404(Book, pk=pk)
+        return get_object_or_404(Book.objects.with_related(), pk=pk)
 
+    @conditional_detail(Book, 'book')
+    @cache_response('book', detail=True)
     def get(self, request, pk):
-        book = self.get_object(pk)
-        serializer = BookSerializer(book)
+        context = sparse_context(request)
+        book = get_object_or_404(project(Book.objects.with_related(), BookSerializer, context), pk=pk)
+        serializer = BookSerializer(book, context=context)
         return Response(serializer.data)
 
     def put(self, request, pk):
         book = self.get_object(pk)
-        serializer = BookSerializer(book, data=request.data)
+        serializer = BookSerializer(book, data=request.data, context=sparse_context(request))
         if serializer.is_valid():
             serializer.save()
             return Response(serializer.data)
@@ -180,33 +267,71 @@ class BookDetailView(APIView):
         book = self.get_object(pk)
         book.delete()
         return Response({'message': 'Book deleted successfully'}, status=status.HTTP_204_NO_CONTENT)
+
+# POST {"quantity": n}: n copies arrive (or are written off, n < 0); stock is read-only everywhere else
+class BookStockView(APIView):
+    @swagger_auto_schema(request_body=RestockSerializer)
+    @idempotent
+    def post(self, request, pk):
+        serializer = RestockSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            stock = inventory.restock(pk, serializer.validated_data['quantity'])
+        except inventory.InsufficientStock as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if stock is None:
+            return Response({'error': 'Book not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'book_id': pk, 'stock': stock, 'availability': 'in_stock' if stock > 0 else 'out_of_stock'})
 ###################################################################################################
-class ReviewView(APIView):
+class ReviewView(KeysetPaginatedMixin, APIView):
+    ordering = ('-review_id',)
+
     def get(self, request):
         reviews = Review.objects.all()
-        serializer = ReviewSerializer(reviews, many=True)
-        return Response(serializer.data)
+        return self.list_response(request, reviews, ReviewSerializer)
 
+    @idempotent
     def post(self, request):
-        serializer = ReviewSerializer(data=request.data)
+        serializer = ReviewSerializer(data=request.data, context=sparse_context(request))
         if serializer.is_valid():
             serializer.save()
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+# POST a list of reviews, ?on_conflict=skip|update for existing (user, book) pairs
+class ReviewBulkView(APIView):
+    max_batch_size = 20000
+
+    @swagger_auto_schema(request_body=ReviewBulkSerializer(many=True))
+    @idempotent
+    def post(self, request):
+        on_conflict = request.query_params.get('on_conflict', 'skip')
+        if on_conflict not in ReviewBulkSerializer.Meta.list_serializer_class.CONFLICT_POLICIES:
+            return Response({'error': 'on_conflict must be skip or update'}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = ReviewBulkSerializer(
+            data=request.data, many=True, max_length=self.max_batch_size,
+            context={'on_conflict': on_conflict},
+        )
+        if serializer.is_valid():
+            serializer.save()
+            return Response(serializer.stats, status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
 #GET/PUT/DEL
 class ReviewDetailView(APIView):
     def get_object(self, pk):
         return get_object_or_404(Review, pk=pk)
 
     def get(self, request, pk):
-        review = self.get_object(pk)
-        serializer = ReviewSerializer(review)
+        context = sparse_context(request)
+        review = get_object_or_404(project(Review.objects.all(), ReviewSerializer, context), pk=pk)
+        serializer = ReviewSerializer(review, context=context)
         return Response(serializer.data)
 
     def put(self, request, pk):
         review = self.get_object(pk)
-        serializer = ReviewSerializer(review, data=request.data)
+        serializer = ReviewSerializer(review, data=request.data, context=sparse_context(request))
         if serializer.is_valid():
             serializer.save()
             return Response(serializer.data)
@@ -218,31 +343,119 @@ class ReviewDetailView(APIView):
         return Response({'message': 'Review deleted successfully'}, status=status.HTTP_204_NO_CONTENT)
 
 ######################################################################################################
-class OrderView(APIView):
+# GET lists the hot orders only, ?archived=true the archived ones (api/archive.py)
+class OrderView(KeysetPaginatedMixin, APIView):
+    ordering = ('-order_date', '-order_id')
+
     def get(self, request):
+        if request.query_params.get('archived') == 'true':
+            return self.list_response(request, ArchivedOrder.objects.all(), ArchivedOrderSerializer)
         orders = Order.objects.all()
-        serializer = OrderSerializer(orders, many=True)
-        return Response(serializer.data)
+        return self.list_response(request, orders, OrderSerializer)
 
+    @idempotent
     def post(self, request):
-        serializer = OrderSerializer(data=request.data)
+        serializer = OrderSerializer(data=request.data, context=sparse_context(request))
         if serializer.is_valid():
             serializer.save()
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+# POST an order together with its lines: {"user": id, "items": [{"book": id, "quantity": n}, ...]}
+class CheckoutView(APIView):
+    @swagger_auto_schema(request_body=CheckoutSerializer)
+    @idempotent
+    def post(self, request):
+        serializer = CheckoutSerializer(data=request.data, context=sparse_context(request))
+        if serializer.is_valid():
+            serializer.save()
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+# POST {"user": id, "items": [{"book": id, "quantity": n}, ...]}: hold the stock for
+# STOCK_RESERVATION_SECONDS, then checkout with {"user": id, "reservation": id}
+class ReservationView(APIView):
+    @swagger_auto_schema(request_body=ReservationSerializer)
+    @idempotent
+    def post(self, request):
+        serializer = ReservationSerializer(data=request.data, context=sparse_context(request))
+        if serializer.is_valid():
+            serializer.save()
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+#GET/DEL, deleting puts the stock back
+class ReservationDetailView(APIView):
+    def get_object(self, pk):
+        return get_object_or_404(StockReservation, pk=pk)
+
+    def get(self, request, pk):
+        serializer = ReservationSerializer(self.get_object(pk), context=sparse_context(request))
+        return Response(serializer.data)
+
+    def delete(self, request, pk):
+        reservation = self.get_object(pk)
+        reservation.delete()
+        return Response({'message': 'Reservation released successfully'}, status=status.HTTP_204_NO_CONTENT)
+
+# GET ?output=ndjson|csv&from=<date>&to=<date>&status=<s1,s2>, one line per order item
+class OrderExportView(APIView):
+    def get(self, request):
+        output = request.query_params.get('output', 'ndjson')
+        if output not in exports.FORMATS:
+            return Response({'error': 'output must be ndjson or csv'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            lines = exports.order_lines(
+                date_from=exports.parse_bound(request.query_params.get('from')),
+                date_to=exports.parse_bound(request.query_params.get('to'), end=True),
+                statuses=exports.parse_statuses(request.query_params.get('status')),
+            )
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        render, content_type = exports.RENDERERS[output]
+        response = StreamingHttpResponse(exports.stream(request, render(lines)), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="orders.{output}"'
+        return response
+
+# GET ?from=<date>&to=<date>&group_by=day|month,category,status&status=<s1,s2>&category=<id,...>
+# revenue, units and lines from the rollup table (api/reports.py), never from the order items
+class SalesReportView(APIView):
+    def get(self, request):
+        params = request.query_params
+        group_by = [name for name in params.get('group_by', 'day').split(',') if name]
+        if not set(group_by) <= set(reports.GROUPS) or {'day', 'month'} <= set(group_by):
+            return Response({'error': 'group_by takes day or month, category and status'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            date_from, date_to, rows = reports.sales_report(
+                date_from=filters.parse_day(params, 'from'),
+                date_to=filters.parse_day(params, 'to'),
+                group_by=group_by,
+                statuses=exports.parse_statuses(params.get('status')),
+                categories=filters.parse_ids(params, 'category'),
+            )
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        for row in rows:
+            row['revenue'] = f'{Decimal(row["revenue"]):.2f}'
+        return Response({'from': date_from, 'to': date_to, 'group_by': group_by, 'rows': rows})
+
 #GET/PUT/DEL
 class OrderDetailView(APIView):
     def get_object(self, pk):
         return get_object_or_404(Order, pk=pk)
 
     def get(self, request, pk):
-        order = self.get_object(pk)
-        serializer = OrderSerializer(order)
+        context = sparse_context(request)
+        order = project(Order.objects.all(), OrderSerializer, context).filter(pk=pk).first()
+        if order is None:
+            # not hot: maybe archived, PUT/DEL don't apply to those
+            order = get_object_or_404(project(ArchivedOrder.objects.all(), ArchivedOrderSerializer, context), pk=pk)
+            return Response(ArchivedOrderSerializer(order, context=context).data)
+        serializer = OrderSerializer(order, context=context)
         return Response(serializer.data)
 
     def put(self, request, pk):
         order = self.get_object(pk)
-        serializer = OrderSerializer(order, data=request.data)
+        serializer = OrderSerializer(order, data=request.data, context=sparse_context(request))
         if serializer.is_valid():
             serializer.save()
             return Response(serializer.data)
@@ -253,14 +466,16 @@ class OrderDetailView(APIView):
         order.delete()
         return Response({'message': 'Order deleted successfully'}, status=status.HTTP_204_NO_CONTENT)
 #####################################################################################################
-class OrderItemView(APIView):
+class OrderItemView(KeysetPaginatedMixin, APIView):
+    ordering = ('-order_item_id',)
+
     def get(self, request):
         items = OrderItem.objects.all()
-        serializer = OrderItemSerializer(items, many=True)
-        return Response(serializer.data)
+        return self.list_response(request, items, OrderItemSerializer)
 
+    @idempotent
     def post(self, request):
-        serializer = OrderItemSerializer(data=request.data)
+        serializer = OrderItemSerializer(data=request.data, context=sparse_context(request))
         if serializer.is_valid():
             serializer.save()
             return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -271,13 +486,18 @@ class OrderItemDetailView(APIView):
         return get_object_or_404(OrderItem, pk=pk)
 
     def get(self, request, pk):
-        item = self.get_object(pk)
-        serializer = OrderItemSerializer(item)
+        context = sparse_context(request)
+        item = project(OrderItem.objects.all(), OrderItemSerializer, context).filter(pk=pk).first()
+        if item is None:
+            item = get_object_or_404(project(ArchivedOrderItem.objects.all(), ArchivedOrderItemSerializer, context),
+                                     pk=pk)
+            return Response(ArchivedOrderItemSerializer(item, context=context).data)
+        serializer = OrderItemSerializer(item, context=context)
         return Response(serializer.data)
 
     def put(self, request, pk):
         item = self.get_object(pk)
-        serializer = OrderItemSerializer(item, data=request.data)
+        serializer = OrderItemSerializer(item, data=request.data, context=sparse_context(request))
         if serializer.is_valid():
             serializer.save()
             return Response(serializer.data)
@@ -293,6 +513,8 @@ from .serializers import CustomLoginSerializer
 
 class CustomLoginView(TokenObtainPairView):
     serializer_class = CustomLoginSerializer
+    # checked before the serializer runs: a throttled attempt costs no password hash
+    throttle_classes = [LoginRateThrottle, LoginEmailRateThrottle]
 
 
 
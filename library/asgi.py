@@ -3,6 +3,14 @@ ASGI config for library project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Served by gunicorn with uvicorn workers (see procfile):
+
+    gunicorn library.asgi:application -k uvicorn_worker.UvicornWorker
+
+The async catalog endpoints (api/async_views.py) run on the event loop; the
+sync DRF views still work, Django runs them in one thread per worker, so keep
+several workers (-w) for write traffic.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
@@ -44,7 +44,41 @@ INSTALLED_APPS = [
 ]
 AUTH_USER_MODEL = 'api.User'
 
+REST_FRAMEWORK = {
+    # JWT from /api/login/; read-only requests trust the token claims (api/authentication.py)
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'api.authentication.ClaimsJWTAuthentication',
+        'rest_framework.authentication.SessionAuthentication',
+    ],
+    # orjson encoding/decoding (api/renderers.py); drop these two to go back to the stdlib json
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'api.renderers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+    # api/throttling.py: register/login set their own throttles, every other write goes by 'write'
+    'DEFAULT_THROTTLE_CLASSES': [
+        'api.throttling.WriteRateThrottle',
+    ],
+    'DEFAULT_THROTTLE_RATES': {
+        'register': '10/hour',
+        'login': '30/min',
+        'login_email': '10/min',
+        'write': '120/min',
+    },
+    # proxies in front of the app: the client IP is read from X-Forwarded-For past them,
+    # 0 trusts only REMOTE_ADDR so a forged header can't dodge the per-IP limits
+    'NUM_PROXIES': 0,
+}
+JWT_USER_CACHE_TTL = 30  # seconds a loaded User row is reused by this process
+JWT_USER_CACHE_SIZE = 10000
+
 MIDDLEWARE = [
+    'api.middleware.QueryInstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -99,6 +133,60 @@ DATABASES= {
     'default':dj_database_url.parse(config('DATABASE_URL'))
 }
 
+# SQL instrumentation (api/middleware.py): max queries per URL name; 'warn' logs, 'fail' raises
+QUERY_BUDGETS = {
+    ('books-list', 'GET'): 3,
+    ('books-detail', 'GET'): 3,
+    ('books-search', 'GET'): 3,
+    ('books-bestsellers', 'GET'): 3,
+    ('authors-list', 'GET'): 2,
+    ('category-list', 'GET'): 2,
+    ('review-list', 'GET'): 2,
+    ('order-list', 'GET'): 2,
+    ('orderItems-list', 'GET'): 2,
+    # 11 for any cart, 15 with an Idempotency-Key, 21 when expired reservations are released first
+    ('order-checkout', 'POST'): 21,
+    ('reports-sales', 'GET'): 2,
+}
+QUERY_BUDGET_MODE = config('QUERY_BUDGET_MODE', default='warn')
+SQL_REPEAT_THRESHOLD = 5  # the same statement this many times in one request is logged as N+1
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        # INFO for one line per request, WARNING for budget / N+1 reports only
+        'api.sql': {'handlers': ['console'], 'level': config('SQL_LOG_LEVEL', default='WARNING'), 'propagate': False},
+    },
+}
+
+
+# Full-text search: one Postgres text search configuration per catalog language
+BOOK_SEARCH_CONFIGS = ['english', 'arabic']
+
+
+# Caches
+# 'catalog' holds serialized catalog GET responses (api/cache.py). Local memory is
+# per process: with several workers, point it at a shared backend (Redis,
+# Memcached) so that invalidations reach every worker. LocMemCache evicts the
+# least recently used entries once MAX_ENTRIES is reached.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'catalog': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'catalog',
+        'TIMEOUT': 300,
+        'OPTIONS': {'MAX_ENTRIES': 5000, 'CULL_FREQUENCY': 10},
+    },
+}
+CATALOG_CACHE_ALIAS = 'catalog'
+# rate limit counters (api/throttling.py); locmem counts per process, use a shared cache to limit across workers
+THROTTLE_CACHE_ALIAS = 'default'
 
 
 # Password validation
@@ -148,3 +236,15 @@ import os
 # Media files (uploads)
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# Resized cover / author photo copies (api/images.py), widths in pixels
+IMAGE_DERIVATIVE_SIZES = {'thumb': 120, 'small': 240, 'medium': 480}
+IMAGE_DERIVATIVE_FORMATS = ['avif', 'webp']  # formats this Pillow build can't encode are skipped
+IMAGE_DERIVATIVE_WORKERS = 2  # background threads per process, 0 = build inline after commit
+IMAGE_DERIVATIVES = True  # False: uploads get no derivatives (the test suite turns them off)
+
+# How long a stock reservation holds its books before expiring back to stock (api/inventory.py)
+STOCK_RESERVATION_SECONDS = config('STOCK_RESERVATION_SECONDS', default=600, cast=int)
+
+# How long the response of a write sent with an Idempotency-Key is replayed to retries (api/idempotency.py)
+IDEMPOTENCY_KEY_SECONDS = config('IDEMPOTENCY_KEY_SECONDS', default=86400, cast=int)